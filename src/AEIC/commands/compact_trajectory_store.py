@@ -0,0 +1,115 @@
+import dataclasses
+
+import click
+
+from AEIC.missions import Database, Query
+from AEIC.missions.query import QueryResult
+from AEIC.trajectories import StoragePolicy, TrajectoryStore
+
+MISSION_KEYS = [f.name for f in dataclasses.fields(QueryResult)]
+
+
+@click.command()
+@click.option(
+    '-a',
+    '--associated-file',
+    'associated_files',
+    type=click.Path(exists=True),
+    multiple=True,
+    help='Associated file to read with the input store (may be repeated).',
+)
+@click.option(
+    '-o',
+    '--associated-output',
+    'associated_outputs',
+    type=click.Path(),
+    multiple=True,
+    help='Output for the matching associated file (may be repeated).',
+)
+@click.option(
+    '-k',
+    '--key',
+    default='flight_id',
+    help='Sort key: a per-trajectory field of the store or, with --missions-db, '
+    'a mission database flight attribute (e.g. aircraft_type or departure).',
+)
+@click.option(
+    '-d',
+    '--missions-db',
+    type=click.Path(exists=True),
+    default=None,
+    help='Mission database to join the sort key from, by flight ID.',
+)
+@click.option(
+    '--layout',
+    type=click.Choice([str(layout) for layout in TrajectoryStore.Layout]),
+    default=None,
+    help='Storage layout for the output (default: same as input).',
+)
+@click.option(
+    '--storage-policy',
+    type=click.Choice(StoragePolicy.PRESETS),
+    default=None,
+    help='Storage policy preset for the output (default: same as input).',
+)
+@click.option(
+    '--shard-size',
+    type=int,
+    default=None,
+    help='Trajectories per NetCDF file for merged store (".aeic-store") output.',
+)
+@click.option(
+    '-j',
+    '--workers',
+    type=int,
+    default=1,
+    help='Worker processes for merged store (".aeic-store") output.',
+)
+@click.argument('input_store', type=click.Path(exists=True))
+@click.argument('output_store', type=click.Path())
+def run(
+    associated_files,
+    associated_outputs,
+    key,
+    missions_db,
+    layout,
+    storage_policy,
+    shard_size,
+    workers,
+    input_store,
+    output_store,
+):
+    """Rewrite a trajectory store with its trajectories sorted by a key.
+
+    The output is a merged store if OUTPUT_STORE ends with ".aeic-store" and a
+    single NetCDF file otherwise. Associated files given with -a are copied
+    only if an output is given for each of them with -o.
+    """
+    if missions_db is not None:
+        if key not in MISSION_KEYS:
+            raise click.UsageError(
+                f'Unknown mission database key "{key}" '
+                f'(choose from {", ".join(MISSION_KEYS)})'
+            )
+        with Database(missions_db) as db:
+            key = {r.id: getattr(r, key) for r in db(Query())}
+
+    with TrajectoryStore.open(
+        base_file=input_store, associated_files=list(associated_files)
+    ) as ts:
+        try:
+            ts.compact(
+                output_store,
+                key,
+                associated_files=list(associated_outputs) or None,
+                layout=layout,
+                storage_policy=storage_policy,
+                shard_size=shard_size,
+                n_workers=workers,
+            )
+        except ValueError as e:
+            raise click.UsageError(str(e))
+
+
+if __name__ == '__main__':
+    run()
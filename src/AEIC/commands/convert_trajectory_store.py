@@ -0,0 +1,59 @@
+import click
+
+from AEIC.trajectories import StoragePolicy, TrajectoryStore
+
+
+@click.command()
+@click.option(
+    '-a',
+    '--associated-file',
+    'associated_files',
+    type=click.Path(exists=True),
+    multiple=True,
+    help='Associated file to read with the input store (may be repeated).',
+)
+@click.option(
+    '--layout',
+    type=click.Choice([str(layout) for layout in TrajectoryStore.Layout]),
+    default=None,
+    help='Storage layout for NetCDF output (default: same as input).',
+)
+@click.option(
+    '--storage-policy',
+    type=click.Choice(StoragePolicy.PRESETS),
+    default=None,
+    help='Storage policy preset for NetCDF output (default: same as input).',
+)
+@click.option(
+    '--shard-size',
+    type=int,
+    default=None,
+    help='Trajectories per NetCDF file for merged store (".aeic-store") output.',
+)
+@click.argument('input_store', type=click.Path(exists=True))
+@click.argument('output_store', type=click.Path())
+def run(
+    associated_files, layout, storage_policy, shard_size, input_store, output_store
+):
+    """Convert a trajectory store between formats.
+
+    The output format is determined by the name of OUTPUT_STORE: a column
+    store for ".aeic-columns", a merged store for ".aeic-store" and a single
+    NetCDF file otherwise.
+    """
+    with TrajectoryStore.open(
+        base_file=input_store, associated_files=list(associated_files)
+    ) as ts:
+        try:
+            ts.export(
+                output_store,
+                layout=layout,
+                storage_policy=storage_policy,
+                shard_size=shard_size,
+            )
+        except ValueError as e:
+            raise click.UsageError(str(e))
+
+
+if __name__ == '__main__':
+    run()
@@ -2,18 +2,30 @@ from .dimensions import Dimension, Dimensions
 from .field_sets import FieldMetadata, FieldSet
 from .ground_track import GroundTrack
 from .phase import FlightPhase
-from .store import TrajectoryStore
-from .trajectory import BASE_FIELDS, BASE_FIELDSET_NAME, Trajectory
+from .storage_policy import FieldStorage, StoragePolicy
+from .store import (
+    CacheStats,
+    RaggedArray,
+    ShardedTrajectoryWriter,
+    TrajectoryStore,
+)
+from .trajectory import BASE_FIELDS, BASE_FIELDSET_NAME, LazyTrajectory, Trajectory
 
 __all__ = [
     'BASE_FIELDSET_NAME',
     'BASE_FIELDS',
+    'CacheStats',
     'Dimension',
     'Dimensions',
     'FieldMetadata',
     'FieldSet',
+    'FieldStorage',
     'FlightPhase',
     'GroundTrack',
+    'LazyTrajectory',
+    'RaggedArray',
+    'ShardedTrajectoryWriter',
+    'StoragePolicy',
     'Trajectory',
     'TrajectoryStore',
 ]
@@ -0,0 +1,335 @@
+"""Memory-mapped columnar storage for trajectory stores.
+
+A column store is a directory (with extension ".aeic-columns") holding one
+uncompressed little-endian `.npy` file per field, plus a JSON metadata file.
+Per-trajectory fields are stored as arrays indexed by trajectory. Pointwise
+fields are stored as the concatenation of the points of all trajectories (as
+in the ragged NetCDF storage layout), with a single array of offsets giving
+the position of the first point of each trajectory. All files are opened
+using `np.memmap`, so reading a field costs no more than touching the pages
+of the file that are needed, with no decompression or decoding.
+
+Column stores are read-only: they are written from an existing
+`TrajectoryStore` using `TrajectoryStore.export`, and opened using
+`TrajectoryStore.open` like any other store. To let the `TrajectoryStore`
+reading code work unchanged, the classes here present column files through
+the small subset of the interface of the netCDF4 `Dataset`, `Group`,
+`Dimension` and `Variable` classes that the reading code uses.
+"""
+
+# TODO: Remove this when we migrate to Python 3.14+.
+from __future__ import annotations
+
+import json
+from pathlib import Path
+from typing import Any
+
+import netCDF4 as nc4
+import numpy as np
+
+from AEIC.performance.types import ThrustMode
+
+from .dimensions import Dimension
+from .field_sets import FieldMetadata
+
+COLUMN_STORE_SUFFIX = '.aeic-columns'
+"""Directory name extension for column stores."""
+
+COLUMN_FORMAT_VERSION = 1
+"""Version number of the column store format, recorded in the metadata."""
+
+METADATA_FILE = 'metadata.json'
+OFFSETS_FILE = '_offsets.npy'
+INDEX_GROUP = '_index'
+
+
+def column_dtype(field_type: type) -> np.dtype:
+    """Data type used for column files for a numeric field type. (Column
+    files are always little-endian. Strings are stored as fixed width Unicode
+    arrays, with a width set by the longest string.)"""
+    return np.dtype(field_type).newbyteorder('<')
+
+
+def _load_column(path: Path) -> np.ndarray:
+    """Open a column file as a read-only memory map. (Empty arrays can't be
+    memory-mapped, so they're just read.)"""
+    try:
+        return np.load(path, mmap_mode='r')
+    except ValueError:
+        return np.load(path)
+
+
+def column_fill_value(field_type: type) -> Any:
+    """Fill value for missing values in a column file: the same as the NetCDF
+    default fill value, so that values read from NetCDF files can be copied
+    unchanged."""
+    if field_type is str:
+        return None
+    return nc4.default_fillvals[np.dtype(field_type).str[1:]]
+
+
+class ColumnVariable:
+    """A memory-mapped column file, looking like a NetCDF variable."""
+
+    def __init__(
+        self,
+        name: str,
+        data: np.ndarray,
+        dimensions: tuple[str, ...],
+        attributes: dict[str, Any] | None = None,
+        fill: Any = None,
+    ):
+        self.name = name
+        self.data = data
+        self.dimensions = dimensions
+        self.attributes = attributes or {}
+        self.fill = fill
+
+    @property
+    def dtype(self) -> Any:
+        # NetCDF string variables have Python str as their type.
+        return str if self.data.dtype.kind == 'U' else self.data.dtype
+
+    @property
+    def datatype(self) -> Any:
+        return self.dtype
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.data.shape
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __getitem__(self, key: Any) -> np.ndarray:
+        # Strings are returned as Python strings, as the netCDF4 package
+        # does. Everything else is a view of the memory-mapped file.
+        if self.data.dtype.kind == 'U':
+            return self.data[key].astype(object)
+        return np.asarray(self.data[key])
+
+    def set_auto_mask(self, flag: bool) -> None:
+        # Column files never produce masked arrays.
+        pass
+
+    def get_fill_value(self) -> Any:
+        return self.fill
+
+    def ncattrs(self) -> list[str]:
+        return list(self.attributes)
+
+    def getncattr(self, name: str) -> Any:
+        return self.attributes[name]
+
+
+class ColumnGroup:
+    """The column files for a field set, looking like a NetCDF group."""
+
+    def __init__(self, name: str, variables: dict[str, ColumnVariable]):
+        self.name = name
+        self.variables = variables
+
+
+class ColumnDimension:
+    """The trajectory dimension of a column store."""
+
+    def __init__(self, length: int):
+        self.length = length
+
+    def __len__(self) -> int:
+        return self.length
+
+
+class ColumnDataset:
+    """A column store directory, looking like a NetCDF dataset."""
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        metadata_file = self.path / METADATA_FILE
+        if not metadata_file.exists():
+            raise ValueError(f'Metadata file missing from column store "{self.path}"')
+        with open(metadata_file) as fp:
+            self.metadata = json.load(fp)
+        if self.metadata.get('format') != COLUMN_FORMAT_VERSION:
+            raise ValueError(
+                f'Unsupported column store format in "{self.path}": '
+                f'{self.metadata.get("format")}'
+            )
+
+        # Global attributes, in the same form as NetCDF global attributes.
+        self.length: int = self.metadata['length']
+        self.fieldset_names: list[str] = self.metadata['fieldset_names']
+        self.fieldset_hashes: list[str] = self.metadata['fieldset_hashes']
+        self.id_hash: str = self.metadata['id_hash']
+        self.layout: str = self.metadata['layout']
+        for k, v in self.metadata.get('attributes', {}).items():
+            setattr(self, k, v)
+        if 'storage_policy' in self.metadata:
+            self.storage_policy = self.metadata['storage_policy']
+
+        self.dimensions = {'trajectory': ColumnDimension(self.length)}
+        self.variables = {
+            'trajectory': ColumnVariable(
+                'trajectory', np.arange(self.length), ('trajectory',)
+            )
+        }
+
+        # Offsets of the first point of each trajectory in pointwise column
+        # files. These appear in each field set group as the `_row_offset` and
+        # `_row_size` variables of the ragged NetCDF layout, which means that
+        # pointwise data is read in the same way as for that layout.
+        offsets = None
+        if (self.path / OFFSETS_FILE).exists():
+            offsets = _load_column(self.path / OFFSETS_FILE)
+        self.offsets = offsets
+
+        self.groups: dict[str, ColumnGroup] = {}
+        for fs_name in self.fieldset_names:
+            variables = {}
+            pointwise = False
+            for name, info in self.metadata['fields'][fs_name].items():
+                attributes = {
+                    k: info[k]
+                    for k in ('description', 'units', 'required', 'default')
+                    if k in info
+                }
+                variables[name] = ColumnVariable(
+                    name,
+                    _load_column(self.path / fs_name / f'{name}.npy'),
+                    tuple(info['dimensions']),
+                    attributes,
+                    info.get('fill'),
+                )
+                pointwise = pointwise or 'point' in info['dimensions']
+            if pointwise:
+                if offsets is None:
+                    raise ValueError(
+                        f'Point offsets file missing from column store "{self.path}"'
+                    )
+                variables['_row_offset'] = ColumnVariable(
+                    '_row_offset', offsets[:-1], ('trajectory',)
+                )
+                variables['_row_size'] = ColumnVariable(
+                    '_row_size', np.diff(offsets), ('trajectory',)
+                )
+            self.groups[fs_name] = ColumnGroup(fs_name, variables)
+
+        if self.metadata.get('indexable', False):
+            self.groups[INDEX_GROUP] = ColumnGroup(
+                INDEX_GROUP,
+                {
+                    name: ColumnVariable(
+                        name,
+                        _load_column(self.path / INDEX_GROUP / f'{name}.npy'),
+                        ('trajectory',),
+                    )
+                    for name in ('flight_id', 'trajectory_index')
+                },
+            )
+
+    def species(self, fs_name: str) -> list[str] | None:
+        """Names of species in the species dimension for a field set."""
+        return self.metadata['species'].get(fs_name)
+
+    def close(self) -> None:
+        # Memory maps are closed when the last reference to them goes away.
+        self.groups = {}
+        self.variables = {}
+        self.offsets = None
+
+    def sync(self) -> None:
+        pass
+
+
+class ColumnStoreWriter:
+    """Writer for a new column store directory.
+
+    Column files are created at their full size up front (so the number of
+    trajectories and total number of points must be known) and filled in
+    through memory maps. The metadata file is written last, by `finish`, so
+    an incomplete column store cannot be opened.
+    """
+
+    def __init__(self, path: Path, length: int, offsets: np.ndarray | None):
+        self.path = Path(path)
+        self.length = length
+        self.offsets = offsets
+        self.fields: dict[str, dict[str, Any]] = {}
+        self.path.mkdir()
+        if offsets is not None:
+            np.save(self.path / OFFSETS_FILE, offsets.astype('<i8'))
+
+    def create_field(
+        self,
+        fs_name: str,
+        name: str,
+        metadata: FieldMetadata,
+        nspecies: int,
+    ) -> np.ndarray | None:
+        """Create the column file for a field, returning a writable memory
+        map for it (or None for string fields, which are written using
+        `write_strings`)."""
+        pointwise = Dimension.POINT in metadata.dimensions
+        dims = metadata.dimensions.netcdf
+        if pointwise:
+            if metadata.field_type is str:
+                raise ValueError(
+                    f'Pointwise string field "{name}" not supported in column stores'
+                )
+            dims = ('point', *dims[1:])
+        info: dict[str, Any] = {
+            'dimensions': list(dims),
+            'fill': column_fill_value(metadata.field_type),
+            'description': metadata.description,
+            'units': metadata.units,
+            'required': 'true' if metadata.required else 'false',
+        }
+        if metadata.default is not None:
+            default = metadata.default
+            info['default'] = (
+                default.item() if isinstance(default, np.generic) else default
+            )
+        self.fields.setdefault(fs_name, {})[name] = info
+
+        (self.path / fs_name).mkdir(exist_ok=True)
+        if metadata.field_type is str:
+            return None
+        shape = [self.length]
+        if pointwise:
+            assert self.offsets is not None
+            shape = [int(self.offsets[-1])]
+        for d in dims[1:]:
+            if d == 'species':
+                shape.append(nspecies)
+            elif d == 'thrust_mode':
+                shape.append(len(ThrustMode))
+        dtype = column_dtype(metadata.field_type)
+        path = self.path / fs_name / f'{name}.npy'
+        if np.prod(shape) == 0:
+            empty = np.empty(shape, dtype=dtype)
+            np.save(path, empty)
+            return empty
+        return np.lib.format.open_memmap(
+            path, mode='w+', dtype=dtype, shape=tuple(shape)
+        )
+
+    def write_strings(self, fs_name: str, name: str, values: list[str]) -> None:
+        """Write the column file for a per-trajectory string field."""
+        np.save(self.path / fs_name / f'{name}.npy', np.array(values, dtype=str))
+
+    def write_index(self, flight_ids: np.ndarray, indexes: np.ndarray) -> None:
+        """Write the sorted flight ID index."""
+        (self.path / INDEX_GROUP).mkdir()
+        np.save(self.path / INDEX_GROUP / 'flight_id.npy', flight_ids.astype('<i8'))
+        np.save(self.path / INDEX_GROUP / 'trajectory_index.npy', indexes.astype('<i8'))
+
+    def finish(self, **metadata: Any) -> None:
+        """Write the metadata file, completing the column store."""
+        data = dict(
+            format=COLUMN_FORMAT_VERSION,
+            length=self.length,
+            fields=self.fields,
+            **metadata,
+        )
+        with open(self.path / METADATA_FILE, 'w') as fp:
+            json.dump(data, fp)
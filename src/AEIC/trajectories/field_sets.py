@@ -355,14 +355,24 @@ class FieldSet(Mapping):
         """Construct a `FieldSet` from a NetCDF group."""
         fields = {}
         for f, v in group.variables.items():
+            # Variables with a leading underscore are for internal use (e.g.,
+            # row sizes and offsets for the ragged storage layout).
+            if f.startswith('_'):
+                continue
+
             # Get a nice Python type from the NetCDF field type.
             field_type = v.dtype
             if hasattr(field_type, 'type'):
                 field_type = field_type.type
             assert isinstance(field_type, type)
 
-            # Determine dimensions for variable.
-            dimensions = Dimensions.from_dim_names(*v.dimensions)
+            # Determine dimensions for variable. Pointwise variables are either
+            # variable-length arrays indexed by trajectory, or are indexed by
+            # the point dimension (ragged storage layout).
+            if 'point' in v.dimensions:
+                dimensions = Dimensions.from_dim_names('trajectory', *v.dimensions)
+            else:
+                dimensions = Dimensions.from_dim_names(*v.dimensions)
             if isinstance(v.datatype, nc4.VLType) and field_type is not str:
                 dimensions = dimensions.add(Dimension.POINT)
 
@@ -405,6 +415,13 @@ class FieldSet(Mapping):
 
     def __hash__(self):
         """Hash based on name and field definitions."""
+        return self._hash
+
+    @cached_property
+    def _hash(self) -> int:
+        # Field sets are immutable once created, so the hash only needs to be
+        # calculated once. (Trajectories are hashed by their data dictionary
+        # on every addition to a `TrajectoryStore`.)
         return self.calc_hash(self.fieldset_name, self._fields)
 
     @cached_property
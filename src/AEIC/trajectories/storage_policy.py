@@ -0,0 +1,227 @@
+"""Compression and chunking policies for trajectory store NetCDF files.
+
+A `StoragePolicy` says how the NetCDF variables for each field in a
+`TrajectoryStore` are stored: zlib compression level, shuffle filter, chunk
+sizes and optional quantization of floating point values. Settings can be
+given for the whole store, for individual field sets and for individual
+fields, with more specific settings overriding less specific ones.
+"""
+
+# TODO: Remove this when we migrate to Python 3.14+.
+from __future__ import annotations
+
+import json
+from dataclasses import asdict, dataclass, field, fields
+from typing import Any
+
+import numpy as np
+
+from .field_sets import FieldMetadata
+
+
+@dataclass(frozen=True)
+class FieldStorage:
+    """Storage settings for a NetCDF variable.
+
+    Any setting left as None is inherited from a less specific level of a
+    `StoragePolicy` (field set settings override the policy defaults, field
+    settings override field set settings).
+    """
+
+    zlib: bool | None = None
+    """Compress the variable using zlib?"""
+
+    complevel: int | None = None
+    """zlib compression level (1-9)."""
+
+    shuffle: bool | None = None
+    """Apply the HDF5 shuffle filter before compression?"""
+
+    chunk_trajectories: int | None = None
+    """Chunk length along the trajectory dimension. (Zero means to use the
+    NetCDF library default.)"""
+
+    chunk_points: int | None = None
+    """Chunk length along the point dimension for pointwise variables in the
+    ragged storage layout."""
+
+    least_significant_digit: int | None = None
+    """If given, floating point values are quantized so that they are
+    accurate to this many decimal places before being stored. This is lossy,
+    but makes data compress much better."""
+
+    def __post_init__(self):
+        if self.complevel is not None and not 0 <= self.complevel <= 9:
+            raise ValueError('complevel must be between 0 and 9')
+        for name in ('chunk_trajectories', 'chunk_points'):
+            value = getattr(self, name)
+            if value is not None and value < 0:
+                raise ValueError(f'{name} must not be negative')
+
+    def update(self, other: FieldStorage | None) -> FieldStorage:
+        """Return settings from `other` where given, otherwise from `self`."""
+        if other is None:
+            return self
+        return FieldStorage(
+            **{
+                f.name: (
+                    getattr(other, f.name)
+                    if getattr(other, f.name) is not None
+                    else getattr(self, f.name)
+                )
+                for f in fields(self)
+            }
+        )
+
+    def to_dict(self) -> dict[str, Any]:
+        """Settings that are not None, as a dictionary."""
+        return {k: v for k, v in asdict(self).items() if v is not None}
+
+
+# Settings used for anything not set in a policy. These give uncompressed
+# per-trajectory variables with library default chunking, and pointwise
+# ragged variables chunked in blocks of 16384 points.
+_BASE_STORAGE = FieldStorage(
+    zlib=False,
+    complevel=0,
+    shuffle=False,
+    chunk_trajectories=0,
+    chunk_points=16384,
+)
+
+
+@dataclass(frozen=True)
+class StoragePolicy:
+    """Compression and chunking policy for trajectory store NetCDF files.
+
+    A policy is given when creating a `TrajectoryStore` (or an associated file
+    using `create_associated`), and is recorded as a JSON string in the
+    `storage_policy` global attribute of each NetCDF file created. The
+    settings for a field are found by starting from `default`, then applying
+    any settings for the field's field set from `fieldsets`, then any settings
+    for the field itself from `fields`.
+
+    There are a few preset policies, available through `preset`:
+
+    - "fast": no compression, for the fastest reading and writing;
+    - "balanced": zlib level 1 with shuffle, which is cheap and removes most
+      of the redundancy in typical trajectory data (this is the default);
+    - "archive": zlib level 6 with shuffle and larger chunks, for data that
+      will be written once and kept for a long time.
+
+    Quantization using `least_significant_digit` is never enabled by the
+    presets, because it changes the values stored; set it explicitly for the
+    fields where the loss of precision is acceptable.
+
+    Note that the HDF5 library used by NetCDF cannot compress the contents of
+    variable-length arrays, so in the default VLEN storage layout compression
+    and quantization settings only affect per-trajectory variables. Chunk
+    sizes along the trajectory dimension apply to all variables. To get
+    compressed pointwise data, use the RAGGED storage layout.
+    """
+
+    default: FieldStorage = field(default_factory=FieldStorage)
+    """Settings for all fields."""
+
+    fieldsets: dict[str, FieldStorage] = field(default_factory=dict)
+    """Settings for fields in named field sets."""
+
+    fields: dict[str, FieldStorage] = field(default_factory=dict)
+    """Settings for individual named fields."""
+
+    PRESETS = ('fast', 'balanced', 'archive')
+
+    @classmethod
+    def preset(cls, name: str) -> StoragePolicy:
+        """Return one of the preset storage policies by name."""
+        match name:
+            case 'fast':
+                return cls(default=FieldStorage(zlib=False, shuffle=False))
+            case 'balanced':
+                return cls(default=FieldStorage(zlib=True, complevel=1, shuffle=True))
+            case 'archive':
+                return cls(
+                    default=FieldStorage(
+                        zlib=True,
+                        complevel=6,
+                        shuffle=True,
+                        chunk_trajectories=4096,
+                        chunk_points=65536,
+                    )
+                )
+            case _:
+                raise ValueError(f'Unknown storage policy preset "{name}"')
+
+    @classmethod
+    def from_spec(cls, spec: StoragePolicy | str | None) -> StoragePolicy:
+        """Convert a policy, preset name or None (for the default policy) to a
+        policy."""
+        if spec is None:
+            return cls.preset('balanced')
+        if isinstance(spec, str):
+            return cls.preset(spec)
+        return spec
+
+    def resolve(self, fieldset_name: str, field_name: str) -> FieldStorage:
+        """Find the complete settings for a field."""
+        return (
+            _BASE_STORAGE.update(self.default)
+            .update(self.fieldsets.get(fieldset_name))
+            .update(self.fields.get(field_name))
+        )
+
+    def variable_kwargs(
+        self,
+        fieldset_name: str,
+        field_name: str,
+        metadata: FieldMetadata,
+        shape: list[int],
+        ragged: bool = False,
+        vlen: bool = False,
+    ) -> dict[str, Any]:
+        """Keyword arguments for `createVariable` for a field.
+
+        `shape` gives the lengths of the variable's non-leading dimensions,
+        used to make chunks cover the whole of those dimensions. If `ragged`
+        is true, the variable is a pointwise variable in the ragged layout
+        (leading dimension "point"), and if `vlen` is true, the variable is
+        a variable-length array variable (which can be chunked, but not
+        usefully compressed).
+        """
+        s = self.resolve(fieldset_name, field_name)
+        kwargs: dict[str, Any] = {}
+        chunk = s.chunk_points if ragged else s.chunk_trajectories
+        if chunk:
+            kwargs['chunksizes'] = [chunk, *shape]
+        if vlen or metadata.field_type is str:
+            return kwargs
+        if s.zlib and s.complevel:
+            kwargs['zlib'] = True
+            kwargs['complevel'] = s.complevel
+            kwargs['shuffle'] = bool(s.shuffle)
+        if s.least_significant_digit is not None and np.issubdtype(
+            metadata.field_type, np.floating
+        ):
+            kwargs['least_significant_digit'] = s.least_significant_digit
+        return kwargs
+
+    def to_json(self) -> str:
+        """Serialize the policy for storage in a NetCDF attribute."""
+        return json.dumps(
+            {
+                'default': self.default.to_dict(),
+                'fieldsets': {k: v.to_dict() for k, v in self.fieldsets.items()},
+                'fields': {k: v.to_dict() for k, v in self.fields.items()},
+            },
+            sort_keys=True,
+        )
+
+    @classmethod
+    def from_json(cls, s: str) -> StoragePolicy:
+        """Deserialize a policy stored in a NetCDF attribute."""
+        d = json.loads(s)
+        return cls(
+            default=FieldStorage(**d.get('default', {})),
+            fieldsets={k: FieldStorage(**v) for k, v in d.get('fieldsets', {}).items()},
+            fields={k: FieldStorage(**v) for k, v in d.get('fields', {}).items()},
+        )
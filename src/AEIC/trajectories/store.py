@@ -1,31 +1,47 @@
 # TODO: Remove this when we migrate to Python 3.14+.
 from __future__ import annotations
 
-import bisect
+import contextlib
+import fcntl
+import functools
 import gc
 import hashlib
 import itertools
 import json
+import multiprocessing as mp
 import os
+import queue
+import shutil
+import tempfile
 import threading
+import time
 import warnings
-from collections.abc import Iterator
+from collections import OrderedDict, deque
+from collections.abc import Callable, Iterable, Iterator, Mapping, Sequence
+from concurrent.futures import Future, ProcessPoolExecutor
 from dataclasses import dataclass
 from datetime import UTC, datetime
 from enum import Enum, StrEnum
 from pathlib import Path
-from typing import Any, Protocol
+from typing import Any, Protocol, overload
 
 import netCDF4 as nc4
 import numpy as np
-from cachetools import LRUCache
+from cachetools import Cache, LFUCache, LRUCache
 
 from AEIC.performance.types import ThrustMode, ThrustModeValues
 from AEIC.types import Species, SpeciesValues
 
+from .columns import (
+    COLUMN_STORE_SUFFIX,
+    ColumnDataset,
+    ColumnStoreWriter,
+    column_fill_value,
+)
 from .dimensions import Dimension
 from .field_sets import FieldMetadata, FieldSet, HasFieldSets
-from .trajectory import BASE_FIELDSET_NAME, Trajectory
+from .storage_policy import StoragePolicy
+from .trajectory import BASE_FIELDSET_NAME, LazyTrajectory, Trajectory
 
 # Python doesn't have a simple way of saying "anything that's acceptable as a
 # filesystem path", so define a simple type alias instead.
@@ -40,11 +56,86 @@ AssociatedFileOpen = PathType
 AssociatedFiles = list[AssociatedFileCreate] | list[AssociatedFileOpen]
 
 
+# Number of trajectories written per NetCDF write in block operations on
+# stores without an explicit write buffer (`add_many`, `save` and
+# `create_associated`).
+
+ADD_MANY_BLOCK_SIZE = 256
+
+
+# Number of trajectories read per block when iterating over a store.
+
+ITER_BLOCK_SIZE = 256
+
+
+# Number of trajectories read per field read when exporting a store to a
+# column store, and default number of trajectories per NetCDF file when
+# exporting to a merged store.
+
+EXPORT_BLOCK_SIZE = 4096
+EXPORT_SHARD_SIZE = 100000
+
+
+# Statistics computed by `aggregate` (as well as quantiles).
+
+AGGREGATE_STATS = ('count', 'sum', 'mean', 'std', 'min', 'max')
+
+
+# Compaction threshold for the flight ID index. When reindexing, flight IDs
+# added since the last reindex are merged into the existing sorted index as
+# long as there are no more of them than this fraction of the size of the
+# existing index. Beyond that, the whole index is rebuilt from the flight IDs
+# stored in the NetCDF files.
+
+INDEX_COMPACTION_FRACTION = 0.25
+
+
+# Maximum number of blocks of trajectories waiting to be written by the
+# writer thread of a store opened with `write_behind=True`. Adding more
+# trajectories blocks until the writer catches up.
+
+WRITE_BEHIND_QUEUE_SIZE = 8
+
+
+# Default maximum number of NetCDF files of merged stores that a store keeps
+# open at once. Files are opened when they're first read from, and the least
+# recently used ones are closed again to stay within the limit.
+
+MAX_OPEN_FILES = 128
+
+
+# Extension of the manifest files of union stores (see `TrajectoryStore.union`).
+
+UNION_STORE_SUFFIX = '.aeic-union'
+
+
 # NOTE: Whenever a NetCDF4 Dataset is opened, the keepweakref parameter must be
 # set to avoid the segmentation fault issues described at
 # https://github.com/Unidata/netcdf4-python/issues/1444
 
 
+# The HDF5 and netcdf-c libraries are not thread-safe, so any NetCDF calls
+# that may happen while more than one thread is involved with a store (for
+# example, reads from the I/O thread used by prefetching iteration) are made
+# holding this process-wide lock. Writes always hold it too: a store being
+# written in one thread may run alongside concurrent stores being read in
+# others.
+
+_NETCDF_LOCK = threading.RLock()
+
+
+def _holding_netcdf_lock(fn):
+    """Decorator for functions whose NetCDF calls are all made holding the
+    NetCDF lock."""
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with _NETCDF_LOCK:
+            return fn(*args, **kwargs)
+
+    return wrapper
+
+
 class AssociatedFileCreateFn(Protocol):
     """The type of functions used to create associated NetCDF files.
 
@@ -60,29 +151,272 @@ class AssociatedFileCreateFn(Protocol):
 
 
 class _TrajectoryStoreIterator(Iterator):
-    """Private iterator class for TrajectoryStore."""
+    """Private iterator class for TrajectoryStore.
+
+    Trajectories are retrieved from the store in blocks, so that sequential
+    scans of file-backed stores use block reads from the NetCDF files."""
 
-    def __init__(self, store):
+    def __init__(self, store, block_size: int = ITER_BLOCK_SIZE):
         self._store = store
+        self._block_size = block_size
         self._index = 0
+        self._block: list[Trajectory] = []
+        self._block_pos = 0
 
     def __next__(self):
-        if self._index < len(self._store):
-            item = self._store[self._index]
-            self._index += 1
-            return item
-        else:
-            raise StopIteration
+        if self._block_pos >= len(self._block):
+            if self._index >= len(self._store):
+                raise StopIteration
+            stop = min(self._index + self._block_size, len(self._store))
+            self._block = self._store[self._index : stop]
+            self._block_pos = 0
+            self._index = stop
+        item = self._block[self._block_pos]
+        self._block_pos += 1
+        return item
+
+
+class _OpenFileLRU:
+    """Read-only NetCDF datasets for the files of merged stores, opened on
+    first use.
+
+    When more than `max_open` datasets are open, the least recently used one
+    is closed. (Values found from a dataset, like groups and variables, are
+    only valid until it's closed, so they're looked up again through `get`
+    for each use.)
+    """
+
+    def __init__(self, max_open: int):
+        self.max_open = max_open
+        self._datasets: OrderedDict[Path, nc4.Dataset] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._datasets)
+
+    def get(self, path: Path, check: Callable[[nc4.Dataset], None]) -> nc4.Dataset:
+        """Return the dataset for a file, opening it if it isn't open, in
+        which case `check` is called on the new dataset before it's used."""
+        with _NETCDF_LOCK:
+            dataset = self._datasets.get(path)
+            if dataset is not None:
+                self._datasets.move_to_end(path)
+                return dataset
+            dataset = nc4.Dataset(path, mode='r', keepweakref=True)
+            try:
+                check(dataset)
+            except BaseException:
+                dataset.close()
+                raise
+            self._datasets[path] = dataset
+            while len(self._datasets) > self.max_open:
+                self._datasets.popitem(last=False)[1].close()
+            return dataset
+
+    def close(self) -> None:
+        """Close all the open datasets."""
+        with _NETCDF_LOCK:
+            while len(self._datasets) > 0:
+                self._datasets.popitem()[1].close()
+
+
+class _MergedFiles:
+    """The NetCDF files of a merged store, opened when first used.
+
+    Each file is checked against the first file of the store (for the same
+    field sets, species dimension, storage layout and so on) and against the
+    trajectory count recorded in the store's metadata the first time that
+    it's opened.
+    """
+
+    def __init__(
+        self, files: _OpenFileLRU, store_dir: Path, paths: list[Path], counts: list[int]
+    ):
+        self.files = files
+        self.store_dir = store_dir
+        self.paths = paths
+        self.counts = counts
+        self._first: tuple[tuple, str, list[str] | None] | None = None
+        self._checked: set[int] = set()
+
+    def dataset(self, k: int) -> nc4.Dataset:
+        return self.files.get(self.paths[k], functools.partial(self._check, k))
+
+    def view(self, get: Callable[[nc4.Dataset], Any]) -> _MergedFileValues:
+        """Sequence of values found by `get` from the dataset of each file."""
+        return _MergedFileValues(self, get)
+
+    def _check(self, k: int, dataset: nc4.Dataset) -> None:
+        if k in self._checked:
+            return
+        path = self.paths[k]
+        names, hashes, id_hash, layout, _, associated_hash, species = (
+            _merged_file_signature(dataset, path)
+        )
+        if {g for g in dataset.groups if not g.startswith('_')} != set(names):
+            raise ValueError(
+                f'Field set names in global attribute do not match NetCDF groups '
+                f'in store {self.store_dir}'
+            )
+
+        # (Associated names differ between files of merged associated stores:
+        # each file is linked to a different base file.)
+        signature = (names, hashes, id_hash, associated_hash)
+        if self._first is None:
+            self._first = (signature, layout, species)
+        elif layout != self._first[1]:
+            raise ValueError(f'Mixed storage layouts in merged store {self.store_dir}')
+        elif species != self._first[2]:
+            raise ValueError(
+                f'Species dimension of NetCDF file {path} does not match the '
+                f'other files in merged store {self.store_dir}'
+            )
+        elif signature != self._first[0]:
+            raise ValueError(
+                f'NetCDF file {path} does not match the other files in merged '
+                f'store {self.store_dir}'
+            )
+        if len(dataset.dimensions['trajectory']) != self.counts[k]:
+            raise ValueError(
+                f'Trajectory count of NetCDF file {path} does not match metadata '
+                f'of merged store {self.store_dir}'
+            )
+        self._checked.add(k)
+
+
+class _MergedFileValues(Sequence):
+    """Values (datasets, groups, dimensions and so on) for each of the files of
+    a merged store, opening the file when a value is accessed. This stands in
+    for the lists of per-file values in `TrajectoryStore.NcFiles`."""
+
+    def __init__(self, files: _MergedFiles, get: Callable[[nc4.Dataset], Any]):
+        self._files = files
+        self._get = get
+
+    def __len__(self) -> int:
+        return len(self._files.paths)
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return [self[i] for i in range(*k.indices(len(self)))]
+        if k < 0:
+            k += len(self)
+        if not 0 <= k < len(self):
+            raise IndexError('NetCDF file index out of range')
+        return self._get(self._files.dataset(k))
+
+
+class _WriteBehind:
+    """Writer thread for a `TrajectoryStore` opened with `write_behind=True`.
 
+    Functions making NetCDF calls are run in order on a single dedicated
+    thread, holding the NetCDF lock. Writes are queued (in a bounded queue)
+    with `submit` and an exception from any of them is kept and raised in the
+    calling thread by the next call of `check` or `wait`. Other operations
+    (file creation, syncing, closing) are run on the writer thread with
+    `run`, which waits for the result.
+    """
+
+    def __init__(self, maxsize: int = WRITE_BEHIND_QUEUE_SIZE):
+        self._queue: queue.Queue[tuple[Callable[[], Any], Future, bool] | None] = (
+            queue.Queue(maxsize)
+        )
+        self._error: BaseException | None = None
+        self._thread = threading.Thread(target=self._work, daemon=True)
+        self._thread.start()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                fn, future, keep_error = item
+                try:
+                    with _NETCDF_LOCK:
+                        future.set_result(fn())
+                except BaseException as exc:
+                    future.set_exception(exc)
+                    if keep_error and self._error is None:
+                        self._error = exc
+            finally:
+                self._queue.task_done()
+
+    @property
+    def in_writer(self) -> bool:
+        return threading.get_ident() == self._thread.ident
+
+    def check(self) -> None:
+        """Raise the exception from a failed write, if there is one."""
+        if self._error is not None:
+            exc, self._error = self._error, None
+            raise exc
+
+    def submit(self, fn: Callable[[], Any]) -> None:
+        """Queue a write, waiting if the queue is full."""
+        self.check()
+        if self.in_writer:
+            fn()
+            return
+        self._queue.put((fn, Future(), True))
+
+    def wait(self) -> None:
+        """Wait for all queued writes to finish."""
+        if not self.in_writer:
+            self._queue.join()
+        self.check()
+
+    def run(self, fn: Callable[[], Any]) -> Any:
+        """Run a function on the writer thread and return its result."""
+        if self.in_writer:
+            return fn()
+        future: Future = Future()
+        self._queue.put((fn, future, False))
+        return future.result()
+
+    def shutdown(self) -> None:
+        """Stop the writer thread, once everything queued has been done."""
+        self._queue.put(None)
+        self._thread.join()
+
+
+@dataclass
+class CacheStats:
+    """Trajectory cache statistics for a `TrajectoryStore`."""
+
+    hits: int
+    """Number of trajectory lookups satisfied from the cache."""
 
-class TrajectoryCache(LRUCache[int, Trajectory]):
-    """Specialization of LRUCache class for trajectory storage.
+    misses: int
+    """Number of trajectory lookups that had to read from the files."""
+
+    evictions: int
+    """Number of trajectories evicted from the cache to make space."""
+
+    entries: int
+    """Number of trajectories currently in the cache."""
+
+    currsize: int
+    """Total size in bytes of the trajectories currently in the cache."""
+
+    maxsize: int
+    """Maximum total size in bytes of the trajectories in the cache."""
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups satisfied from the cache."""
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups > 0 else 0.0
+
+
+class _TrajectoryCacheMixin:
+    """Common behaviour for trajectory caches with different eviction
+    policies.
 
     This is used to handle the case of in-memory trajectory stores that are not
     connected to a NetCDF file: in that case, we want to prevent evictions from
     the trajectory cache, since there is no file to which we can save evicted
     items. Instead, we just throw an exception if the trajectory cache would
-    exceed its assigned size.
+    exceed its assigned size. It also keeps hit, miss and eviction counts.
     """
 
     class EvictionOccurred(RuntimeError):
@@ -91,17 +425,226 @@ class TrajectoryCache(LRUCache[int, Trajectory]):
         pass
 
     def __init__(self, *args, **kwargs):
-        """Initialize a trajectory cache with LRU eviction."""
         super().__init__(*args, **kwargs)
         self.exception_on_eviction = False
+        self.reset_stats()
+
+    def reset_stats(self) -> None:
+        """Reset the hit, miss and eviction counts."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        """Look up an item, counting cache hits and misses."""
+        if key in self:  # type: ignore[operator]
+            self.hits += 1
+            return self[key]  # type: ignore[index]
+        self.misses += 1
+        return default
 
     def popitem(self):
         """Pop item from cache and return it."""
         if self.exception_on_eviction:
             raise self.EvictionOccurred()
-        key, value = super().popitem()
+        key, value = super().popitem()  # type: ignore[misc]
+        self.evictions += 1
         return key, value
 
+    def stats(self) -> CacheStats:
+        """Current cache statistics."""
+        return CacheStats(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            entries=len(self),  # type: ignore[arg-type]
+            currsize=self.currsize,  # type: ignore[attr-defined]
+            maxsize=self.maxsize,  # type: ignore[attr-defined]
+        )
+
+
+class SLRUCache[K, V](Cache[K, V]):
+    """Segmented LRU cache.
+
+    Items enter the cache in a "probationary" segment, and are promoted to a
+    "protected" segment when they are looked up again. The protected segment
+    is limited to a fraction of the cache size: when it overflows, its least
+    recently used items are moved back to the probationary segment. Items
+    are evicted from the probationary segment first, in LRU order.
+
+    This makes the cache resistant to scans: items that are only used once,
+    like the trajectories read by a full pass over a store, pass through the
+    probationary segment without evicting the working set of items that are
+    used repeatedly.
+    """
+
+    def __init__(self, maxsize, getsizeof=None, protected_fraction: float = 0.8):
+        Cache.__init__(self, maxsize, getsizeof)
+        self.protected_fraction = protected_fraction
+        self._probation: OrderedDict[K, None] = OrderedDict()
+        self._protected: OrderedDict[K, int] = OrderedDict()
+        self._protected_size = 0
+
+    def __getitem__(self, key, cache_getitem=Cache.__getitem__):
+        value = cache_getitem(self, key)
+        if key in self:  # __missing__ may not store item
+            self._touch(key, value)
+        return value
+
+    def __setitem__(self, key, value, cache_setitem=Cache.__setitem__):
+        cache_setitem(self, key, value)
+        if key in self._protected:
+            size = self.getsizeof(value)
+            self._protected_size += size - self._protected[key]
+            self._protected[key] = size
+            self._protected.move_to_end(key)
+            self._rebalance()
+        else:
+            self._probation[key] = None
+            self._probation.move_to_end(key)
+
+    def __delitem__(self, key, cache_delitem=Cache.__delitem__):
+        cache_delitem(self, key)
+        if key in self._protected:
+            self._protected_size -= self._protected.pop(key)
+        else:
+            del self._probation[key]
+
+    def popitem(self):
+        """Remove and return the least recently used probationary item (or
+        protected item, if there are no probationary items)."""
+        order = self._probation if len(self._probation) > 0 else self._protected
+        try:
+            key = next(iter(order))
+        except StopIteration:
+            raise KeyError(f'{type(self).__name__} is empty') from None
+        return (key, self.pop(key))
+
+    def _touch(self, key, value):
+        if key in self._protected:
+            self._protected.move_to_end(key)
+            return
+        del self._probation[key]
+        size = self.getsizeof(value)
+        self._protected[key] = size
+        self._protected_size += size
+        self._rebalance()
+
+    def _rebalance(self):
+        # Demote least recently used protected items to the most recently
+        # used end of the probationary segment.
+        limit = self.maxsize * self.protected_fraction
+        while self._protected_size > limit and len(self._protected) > 1:
+            key, size = self._protected.popitem(last=False)
+            self._protected_size -= size
+            self._probation[key] = None
+
+
+class TrajectoryCache(_TrajectoryCacheMixin, LRUCache[int, Trajectory]):
+    """Trajectory cache with least recently used eviction."""
+
+
+class LFUTrajectoryCache(_TrajectoryCacheMixin, LFUCache[int, Trajectory]):
+    """Trajectory cache with least frequently used eviction."""
+
+
+class SLRUTrajectoryCache(_TrajectoryCacheMixin, SLRUCache[int, Trajectory]):
+    """Trajectory cache with scan-resistant segmented LRU eviction."""
+
+
+class _StoreFieldLoader:
+    """Loads field values for a `LazyTrajectory` from a `TrajectoryStore`.
+    (Only the fields in the store's field projection, if it has one, can be
+    loaded.)"""
+
+    def __init__(self, store: TrajectoryStore, index: int, fields: set[str] | None):
+        self.store = store
+        self.index = index
+        self.fields = fields
+
+    def load_field(self, name: str) -> Any:
+        return self.store._read_lazy_field(self.index, name)
+
+    def load_npoints(self) -> int:
+        return self.store._read_lazy_npoints(self.index)
+
+    def resized(self, trajectory: LazyTrajectory) -> None:
+        self.store._recache(self.index, trajectory)
+
+
+class _FieldColumns(Mapping):
+    """Read-only mapping from field names to the values of the fields for all
+    trajectories in a `TrajectoryStore`, as returned by `read_field`. Each
+    field is read when it's first used. (This is what the predicate passed to
+    `TrajectoryStore.subset` sees.)"""
+
+    def __init__(self, store: TrajectoryStore):
+        self.store = store
+        self._values: dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._values:
+            if name not in set(self):
+                raise KeyError(name)
+            self._values[name] = self.store.read_field(name)
+        return self._values[name]
+
+    def __iter__(self) -> Iterator[str]:
+        for fs_name in self.store._nc:
+            yield from FieldSet.from_registry(fs_name)
+
+    def __len__(self) -> int:
+        return sum(len(FieldSet.from_registry(fs_name)) for fs_name in self.store._nc)
+
+
+@dataclass
+class RaggedArray:
+    """Pointwise values for a number of trajectories, stored contiguously.
+
+    The values for trajectory `i` are `values[offsets[i]:offsets[i + 1]]`, so
+    `offsets` has one more entry than there are trajectories. Any dimensions
+    beyond the first in `values` (e.g., for species-indexed fields) are
+    carried along unchanged.
+    """
+
+    values: np.ndarray
+    """Concatenated values for all trajectories."""
+
+    offsets: np.ndarray
+    """Offsets of the start of each trajectory's values, plus a final entry
+    giving the total number of values."""
+
+    def __len__(self) -> int:
+        """Number of trajectories."""
+        return len(self.offsets) - 1
+
+    def __getitem__(self, idx: int) -> np.ndarray:
+        """Values for a single trajectory."""
+        if idx < 0:
+            idx += len(self)
+        if idx < 0 or idx >= len(self):
+            raise IndexError('RaggedArray index out of range')
+        return self.values[self.offsets[idx] : self.offsets[idx + 1]]
+
+    @property
+    def row_sizes(self) -> np.ndarray:
+        """Number of values for each trajectory."""
+        return np.diff(self.offsets)
+
+    @classmethod
+    def from_rows(
+        cls, rows: Sequence[np.ndarray], dtype: Any = None, shape: tuple = ()
+    ) -> RaggedArray:
+        """Build a ragged array from a sequence of per-trajectory arrays.
+
+        The `dtype` and trailing `shape` are used to make an empty values
+        array when there are no rows."""
+        offsets = np.zeros(len(rows) + 1, dtype=np.int64)
+        if len(rows) == 0:
+            return cls(values=np.empty((0, *shape), dtype=dtype), offsets=offsets)
+        np.cumsum([len(r) for r in rows], out=offsets[1:])
+        return cls(values=np.concatenate(rows), offsets=offsets)
+
 
 class TrajectoryStore:
     """Class representing a set of trajectories stored in NetCDF files.
@@ -173,6 +716,70 @@ class TrajectoryStore:
     trajectories overflow the cache size, requiring an eviction, a
     `TrajectoryCache.EvictionOccurred` exception is raised.
 
+    **Buffered writing**
+
+    By default, each trajectory added to a store in CREATE or APPEND mode is
+    written to the NetCDF files immediately, which means one small NetCDF write
+    per field per trajectory. For bulk writing, trajectories can be added using
+    the `add_many` method, which writes blocks of trajectories with a single
+    NetCDF write per field, and a write buffer can be configured using the
+    `write_buffer_size` (number of trajectories) and `write_buffer_mb` (MB of
+    trajectory data) constructor arguments. Buffered trajectories are written
+    when the buffer fills and whenever the store is synced or closed.
+
+    A store opened with `write_behind=True` hands its NetCDF writes (and all
+    its other NetCDF calls, apart from reads) to a dedicated writer thread,
+    so that compression and writing of trajectories overlaps with whatever
+    the adding thread does next, typically simulating more trajectories. The
+    blocks of trajectories waiting to be written are held in a bounded queue
+    (`WRITE_BEHIND_QUEUE_SIZE` blocks, each one trajectory or one write
+    buffer's worth), so adding trajectories waits when the writer falls
+    behind. An exception from a write is raised by the next call of `add`,
+    `add_many`, `sync` or `close`. Reading from the store waits for queued
+    writes to finish.
+
+    **Checkpointing**
+
+    Whenever a store in CREATE or APPEND mode is synced or closed, it is
+    "committed": the number of trajectories in the store and the largest
+    flight ID among them (the "flight ID watermark") are recorded in each of
+    its NetCDF files as the `committed_trajectories` and `committed_flight_id`
+    global attributes, and the files are synced to disk. For long simulation
+    runs, the `checkpoint_every` (number of trajectories) and
+    `checkpoint_seconds` constructor arguments make the store commit itself
+    at regular intervals as trajectories are added.
+
+    A process that is killed while writing a store normally leaves data
+    written after the last commit in an inconsistent state. Opening the
+    store in APPEND mode truncates it back to the last commit, by rewriting
+    the files with just the committed trajectories (with a warning saying
+    how many were discarded), after which the run can carry on, using
+    `flight_ids` to skip the flights that are already in the store.
+
+    **Storage layouts**
+
+    Pointwise data can be stored in NetCDF files in one of two layouts,
+    chosen using the `layout` argument when creating a store. In the default
+    VLEN layout, each pointwise field is a NetCDF variable-length array
+    variable, with one array per trajectory. In the RAGGED layout (a CF
+    "contiguous ragged array" representation), the points of all trajectories
+    in each field set are stored one after another along a `point` dimension,
+    with per-trajectory `_row_size` and `_row_offset` variables recording
+    where each trajectory's points are. Ragged variables are chunked and
+    compressed, reading a block of trajectories needs a single contiguous
+    read per variable, and ranges of points within trajectories can be read
+    without reading the whole trajectory (see `read_points`). The layout used
+    is recorded in each NetCDF file, and stores using either layout can be
+    opened in the same way.
+
+    Compression, chunking and quantization of the NetCDF variables are
+    controlled by a `StoragePolicy`, given using the `storage_policy` argument
+    when creating a store (either a policy object or the name of one of the
+    "fast", "balanced" or "archive" presets). Settings can be given for the
+    whole store, for individual field sets and for individual fields. The
+    policy is recorded in each NetCDF file, and is used by default for any
+    associated files created from the store.
+
     **Base and associated files**
 
     Every `TrajectoryStore` has a "base" NetCDF file (or files, for a merged
@@ -199,7 +806,11 @@ class TrajectoryStore:
     new associated NetCDF file. The intended use case here is for the
     calculation of data like emissions that are associated with trajectories
     but are not part of the trajectory data itself, and so may be calculated
-    separately.
+    separately. For large stores, the mapping can be run in parallel in worker
+    processes (the `n_workers` argument), producing a merged associated store.
+    For analysis passes that compute a summary rather than new data fields,
+    `map_reduce` runs a function over every trajectory of a store in worker
+    processes in the same way and combines the results.
 
     When an associated file is created, metadata is stored within the file to
     link it to the base file from which it was created. This linkage is checked
@@ -221,7 +832,53 @@ class TrajectoryStore:
     in READ mode like any other `TrajectoryStore`. Merged stores must have
     extension ".aeic-store".
 
+    A merged store can also be written directly, without a merge step, using
+    the `create_sharded` class method, which starts a new NetCDF file in the
+    store directory whenever the current one is big enough. Several processes
+    can write files of the same merged store this way at the same time.
+
     Merged stores may be created from both base files and associated files.
+    A merged associated store may also be opened along with a single base
+    file, as long as the store is opened in READ mode.
+
+    The NetCDF files of a merged store are opened when they're first read
+    from, not when the store is opened, so opening a store with thousands of
+    files is quick. No more than `max_open_files` of them (128 by default) are
+    kept open at once: the least recently used files are closed as others are
+    opened.
+
+    **Union stores**
+
+    Stores can also be combined without moving or copying any files using the
+    `union` class method. This writes a small NetCDF manifest file (with
+    extension ".aeic-union") listing the member stores (single NetCDF files or
+    merged stores, which may be on different filesystems) by path, with their
+    field set hash and trajectory count, and holding a combined flight ID
+    index. A union store is opened in READ mode just like a merged store, with
+    trajectory indexes running consecutively through the members in the order
+    they're listed. The members must not be changed while they're part of a
+    union: a member with a different number of trajectories from the one
+    recorded in the manifest is rejected when the union is opened or when the
+    member's files are first read. Unions of associated stores may be opened
+    along with a union of their base stores, as can the merged associated
+    stores made from a union store by `create_associated`.
+
+    **Column stores**
+
+    For repeated analysis passes over the same data, the cost of decoding
+    NetCDF data can dominate. Any store can be copied to a "column store"
+    using the `export` method: this is a directory (with extension
+    ".aeic-columns") containing one uncompressed memory-mapped `.npy` file per
+    field (see the `AEIC.trajectories.columns` module). Column stores are
+    opened in READ mode in the same way as NetCDF stores, support all the
+    same ways of reading trajectories, with the same field set consistency
+    checks, and `read_field` can return views of the column files without
+    any copying. Column stores cannot be appended to, and do not have
+    associated files: all the field sets of the store that was exported are
+    held in the column store. The `export` method of a column store can be
+    used to convert it back to a NetCDF file or merged store. (The
+    `convert-trajectory-store` command does the same conversions from the
+    command line.)
 
     **Trajectory access and mission database indexing**
 
@@ -229,7 +886,11 @@ class TrajectoryStore:
     the store with the integer index of the trajectory within the store.
     Indexes are assigned in order from zero in the order of insertion of
     trajectories. Indexes into merged stores run consecutively from zero across
-    all the constituent NetCDF files composing the merged store.
+    all the constituent NetCDF files composing the merged store. Stores may
+    also be indexed with a slice, a sequence of integer indexes or a boolean
+    mask, returning a list of trajectories: these are read from the NetCDF
+    files in blocks, which is much faster than reading trajectories one at a
+    time. (Iteration over a store uses the same block reads.)
 
     In addition, if all trajectories in the store have a `flight_id` field
     (representing the mission database flight ID for the trajectory), the store
@@ -238,6 +899,73 @@ class TrajectoryStore:
     trajectory must be unique within the store. A trajectory can be retrieved
     by flight ID using the `get_flight` method.
 
+    For analysis of a single field over many trajectories, the `read_field`
+    method reads field values directly from the NetCDF files in bulk, without
+    constructing `Trajectory` values, returning pointwise fields as a
+    `RaggedArray`. Summary statistics of per-trajectory fields over the whole
+    store (sums, means, quantiles and so on, optionally grouped by a field or
+    by keys joined to the trajectories by flight ID) are computed directly
+    from the NetCDF variables by the `aggregate` method, and the trajectories
+    selected by a condition on per-trajectory fields (or by a set of flight
+    IDs) can be copied to a new store in bulk using the `subset` method.
+
+    **Field projection**
+
+    A store opened in READ mode with the `fieldsets` and/or `fields` arguments
+    reads only the named field sets and fields into trajectories: for example,
+    `fieldsets=['base']` gives plain trajectories without any emissions data,
+    and `fields=['name', 'total_fuel_mass']` reads just those two per-trajectory
+    fields. The NetCDF groups and variables for everything else are not
+    touched. Trajectories from such a store carry only the projected fields:
+    accessing any other field raises `AttributeError`. (The number of points
+    in each trajectory is always known, but when no pointwise fields are
+    projected from a store using the VLEN layout, finding it means reading
+    one pointwise variable.) Projection does not restrict `read_field`, which
+    reads whatever field it is asked for.
+
+    **Lazy trajectories**
+
+    A store opened in READ mode with `lazy=True` returns `LazyTrajectory`
+    views instead of fully loaded trajectories. A view reads nothing until
+    one of its fields is accessed, then reads just that field (one NetCDF
+    read for each variable involved) and keeps the value, so scripts that
+    use a few fields of each trajectory read only those, and the trajectory
+    cache, which measures trajectories by the data they actually hold, has
+    room for many more of them. Views read from the store's files, so they
+    can only load fields while the store is open. Lazy loading combines with
+    field projection: fields outside the projection are not available.
+
+    **Trajectory cache**
+
+    Trajectories read from the NetCDF files are kept in a trajectory cache,
+    limited in size to `cache_size_mb` megabytes of trajectory data (measured
+    by the size of the data arrays held by the trajectories). The eviction
+    policy used when the cache is full is chosen using the `cache_policy`
+    argument: LRU (least recently used, the default), LFU (least frequently
+    used) or SLRU (segmented LRU). The SLRU policy is "scan-resistant":
+    trajectories that are only read once, for example during a full pass
+    over the store, are evicted before trajectories that have been looked up
+    more than once, so a working set of frequently used trajectories survives
+    full passes. The `cache_stats` property gives hit, miss and eviction
+    counts and the current size of the cache, which can be used to tune the
+    cache size and policy for a workload.
+
+    **Concurrent reading**
+
+    Because the underlying HDF5 and netcdf-c libraries are not thread-safe,
+    a `TrajectoryStore` may normally only be used from a single thread, and
+    stores may not be active in different threads at the same time. A store
+    opened in READ mode with `concurrent=True` lifts this restriction: it may
+    be shared between any number of threads (and concurrent stores may be
+    opened in different threads). All NetCDF calls made by the store are
+    serialized using a process-wide lock, while decoding of data read from the
+    NetCDF files, construction of trajectories and trajectory cache lookups
+    happen in the calling threads. Trajectories returned from a concurrent
+    store may be shared between threads through the trajectory cache, so
+    should be treated as read-only. A store being written in one thread may be
+    used alongside concurrent stores in other threads: all its NetCDF writes
+    are made holding the same lock.
+
     """
 
     class FileMode(StrEnum):
@@ -245,6 +973,29 @@ class TrajectoryStore:
         CREATE = 'w'
         APPEND = 'a'
 
+    class Layout(StrEnum):
+        """Storage layout for pointwise data in NetCDF files."""
+
+        VLEN = 'vlen'
+        """One NetCDF variable-length array per trajectory per field."""
+
+        RAGGED = 'ragged'
+        """CF contiguous ragged arrays: the points of all trajectories are
+        stored one after another along a per-group `point` dimension."""
+
+    class CachePolicy(StrEnum):
+        """Eviction policy for the trajectory cache."""
+
+        LRU = 'lru'
+        """Evict the least recently used trajectory."""
+
+        LFU = 'lfu'
+        """Evict the least frequently used trajectory."""
+
+        SLRU = 'slru'
+        """Segmented LRU: scan-resistant, so that full sequential passes over
+        the store don't evict trajectories that are used repeatedly."""
+
     @dataclass
     class NcFiles:
         """Internal class used to store information about NetCDF files
@@ -257,22 +1008,23 @@ class TrajectoryStore:
         fieldsets: set[str]
         """Field sets stored in the NetCDF files."""
 
-        dataset: list[nc4.Dataset]
+        dataset: Sequence[nc4.Dataset]
         """Netcdf4 Dataset objects for the files: multiple to support merged
-        stores."""
+        stores. (For merged stores, this and the other per-file sequences
+        open the files as needed: don't keep the values around.)"""
 
-        traj_dim: list[nc4.Dimension]
+        traj_dim: Sequence[nc4.Dimension]
         """Trajectory dimension objects for the files: multiple to support
         merged stores."""
 
-        traj_var: list[nc4.Variable]
+        traj_var: Sequence[nc4.Variable]
         """Trajectory variable objects for the files: multiple to support
         merged stores."""
 
         species: list[Species] | None
         """Species included in the species dimension in the files, if any."""
 
-        groups: dict[str, list[nc4.Group]]
+        groups: dict[str, Sequence[nc4.Group]]
         """Mapping from field set names to NetCDF groups in the files: groups
         are multiple for each field set name to support merged stores."""
 
@@ -296,6 +1048,12 @@ class TrajectoryStore:
         created: datetime | None = None
         """Creation time global attribute value."""
 
+        layout: str = 'vlen'
+        """Storage layout for pointwise data in the files."""
+
+        storage_policy: StoragePolicy | None = None
+        """Storage policy recorded in the files, if any."""
+
     active_in_thread: int | None = None
     """Thread ID of active TrajectoryStore instance, if any. Multi-threaded
     access is not allowed. This attribute is used to check for this."""
@@ -328,6 +1086,19 @@ class TrajectoryStore:
         comment: str | None = None,
         history: str | None = None,
         source: str | None = None,
+        write_buffer_size: int | None = None,
+        write_buffer_mb: float | None = None,
+        write_behind: bool | None = None,
+        checkpoint_every: int | None = None,
+        checkpoint_seconds: float | None = None,
+        concurrent: bool | None = None,
+        layout: Layout | str | None = None,
+        storage_policy: StoragePolicy | str | None = None,
+        cache_policy: CachePolicy | str = CachePolicy.LRU,
+        fieldsets: list[str] | None = None,
+        fields: list[str] | None = None,
+        lazy: bool | None = None,
+        max_open_files: int | None = None,
     ):
         """Initialize a TrajectoryStore with various file access modes.
 
@@ -363,6 +1134,62 @@ class TrajectoryStore:
             History for the base NetCDF file. (Global NetCDF attribute.)
         source : str | None, optional
             Source for the base NetCDF file. (Global NetCDF attribute.)
+        write_buffer_size : int | None, optional
+            Number of added trajectories to hold in memory before writing them
+            to the NetCDF files as a single block. Permitted only in CREATE and
+            APPEND modes. Default is None (write each trajectory as it is
+            added).
+        write_buffer_mb : float | None, optional
+            Size in MB of added trajectory data to hold in memory before
+            writing it to the NetCDF files as a single block. Permitted only in
+            CREATE and APPEND modes. May be combined with `write_buffer_size`,
+            in which case the buffer is flushed when either limit is reached.
+        write_behind : bool | None, optional
+            If True, NetCDF writes are done by a dedicated writer thread, so
+            that adding trajectories doesn't wait for them to be compressed
+            and written (see "Buffered writing" in the class documentation).
+            Permitted only in CREATE and APPEND modes. Default is False.
+        checkpoint_every : int | None, optional
+            Number of added trajectories after which the store is committed
+            (see "Checkpointing" in the class documentation). Permitted only
+            in CREATE and APPEND modes. Default is None (commit only when the
+            store is synced or closed).
+        checkpoint_seconds : float | None, optional
+            Time in seconds after which the store is committed when more
+            trajectories are added. Permitted only in CREATE and APPEND
+            modes. May be combined with `checkpoint_every`, in which case the
+            store is committed when either limit is reached.
+        concurrent : bool | None, optional
+            If True in READ mode, the store may be used from multiple threads
+            at once (see "Concurrent reading" in the class documentation).
+            Default is False.
+        layout : TrajectoryStore.Layout | str | None, optional
+            Storage layout for pointwise data in new NetCDF files (see "Storage
+            layouts" in the class documentation). Permitted only in CREATE
+            mode. Default is VLEN.
+        storage_policy : StoragePolicy | str | None, optional
+            Compression and chunking policy for new NetCDF files, or the name
+            of a preset policy ("fast", "balanced" or "archive"). Permitted
+            only in CREATE mode. Default is the "balanced" preset.
+        cache_policy : TrajectoryStore.CachePolicy | str, optional
+            Eviction policy for the trajectory cache (see "Trajectory cache"
+            in the class documentation). Default is LRU.
+        fieldsets : list[str] | None, optional
+            Names of field sets whose fields are read into trajectories (see
+            "Field projection" in the class documentation). Permitted only in
+            READ mode. Default is None (all field sets).
+        fields : list[str] | None, optional
+            Names of individual fields to read into trajectories, in addition
+            to the fields of any field sets given by `fieldsets`. Permitted
+            only in READ mode. Default is None.
+        lazy : bool | None, optional
+            If True in READ mode, trajectories are returned as `LazyTrajectory`
+            views that read each field only when it is first accessed (see
+            "Lazy trajectories" in the class documentation). Default is False.
+        max_open_files : int | None, optional
+            Maximum number of NetCDF files of merged stores to keep open at
+            once in READ mode (see "Merged stores" in the class
+            documentation). Default is 128.
 
         Raises
         ------
@@ -371,15 +1198,19 @@ class TrajectoryStore:
 
         """
 
-        # Check thread activity: must be single-threaded.
-        if TrajectoryStore.active_in_thread is not None:
-            if TrajectoryStore.active_in_thread != threading.get_ident():
-                raise RuntimeError(
-                    'TrajectoryStore: multiple TrajectoryStore instances '
-                    'active in different threads simultaneously.'
-                )
-        else:
-            TrajectoryStore.active_in_thread = threading.get_ident()
+        # Check thread activity: must be single-threaded, unless this is a
+        # read-only store opened for concurrent use. (All NetCDF calls made by
+        # concurrent stores are serialized using the process-wide NetCDF lock.)
+        self.concurrent = bool(concurrent)
+        if not self.concurrent:
+            if TrajectoryStore.active_in_thread is not None:
+                if TrajectoryStore.active_in_thread != threading.get_ident():
+                    raise RuntimeError(
+                        'TrajectoryStore: multiple TrajectoryStore instances '
+                        'active in different threads simultaneously.'
+                    )
+            else:
+                TrajectoryStore.active_in_thread = threading.get_ident()
 
         # File access mode for a TrajectoryStore is fixed: if you need to
         # switch mode, close and reopen the store.
@@ -403,9 +1234,22 @@ class TrajectoryStore:
         # or close.
         self.index_stale = False
 
+        # In-memory copy of the index: parallel arrays of sorted flight IDs and
+        # the corresponding trajectory indexes. Loaded on the first lookup and
+        # kept until the store is closed or reindexed, so that lookups don't
+        # have to go back to the NetCDF file every time.
+        self._index_arrays: tuple[np.ndarray, np.ndarray] | None = None
+
+        # Flight IDs and trajectory indexes of trajectories added since the
+        # last reindex, to be merged into the existing index.
+        self._pending_flight_ids: list[int] = []
+        self._pending_indexes: list[int] = []
+
         # Default values for other attributes.
         self.global_attributes = {}
         self.merged_store = False
+        self.union_store = False
+        self.column_store = False
 
         # Check that all constructor arguments are consistent.
         self._check_constructor_arguments(
@@ -418,28 +1262,62 @@ class TrajectoryStore:
             comment,
             history,
             source,
+            write_buffer_size,
+            write_buffer_mb,
+            write_behind,
+            checkpoint_every,
+            checkpoint_seconds,
+            concurrent,
+            layout,
+            storage_policy,
+            fieldsets,
+            fields,
+            lazy,
+            max_open_files,
         )
 
-        # Trajectories are stored as an LRU cache indexed by the index of the
-        # trajectory. (This is done to handle cases where the trajectory store
-        # is very large and cannot be held in memory all at once.)
+        # Fields read into trajectories for each field set, when the store is
+        # opened with a field projection. (None means all fields of all field
+        # sets.) Set up once the files are open.
+        self._projection: dict[str, list[str]] | None = None
+
+        # Trajectories are stored in a size-limited cache indexed by the index
+        # of the trajectory, with a choice of eviction policy. (This is done to
+        # handle cases where the trajectory store is very large and cannot be
+        # held in memory all at once.) Sizes are measured by the bytes of data
+        # held by each trajectory.
         #
         # A store created with base_file=None is in-memory only. We can switch to
         # a file-backed store using the save method, but in the meantime, the
-        # trajectory cache cannot evict any entries. The custom TrajectoryCache
-        # class has a flag to raise an exception on eviction for this use case.
+        # trajectory cache cannot evict any entries. The custom trajectory
+        # cache classes have a flag to raise an exception on eviction for this
+        # use case.
         #
-        # NOTE: The LRUCache on which TrajectoryCache is based is not
-        # thread-safe, but that's OK because TrajectoryStore isn't thread-safe
-        # anyway, because of the threading problems in the underlying NetCDF
-        # libraries. Our use cases for AEIC do not require TrajectoryStore to
-        # be thread-safe, so we're all good.
-        self._trajectories = TrajectoryCache(
+        # NOTE: The cachetools caches on which the trajectory caches are based
+        # are not thread-safe (even lookups reorder entries), so all cache accesses
+        # that can happen from more than one thread (concurrent stores and
+        # prefetching iteration) are made holding the cache lock.
+        try:
+            self.cache_policy = self.CachePolicy(cache_policy)
+        except ValueError:
+            raise ValueError(f'Unknown cache policy "{cache_policy}"')
+        cache_class = {
+            self.CachePolicy.LRU: TrajectoryCache,
+            self.CachePolicy.LFU: LFUTrajectoryCache,
+            self.CachePolicy.SLRU: SLRUTrajectoryCache,
+        }[self.cache_policy]
+        self._trajectories = cache_class(
             cache_size_mb * 1024 * 1024,
             getsizeof=lambda t: t.nbytes,  # type: ignore
         )
         if self.base_file is None:
             self._trajectories.exception_on_eviction = True
+        self._cache_lock = threading.RLock()
+
+        # Number of trajectories in a store opened in READ mode. This can't
+        # change, so it's determined once on first use, rather than asking the
+        # NetCDF library every time.
+        self._read_length: int | None = None
 
         # List of NetCDF file information structures and mapping from field set
         # names to NetCDF file information. The first entry in self._nc_files is
@@ -463,13 +1341,60 @@ class TrajectoryStore:
         # Whether writing is enabled (CREATE or APPEND mode).
         self._write_enabled = mode in (self.FileMode.CREATE, self.FileMode.APPEND)
 
+        # Hash of the data dictionary shared by all trajectories in the store.
+        # This is fixed by the first trajectory added, and is kept here so that
+        # we don't need to find and hash a prototype trajectory on every add.
+        self._schema_hash: int | None = None
+
+        # Species for the species dimension of the NetCDF files created for
+        # the store. Normally these are the species of the first trajectory
+        # added, but they can be fixed in advance (so that the shards of a
+        # sharded store all get the same species dimension).
+        self._create_species: list[Species] | None = None
+
+        # Write buffer: trajectories that have been added to the store but not
+        # yet written to the NetCDF files. Buffered trajectories always have
+        # consecutive indexes, starting from `_write_buffer_start`, and are
+        # written as a single block per NetCDF variable when the buffer fills
+        # or when the store is synced or closed.
+        self.write_buffer_size = write_buffer_size
+        self.write_buffer_mb = write_buffer_mb
+        self._write_buffer: list[Trajectory] = []
+        self._write_buffer_start = 0
+        self._write_buffer_nbytes = 0
+
+        # Writer thread for write-behind stores. All NetCDF calls for these
+        # stores, from opening or creating the files to closing them, are made
+        # on the writer thread, except for reads, which wait for any queued
+        # writes to finish first.
+        self._writer = _WriteBehind() if write_behind else None
+
+        # Checkpointing: the store is committed every `checkpoint_every`
+        # trajectories and/or every `checkpoint_seconds` seconds. These record
+        # the trajectory count and time of the last commit.
+        self.checkpoint_every = checkpoint_every
+        self.checkpoint_seconds = checkpoint_seconds
+        self._committed_count = 0
+        self._committed_time = time.monotonic()
+
         # Open an existing file or files.
         if mode in (self.FileMode.READ, self.FileMode.APPEND):
             try:
-                if self.merged_store:
-                    self._open_merged()
+                if self._writer is not None:
+                    self._writer.run(self._open)
                 else:
-                    self._open()
+                    with _NETCDF_LOCK:
+                        if self.column_store:
+                            self._open_columns()
+                        elif self.merged_store:
+                            self._open_merged()
+                        else:
+                            self._open()
+                if mode == self.FileMode.APPEND:
+                    self._on_writer(self._truncate_uncommitted)
+                    self._committed_count = self._next_index
+                if fieldsets is not None or fields is not None:
+                    self._projection = self._make_projection(fieldsets, fields)
             except Exception:
                 self.close()
                 raise
@@ -513,6 +1438,19 @@ class TrajectoryStore:
         """
         return self._nc_files
 
+    @property
+    def cache_stats(self) -> CacheStats:
+        """Trajectory cache statistics: hit, miss and eviction counts since
+        the store was opened (or since `reset_cache_stats` was called), and
+        the number and total size of trajectories currently in the cache."""
+        with self._cache_lock:
+            return self._trajectories.stats()
+
+    def reset_cache_stats(self) -> None:
+        """Reset the trajectory cache hit, miss and eviction counts."""
+        with self._cache_lock:
+            self._trajectories.reset_stats()
+
     def save(
         self, base_file: PathType, associated_files: AssociatedFiles | None = None
     ):
@@ -553,8 +1491,11 @@ class TrajectoryStore:
         self._create()
 
         # Write trajectories to the newly created files.
-        for i in range(trajectories_to_save):
-            self._write_trajectory(i)
+        for start in range(0, trajectories_to_save, ADD_MANY_BLOCK_SIZE):
+            stop = min(start + ADD_MANY_BLOCK_SIZE, trajectories_to_save)
+            self._write_block(
+                start=start, items=[self._trajectories[i] for i in range(start, stop)]
+            )
 
         # Once the files have been created successfully and the existing data
         # persisted, we can allow evictions from the trajectory cache.
@@ -566,6 +1507,9 @@ class TrajectoryStore:
         fieldsets: list[str],
         mapping_function: AssociatedFileCreateFn,
         *args,
+        n_workers: int | None = None,
+        species: Iterable[Species] | None = None,
+        storage_policy: StoragePolicy | str | None = None,
         **kwargs,
     ) -> None:
         """Create an associated NetCDF file for additional field sets.
@@ -573,15 +1517,56 @@ class TrajectoryStore:
         This maps a function over all trajectories in the TrajectoryStore to
         create new associated data values, which are immediately written to an
         associated NetCDF file.
+
+        If `n_workers` is greater than one, the mapping is done in parallel in
+        a pool of worker processes, and the result is a merged associated store
+        (so `associated_file` must have the extension ".aeic-store"). The
+        trajectory index range is partitioned across the workers (one part per
+        NetCDF file for a merged base store, or `n_workers` parts for a single
+        file base store), each worker writes one NetCDF file of the merged
+        store, and the files are linked to the base store just as for a single
+        associated file. In this mode, the store must be open in READ mode and
+        `mapping_function` and any additional arguments must be picklable,
+        since worker processes are started using the "spawn" method.
+
+        The chemical species to include in the species dimension of the new
+        files are normally determined from the first result of the mapping
+        function. They may instead be given explicitly using `species`, which
+        guarantees that all files in a merged associated store use the same
+        species dimension without an extra call of the mapping function.
+
+        The new files use the same storage layout as the store, and use the
+        store's storage policy unless a different one is given using
+        `storage_policy` (a `StoragePolicy` or the name of a preset policy).
         """
-        # Check that file doesn't already exist.
         p = Path(associated_file)
+        parallel = n_workers is not None and n_workers > 1
+        if n_workers is not None and n_workers < 1:
+            raise ValueError('n_workers must be at least 1')
+
+        # Check that file doesn't already exist.
         if not p.parent.exists():
             raise ValueError(
                 f'Parent directory of associated NetCDF file "{p}" does not exist'
             )
         if p.exists():
             raise ValueError(f'Associated NetCDF file "{p}" already exists')
+        if parallel:
+            if not p.name.endswith('.aeic-store'):
+                raise ValueError(
+                    f'Merged associated store "{p}" does not have ".aeic-store" suffix'
+                )
+            if self.mode != self.FileMode.READ:
+                raise ValueError(
+                    'Parallel creation of associated files requires a store '
+                    'opened in READ mode'
+                )
+
+        policy = (
+            StoragePolicy.from_spec(storage_policy)
+            if storage_policy is not None
+            else self.storage_policy
+        )
 
         # Check field sets are known.
         for fs_name in fieldsets:
@@ -590,64 +1575,283 @@ class TrajectoryStore:
                     f'FieldSet with name "{fs_name}" not found in FieldSet registry'
                 )
 
-        # We need to call the mapping once to see what chemical species we need
-        # to put in the species dimension int he new NetCDF file.
-        nc_info = None
-
-        for i in range(len(self)):
-            # Create associated data value.
-            associated_data = mapping_function(self[i], *args, **kwargs)
-
-            # Create file: we can only do this once we have one result from the
-            # mapping function, because we need to determine the species we
-            # need to allow in the NetCDF files' species dimension.
-            if nc_info is None:
-                species = set()
-                for fs_name in fieldsets:
-                    fs = FieldSet.from_registry(fs_name)
-                    for f, metadata in fs.fields.items():
-                        if Dimension.SPECIES in metadata.dimensions:
-                            species.update(getattr(associated_data, f).keys())
-
-                nc_info = self._create_nc_file(
-                    associated_file,
-                    set(fieldsets),
-                    sorted(species),
-                    save=False,
-                    associated_name=self._nc_files[0].path[0],
-                    associated_hash=self._nc_files[0].dataset[0].id_hash,
-                )
+        if parallel:
+            assert n_workers is not None
+            self._create_associated_parallel(
+                p,
+                fieldsets,
+                mapping_function,
+                args,
+                kwargs,
+                n_workers,
+                sorted(species) if species is not None else None,
+                policy,
+            )
+            return
 
-            # These are the only checks we're going to do here: the call to
-            # _write_data will fail if any of the fields from the field sets
-            # are missing or of the wrong type.
-            if not isinstance(associated_data, HasFieldSets):
+        # We need a result from the mapping function to see what chemical
+        # species we need to put in the species dimension in the new NetCDF
+        # file, unless we've been told explicitly.
+        results = (
+            mapping_function(traj, *args, **kwargs)
+            for traj in self._iter_range(0, len(self))
+        )
+        if species is None:
+            first = next(results, None)
+            if first is None:
                 raise ValueError(
-                    'Result of mapping_function must implement HasFieldSets protocol'
+                    'Cannot determine species for associated file from empty store'
                 )
-            assoc_field_sets = associated_data.FIELD_SETS
-            assert isinstance(assoc_field_sets, list)
-            if len(assoc_field_sets) != len(fieldsets):
+            species = _associated_species(fieldsets, first)
+            results = itertools.chain([first], results)
+
+        base = self._nc_files[0]
+        nc_info = self._create_nc_file(
+            associated_file,
+            set(fieldsets),
+            sorted(species),
+            save=False,
+            associated_name=base.path[0],
+            associated_hash=base.dataset[0].id_hash,
+            storage_policy=policy,
+        )
+        try:
+            self._write_associated(nc_info, fieldsets, results)
+        finally:
+            with _NETCDF_LOCK:
+                nc_info.dataset[0].close()
+
+    def _create_associated_parallel(
+        self,
+        store_dir: Path,
+        fieldsets: list[str],
+        mapping_function: AssociatedFileCreateFn,
+        args: tuple,
+        kwargs: dict,
+        n_workers: int,
+        species: list[Species] | None,
+        storage_policy: StoragePolicy,
+    ) -> None:
+        """Parallel version of `create_associated`, writing a merged
+        associated store."""
+
+        # Make sure every file in the merged store gets the same species
+        # dimension: if we haven't been given the species, take them from the
+        # mapping function result for the first trajectory.
+        if species is None:
+            if len(self) == 0:
                 raise ValueError(
-                    'Result of mapping_function must contain all field sets '
-                    'specified for associated NetCDF file'
+                    'Cannot determine species for associated file from empty store'
                 )
-            if set(fs.fieldset_name for fs in assoc_field_sets) != set(fieldsets):
-                raise ValueError(
-                    'Field sets in mapping_function result must match field sets '
-                    'specified for associated NetCDF file'
+            species = _associated_species(
+                fieldsets, mapping_function(self[0], *args, **kwargs)
+            )
+
+        # Partition the trajectory index range. Each part becomes one NetCDF
+        # file in the merged associated store, linked to the base NetCDF file
+        # containing the trajectories. For a merged base store, the parts must
+        # match the base store's files so that the two merged stores can be
+        # opened together. (The files of the members of a union store may
+        # have the same names, so they're numbered instead.)
+        base = self._nc[BASE_FIELDSET_NAME]
+        if self.merged_store:
+            bounds = [0, *self._shard_bounds(base)]
+            parts = [
+                (
+                    bounds[k],
+                    bounds[k + 1],
+                    base.path[k],
+                    f'{store_dir.stem}_{k:05d}.nc'
+                    if self.union_store
+                    else base.path[k].name,
                 )
+                for k in range(len(base.path))
+            ]
+        else:
+            bounds = np.linspace(0, len(self), n_workers + 1).astype(int).tolist()
+            parts = [
+                (bounds[k], bounds[k + 1], base.path[0], f'{store_dir.stem}_{k:04d}.nc')
+                for k in range(n_workers)
+                if bounds[k + 1] > bounds[k]
+            ]
 
-            # Write data for field set to associated file.
-            self._write_data(
-                single_nc_file=nc_info,
-                index=i,
-                fieldsets=fieldsets,
-                data=associated_data,
-            )
+        os.mkdir(store_dir)
+        try:
+            ctx = mp.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx) as pool:
+                futures = [
+                    pool.submit(
+                        _create_associated_part,
+                        base_file=self.base_file,
+                        associated_files=self.associated_files,
+                        override=self.override,
+                        force_fieldset_matches=self.force_fieldset_matches,
+                        output_file=store_dir / name,
+                        fieldsets=fieldsets,
+                        species=species,
+                        associated_name=associated_name,
+                        associated_hash=base.dataset[0].id_hash,
+                        storage_policy=storage_policy,
+                        start=start,
+                        stop=stop,
+                        mapping_function=mapping_function,
+                        args=args,
+                        kwargs=kwargs,
+                    )
+                    for start, stop, associated_name, name in parts
+                ]
+                store_data = [
+                    (name, f.result()) for (_, _, _, name), f in zip(parts, futures)
+                ]
+        except BaseException:
+            shutil.rmtree(store_dir, ignore_errors=True)
+            raise
+
+        attrs = self.global_attributes
+        TrajectoryStore._write_merged_metadata(
+            store_dir,
+            store_data,
+            title=attrs.get('title'),
+            comment=attrs.get('comment'),
+            history=attrs.get('history'),
+            source=attrs.get('source'),
+        )
+
+    @staticmethod
+    def map_reduce(
+        store_path: PathType,
+        map_fn: Callable[..., Any],
+        reduce_fn: Callable[[Any, Any], Any],
+        *args,
+        n_workers: int | None = None,
+        associated_files: list[PathType] | None = None,
+        fieldsets: list[str] | None = None,
+        fields: list[str] | None = None,
+        **kwargs,
+    ) -> Any:
+        """Map a function over all trajectories in a store and combine the
+        results, in parallel worker processes.
+
+        `map_fn` is called as `map_fn(trajectory, *args, **kwargs)` for each
+        trajectory, and the results are combined using `reduce_fn(a, b)`,
+        which must be associative (results are always combined in trajectory
+        order, so it need not be commutative). The trajectory index range is
+        split into parts: one per NetCDF file for a merged store, with files
+        holding more than their share of the store (the number of
+        trajectories divided by `n_workers`) split into sub-ranges, and
+        `n_workers` parts for a single NetCDF file. Each part is processed in
+        a process from a pool of `n_workers` worker processes (using the
+        "spawn" start method, so `map_fn` and `reduce_fn` must be picklable,
+        which means defined at module level), which opens the store
+        read-only and reads only the trajectories in its part. The partial
+        results are combined in the calling process.
+
+        If `n_workers` is None or 1, everything is done in the calling
+        process. Associated files to open with the store, and a field
+        projection (see "Field projection" in the class documentation), may
+        be given. Returns None for an empty store.
+        """
+        if n_workers is not None and n_workers < 1:
+            raise ValueError('n_workers must be at least 1')
+        open_kwargs: dict[str, Any] = dict(
+            base_file=store_path,
+            associated_files=associated_files,
+            fieldsets=fieldsets,
+            fields=fields,
+        )
+        parallel = n_workers is not None and n_workers > 1
+        if not parallel:
+            return _map_reduce_part(
+                open_kwargs=open_kwargs,
+                start=None,
+                stop=None,
+                map_fn=map_fn,
+                reduce_fn=reduce_fn,
+                args=args,
+                kwargs=kwargs,
+            )[1]
+
+        # Split the store into parts.
+        assert n_workers is not None
+        with TrajectoryStore.open(**open_kwargs) as ts:
+            nc_files = ts._nc_files[0]
+            bounds = [0, *ts._shard_bounds(nc_files)]
+        target = max(1, -(-bounds[-1] // n_workers))
+        parts = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            nparts = -(-(stop - start) // target)
+            for k in range(nparts):
+                parts.append(
+                    (
+                        start + (stop - start) * k // nparts,
+                        start + (stop - start) * (k + 1) // nparts,
+                    )
+                )
+
+        ctx = mp.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx) as pool:
+            futures = [
+                pool.submit(
+                    _map_reduce_part,
+                    open_kwargs=open_kwargs,
+                    start=start,
+                    stop=stop,
+                    map_fn=map_fn,
+                    reduce_fn=reduce_fn,
+                    args=args,
+                    kwargs=kwargs,
+                )
+                for start, stop in parts
+            ]
+            partials = [f.result() for f in futures]
+
+        result = None
+        have_result = False
+        for have_partial, partial in partials:
+            if not have_partial:
+                continue
+            result = reduce_fn(result, partial) if have_result else partial
+            have_result = True
+        return result
+
+    def _iter_range(self, start: int, stop: int) -> Iterator[Trajectory]:
+        """Iterate over a range of trajectories, reading them in blocks."""
+        for block_start in range(start, stop, ITER_BLOCK_SIZE):
+            yield from self[block_start : min(block_start + ITER_BLOCK_SIZE, stop)]
+
+    def _write_associated(
+        self,
+        nc_info: TrajectoryStore.NcFiles,
+        fieldsets: list[str],
+        results: Iterable[Any],
+    ) -> None:
+        """Write mapping function results for consecutive trajectories to a
+        new associated NetCDF file, a block at a time."""
+        pending: list[Any] = []
+        pending_start = 0
+        for associated_data in results:
+            # These are the only checks we're going to do here: the call to
+            # _write_block will fail if any of the fields from the field sets
+            # are missing or of the wrong type.
+            _check_associated_result(associated_data, fieldsets)
+
+            pending.append(associated_data)
+            if len(pending) >= ADD_MANY_BLOCK_SIZE:
+                self._write_block(
+                    start=pending_start,
+                    items=pending,
+                    single_nc_file=nc_info,
+                    fieldsets=fieldsets,
+                )
+                pending_start += len(pending)
+                pending = []
 
-        assert nc_info is not None
-        nc_info.dataset[0].close()
+        self._write_block(
+            start=pending_start,
+            items=pending,
+            single_nc_file=nc_info,
+            fieldsets=fieldsets,
+        )
 
     @property
     def nc_linked(self) -> bool:
@@ -657,44 +1861,78 @@ class TrajectoryStore:
     def close(self):
         """Close any open NetCDF files associated with the trajectory store."""
 
-        # If we have an index and it's stale, reindex before closing to ensure
-        # consistency.
-        if self.indexable and self.index_stale:
-            self._reindex()
-
-        # If there is a separate index Dataset (also for merged stores), close
-        # it too.
-        self.index_group = None
-        if self.index_dataset is not None:
-            self.index_dataset.close()
-            self.index_dataset = None
-
-        # Close each NetCDF4 Dataset associated with each of the open stores
-        # (there will be multiple Datasets if we're using a merged store).
-        for nc in self._nc_files:
-            for ds in nc.dataset:
-                ds.close()
-
-        # Clear out everything to do with NetCDF4 Datasets we had open.
-        self._nc.clear()
-        self._nc_files.clear()
-
-        # Try to force finalization of NetCDF4 objects.
-        gc.collect()
+        try:
+            # Write out any buffered trajectories.
+            self._flush_write_buffer()
+
+            # If we have an index and it's stale, reindex before closing to
+            # ensure consistency.
+            if self.indexable and self.index_stale:
+                self._on_writer(self._reindex)
+            if self._write_enabled:
+                self._on_writer(self._commit)
+        finally:
+            # The files are closed (on the writer thread, which is then
+            # stopped, for write-behind stores) even if writing failed.
+            self._on_writer(self._close_files)
+            if self._writer is not None:
+                self._writer.shutdown()
+                self._writer = None
+
+    def _close_files(self):
+        """Close the NetCDF files and forget about them."""
+
+        # Closing files (and finalizing NetCDF4 objects) involves NetCDF calls
+        # like anything else, so is done holding the NetCDF lock in case
+        # concurrent stores are in use in other threads.
+        with _NETCDF_LOCK:
+            # If there is a separate index Dataset (also for merged stores),
+            # close it too.
+            self.index_group = None
+            self._index_arrays = None
+            if self.index_dataset is not None:
+                self.index_dataset.close()
+                self.index_dataset = None
+
+            # Close each NetCDF4 Dataset associated with each of the open
+            # stores. (The files of merged stores are opened as needed, so
+            # only the open ones are closed.)
+            for nc in self._nc_files:
+                if isinstance(nc.dataset, list):
+                    for ds in nc.dataset:
+                        ds.close()
+            self._open_files.close()
+
+            # Clear out everything to do with NetCDF4 Datasets we had open.
+            self._nc.clear()
+            self._nc_files.clear()
+
+            # Try to force finalization of NetCDF4 objects.
+            gc.collect()
 
     def sync(self):
         """Synchronize any pending writes to the NetCDF file or files.
 
-        Note that this does not necessarily make the NetCDF files readable by
-        another application because of NetCDF4's finalization behavior. To
-        ensure complete finalization, call close() instead.
+        This also commits the store (see "Checkpointing" in the class
+        documentation). Note that this does not necessarily make the NetCDF
+        files readable by another application because of NetCDF4's
+        finalization behavior. To ensure complete finalization, call close()
+        instead.
         """
         if not self._write_enabled:
             raise RuntimeError('Cannot sync TrajectoryStore not opened in write mode')
 
+        # Write out any buffered trajectories.
+        self._flush_write_buffer()
+
         # If we have an index and it's stale, reindex as part of the sync.
         if self.indexable and self.index_stale:
-            self._reindex()
+            self._on_writer(self._reindex)
+        self._on_writer(self._sync_files)
+
+    def _sync_files(self):
+        """Commit the store and sync the NetCDF files."""
+        self._commit()
 
         # Sync each NetCDF4 Dataset associated with each of the open stores
         # (there will be multiple Datasets if we're using a merged store).
@@ -708,21 +1946,68 @@ class TrajectoryStore:
             self.index_dataset.sync()
 
     def add(self, trajectory: Trajectory) -> int:
-        """Add a trajectory to the store and return its index."""
+        """Add a trajectory to the store and return its index.
+
+        If the store was opened with a write buffer (`write_buffer_size` or
+        `write_buffer_mb`), the trajectory is held in memory and written to
+        the NetCDF files along with other buffered trajectories when the buffer
+        fills or when the store is synced or closed. Otherwise, the trajectory
+        is written immediately (or, for write-behind stores, queued for
+        writing).
+        """
+        index = self._add_to_buffer(trajectory)
+        if self._write_buffer_full():
+            self._flush_write_buffer(wait=False)
+        if self._checkpoint_due():
+            self.sync()
+        return index
+
+    def add_many(self, trajectories: Iterable[Trajectory]) -> list[int]:
+        """Add multiple trajectories to the store and return their indexes.
+
+        Trajectories are written to the NetCDF files in blocks, with a single
+        NetCDF write per variable for each block, which is much faster than
+        adding trajectories one at a time. If the store has no write buffer
+        configured, all trajectories are written (or, for write-behind stores,
+        queued for writing) by the time this method returns; otherwise, the
+        normal write buffer rules apply.
+        """
+        buffered = (
+            self.write_buffer_size is not None or self.write_buffer_mb is not None
+        )
+        indexes = []
+        for trajectory in trajectories:
+            indexes.append(self._add_to_buffer(trajectory))
+            if buffered:
+                if self._write_buffer_full():
+                    self._flush_write_buffer(wait=False)
+            elif len(self._write_buffer) >= ADD_MANY_BLOCK_SIZE:
+                self._flush_write_buffer(wait=False)
+            if self._checkpoint_due():
+                self.sync()
+        if not buffered:
+            self._flush_write_buffer(wait=False)
+        return indexes
+
+    def _add_to_buffer(self, trajectory: Trajectory) -> int:
+        """Check a trajectory, assign it an index and add it to the write
+        buffer."""
         if not self._write_enabled:
             raise RuntimeError(
                 'Cannot add trajectory to TrajectoryStore not opened in write mode'
             )
+        if self._writer is not None:
+            self._writer.check()
 
         # As soon as we've added one trajectory to the store, we have fixed the
         # data schema, which we check for each new trajectory.
-        if len(self._trajectories) > 0:
-            proto = next(iter(self._trajectories.values()))
-            if hash(trajectory) != hash(proto):
-                raise ValueError(
-                    'All trajectories in a TrajectoryStore must have the same '
-                    'data fields'
-                )
+        traj_hash = hash(trajectory)
+        if self._schema_hash is None:
+            self._schema_hash = traj_hash
+        elif traj_hash != self._schema_hash:
+            raise ValueError(
+                'All trajectories in a TrajectoryStore must have the same data fields'
+            )
 
         # Decide on whether or not we can index the store, checking consistency
         # on this decision with each trajectory we add.
@@ -745,40 +2030,194 @@ class TrajectoryStore:
         # If this is the first trajectory added to the store, we might need to
         # create the NetCDF files.
         if self._file_creation_pending:
-            self._create()
+            self._on_writer(self._create)
             self._file_creation_pending = False
 
-        # Write the trajectory data to the output NetCDF file.
-        self._write_trajectory(saved_index)
+        # Queue the trajectory for writing to the output NetCDF files. (An
+        # in-memory store has nothing to write to, so it doesn't buffer.)
+        if self.nc_linked:
+            if len(self._write_buffer) == 0:
+                self._write_buffer_start = saved_index
+            self._write_buffer.append(trajectory)
+            self._write_buffer_nbytes += trajectory.nbytes
 
         # Whenever we add a trajectory, the trajectory index is no longer up to
         # date. For efficiency, we do not reindex immediately, deferring either
         # to close or sync of the store, or to when an index lookup is
-        # requested.
+        # requested. The new flight ID is remembered so that it can be merged
+        # into the existing index then.
         if self.indexable:
             self.index_stale = True
+            self._pending_flight_ids.append(int(trajectory.flight_id))
+            self._pending_indexes.append(saved_index)
 
         return saved_index
 
-    @staticmethod
-    def merge(
-        output_store: PathType,
-        input_stores: list[PathType] | None = None,
-        input_stores_pattern: PathType | None = None,
-        input_stores_index_range: tuple[int, int] | None = None,
-        title: str | None = None,
-        comment: str | None = None,
-        history: str | None = None,
-        source: str | None = None,
-    ) -> None:
-        """Merge multiple `TrajectoryStore` files into a single merged store.
+    def _checkpoint_due(self) -> bool:
+        """Check whether the store should be committed after adding a
+        trajectory."""
+        if not self.nc_linked:
+            return False
+        if (
+            self.checkpoint_every is not None
+            and self._next_index - self._committed_count >= self.checkpoint_every
+        ):
+            return True
+        if (
+            self.checkpoint_seconds is not None
+            and time.monotonic() - self._committed_time >= self.checkpoint_seconds
+        ):
+            return True
+        return False
 
-        The merging is done simply by copying the individual NetCDF files into
-        a directory and creating a metadata JSON file in the same directory to
-        record the metadata about the merged store and its constituent files.
-        (If the store is indexed, a separate NetCDF file is also created to
-        hold the merged index.) The resulting merged store can then be opened
-        in READ mode like any other `TrajectoryStore`. Merged stores must have
+    def _commit(self) -> None:
+        """Record the trajectory count and flight ID watermark in the NetCDF
+        files. (Everything added must have been written already.)"""
+        if not self.nc_linked:
+            return
+        n = self._next_index
+        watermark = -1
+        if self.indexable and n > 0:
+            watermark = int(self._load_index()[0][-1])
+        for nc in self._nc_files:
+            for ds in nc.dataset:
+                ds.committed_trajectories = n
+                ds.committed_flight_id = watermark
+        self._committed_count = n
+        self._committed_time = time.monotonic()
+
+    def _truncate_uncommitted(self) -> None:
+        """Discard trajectories added to the store after the last commit.
+
+        Files with more trajectories than the committed count recorded in the
+        base file are rewritten with just the committed trajectories, and the
+        store is reopened. (NetCDF dimensions can't be shrunk in place.)
+        """
+        base = self._nc_files[0].dataset[0]
+        if 'committed_trajectories' not in base.ncattrs():
+            return
+        n = int(base.committed_trajectories)
+        stale = [nc for nc in self._nc_files if len(nc.traj_dim[0]) > n]
+        if len(stale) == 0:
+            return
+        warnings.warn(
+            f'Discarding {len(stale[0].traj_dim[0]) - n} uncommitted trajectories '
+            f'from TrajectoryStore "{self.base_file}"'
+        )
+
+        rows = np.arange(n, dtype=np.int64)
+        replacements = []
+        try:
+            for src in stale:
+                dataset = src.dataset[0]
+                path = src.path[0]
+                tmp = path.with_name(f'.{path.name}.truncated')
+                tmp.unlink(missing_ok=True)
+                attrs = {k: dataset.getncattr(k) for k in dataset.ncattrs()}
+                dst = self._create_nc_file(
+                    tmp,
+                    set(src.fieldsets),
+                    src.species or [],
+                    associated_name=attrs.get('associated_name'),
+                    associated_hash=attrs.get('associated_hash'),
+                    save=False,
+                    storage_policy=src.storage_policy,
+                    layout=self.Layout(src.layout),
+                )
+                replacements.append((tmp, path))
+                try:
+                    self._copy_rows(src, dst, rows)
+                    out = dst.dataset[0]
+                    for k, v in attrs.items():
+                        if k not in out.ncattrs():
+                            out.setncattr(k, v)
+                    if '_index' in dataset.groups:
+                        flight_ids = dataset.groups[BASE_FIELDSET_NAME].variables[
+                            'flight_id'
+                        ][:n]
+                        _write_index_group(out, np.asarray(flight_ids, np.int64))
+                finally:
+                    dst.dataset[0].close()
+        except BaseException:
+            for tmp, _ in replacements:
+                tmp.unlink(missing_ok=True)
+            raise
+
+        self._close_files()
+        for tmp, path in replacements:
+            os.replace(tmp, path)
+        self._open()
+
+    def _write_buffer_full(self) -> bool:
+        """Check whether the write buffer has reached its flush threshold."""
+        if len(self._write_buffer) == 0:
+            return False
+        if self.write_buffer_size is None and self.write_buffer_mb is None:
+            return True
+        if (
+            self.write_buffer_size is not None
+            and len(self._write_buffer) >= self.write_buffer_size
+        ):
+            return True
+        if (
+            self.write_buffer_mb is not None
+            and self._write_buffer_nbytes >= self.write_buffer_mb * 1024 * 1024
+        ):
+            return True
+        return False
+
+    def _flush_write_buffer(self, wait: bool = True) -> None:
+        """Write all buffered trajectories to the NetCDF files.
+
+        For write-behind stores, the buffered trajectories are queued for the
+        writer thread and, if `wait` is true, this waits until all queued
+        writes are done.
+        """
+        if len(self._write_buffer) > 0:
+            # The buffer is emptied before writing so that a failed write
+            # doesn't get retried (and fail again) when the store is closed.
+            items = self._write_buffer
+            self._write_buffer = []
+            self._write_buffer_nbytes = 0
+            write = functools.partial(
+                self._write_block, start=self._write_buffer_start, items=items
+            )
+            if self._writer is None:
+                with _NETCDF_LOCK:
+                    write()
+            else:
+                self._writer.submit(write)
+        if wait and self._writer is not None:
+            self._writer.wait()
+
+    def _on_writer(self, fn: Callable[[], Any]) -> Any:
+        """Call a function making NetCDF calls: on the writer thread for
+        write-behind stores, directly otherwise. (Either way, the function is
+        called holding the NetCDF lock.)"""
+        if self._writer is None:
+            with _NETCDF_LOCK:
+                return fn()
+        return self._writer.run(fn)
+
+    @staticmethod
+    def merge(
+        output_store: PathType,
+        input_stores: list[PathType] | None = None,
+        input_stores_pattern: PathType | None = None,
+        input_stores_index_range: tuple[int, int] | None = None,
+        title: str | None = None,
+        comment: str | None = None,
+        history: str | None = None,
+        source: str | None = None,
+    ) -> None:
+        """Merge multiple `TrajectoryStore` files into a single merged store.
+
+        The merging is done simply by copying the individual NetCDF files into
+        a directory and creating a metadata JSON file in the same directory to
+        record the metadata about the merged store and its constituent files.
+        (If the store is indexed, a separate NetCDF file is also created to
+        hold the merged index.) The resulting merged store can then be opened
+        in READ mode like any other `TrajectoryStore`. Merged stores must have
         extension `.aeic-store`."""
 
         # Check parameters and normalize input stores list.
@@ -822,7 +2261,28 @@ class TrajectoryStore:
             TrajectoryStore._create_merged_store_index(output_store, input_stores)
 
         # Write metadata JSON file to output directory.
-        data = dict(stores=store_data, created=datetime.now(tz=UTC).isoformat())
+        TrajectoryStore._write_merged_metadata(
+            output_store,
+            store_data,
+            title=title,
+            comment=comment,
+            history=history,
+            source=source,
+        )
+
+    @staticmethod
+    def _write_merged_metadata(
+        output_store: PathType,
+        store_data: list[tuple[str, int]],
+        title: str | None = None,
+        comment: str | None = None,
+        history: str | None = None,
+        source: str | None = None,
+    ) -> None:
+        """Write the metadata JSON file for a merged store."""
+        data: dict[str, Any] = dict(
+            stores=store_data, created=datetime.now(tz=UTC).isoformat()
+        )
         if title is not None:
             data['title'] = title
         if comment is not None:
@@ -834,31 +2294,1314 @@ class TrajectoryStore:
         with open(Path(output_store) / 'metadata.json', 'w') as f:
             json.dump(data, f)
 
+    @staticmethod
+    def extend_merged(store_dir: PathType, new_files: list[PathType]) -> None:
+        """Add more `TrajectoryStore` files to an existing merged store.
+
+        The new files are moved into the merged store directory and listed in
+        its metadata file after the existing files, so the indexes of the
+        trajectories already in the store do not change. The new files must
+        have the same field sets (with the same digests), species dimension,
+        storage layout and associated file attributes as the files already in
+        the store. If the
+        store is indexed, the flight IDs of the new trajectories are merged
+        into the existing index instead of the index being rebuilt.
+
+        As for `merge`, the merged store must not be open while it is being
+        extended.
+        """
+
+        # Check the merged store and the files to be added.
+        store_dir = Path(store_dir)
+        if not str(store_dir).endswith('.aeic-store'):
+            raise ValueError('Merged TrajectoryStore must have ".aeic-store" extension')
+        metadata_file = store_dir / 'metadata.json'
+        if not metadata_file.exists():
+            raise ValueError(f'Metadata file missing from merged store {store_dir}')
+        with open(metadata_file) as f:
+            metadata = json.load(f)
+        stores = metadata.get('stores', [])
+        if len(stores) == 0:
+            raise ValueError(f'No stores listed in metadata file {metadata_file}')
+        names = {s[0] for s in stores}
+        new_paths = [Path(p) for p in new_files]
+        for p in new_paths:
+            if not p.exists():
+                raise ValueError(f'Input TrajectoryStore file "{p}" does not exist')
+            if p.suffix != '.nc':
+                raise ValueError(f'Merge input "{p}" is not a NetCDF file')
+            if p.name in names or (store_dir / p.name).exists():
+                raise ValueError(
+                    f'A file named "{p.name}" is already in merged store {store_dir}'
+                )
+            names.add(p.name)
+
+        TrajectoryStore._register_merged_files(store_dir, new_paths)
+
+    @staticmethod
+    @_holding_netcdf_lock
+    def _register_merged_files(
+        store_dir: Path, new_paths: list[Path], attributes: dict[str, Any] | None = None
+    ) -> None:
+        """Add NetCDF files to the list of files of a merged store.
+
+        Files not already in the store directory are moved there, the flight
+        IDs of their trajectories are merged into the store's index and they
+        are added to the end of the list of files in the metadata file. The
+        new files must have the same field sets (with the same digests),
+        species dimension, storage layout and associated file attributes as
+        the files already in the store. If the store doesn't have a metadata
+        file yet, one is created, with the global `attributes` given.
+
+        The store is locked while this happens, so that processes writing
+        shards of the same store (see `create_sharded`) can add them safely.
+        """
+        with _merged_store_lock(store_dir):
+            metadata_file = store_dir / 'metadata.json'
+            if metadata_file.exists():
+                with open(metadata_file) as f:
+                    metadata = json.load(f)
+            else:
+                metadata = dict(created=datetime.now(tz=UTC).isoformat())
+                metadata.update(
+                    {k: v for k, v in (attributes or {}).items() if v is not None}
+                )
+            stores = metadata.get('stores', [])
+
+            # The new files must match the files already in the store (or the
+            # first new file, for a new store).
+            first = store_dir / stores[0][0] if len(stores) > 0 else new_paths[0]
+            dataset = nc4.Dataset(first, 'r', keepweakref=True)
+            try:
+                signature = _merged_file_signature(dataset, store_dir)
+                indexable = (
+                    (store_dir / '_index.nc').exists()
+                    if len(stores) > 0
+                    else '_index' in dataset.groups
+                )
+            finally:
+                dataset.close()
+
+            # Collect metadata and flight ID index entries for the new files.
+            store_data = []
+            new_ids = []
+            new_idxs = []
+            index_offset = sum(s[1] for s in stores)
+            for p in new_paths:
+                with TrajectoryStore.open(base_file=p) as ts:
+                    signature_p = _merged_file_signature(ts._nc_files[0].dataset[0], p)
+                    if signature_p[-1] != signature[-1]:
+                        raise ValueError(
+                            f'Species dimension of "{p}" does not match merged '
+                            f'store {store_dir}'
+                        )
+                    if signature_p != signature:
+                        raise ValueError(
+                            f'Field sets, storage layout or associated file '
+                            f'attributes of "{p}" do not match merged store '
+                            f'{store_dir}'
+                        )
+                    if (ts.index_group is not None) != indexable:
+                        raise ValueError(
+                            'Either all or none of the input stores must be indexable'
+                        )
+                    if indexable:
+                        ids, idxs = ts._load_index()
+                        new_ids.append(ids)
+                        new_idxs.append(idxs + index_offset)
+                    store_data.append((p.name, len(ts)))
+                    index_offset += len(ts)
+
+            # Move the new files into the store directory.
+            for p in new_paths:
+                if p.resolve().parent != store_dir.resolve():
+                    os.rename(p, store_dir / p.name)
+
+            # Merge the new flight IDs into the index.
+            if indexable and len(new_ids) > 0:
+                TrajectoryStore._extend_merged_store_index(
+                    store_dir, np.concatenate(new_ids), np.concatenate(new_idxs)
+                )
+
+            # The new files become part of the store when the metadata file
+            # lists them, so this is done last. (The file is replaced in one
+            # step, so readers never see a partly written metadata file.)
+            metadata['stores'] = stores + store_data
+            tmp = store_dir / '.metadata.json.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(metadata, f)
+            os.replace(tmp, metadata_file)
+
+    @staticmethod
+    def create_sharded(
+        store_dir: PathType,
+        *,
+        max_trajectories_per_shard: int | None = None,
+        max_bytes_per_shard: int | None = None,
+        shard_prefix: str = 'shard',
+        species: Iterable[Species] | None = None,
+        **kwargs,
+    ) -> ShardedTrajectoryWriter:
+        """Create (or add to) a merged store by writing its NetCDF files
+        directly.
+
+        Trajectories added to the returned `ShardedTrajectoryWriter` are
+        written to NetCDF files ("shards") in the merged store directory
+        `store_dir` (which must have the extension ".aeic-store", and is
+        created if it doesn't exist). When a shard reaches
+        `max_trajectories_per_shard` trajectories or `max_bytes_per_shard`
+        bytes of trajectory data (measured as for the trajectory cache, so
+        before compression), it is closed and added to the merged store,
+        updating the store's metadata file and flight ID index, and the next
+        trajectory starts a new shard. The last shard is added when the writer
+        is closed. If neither limit is given, shards hold up to 100000
+        trajectories. There is no separate merge step: the merged store can be
+        opened for reading as soon as the writer is closed (and shards that
+        have already been added can be read before that: the metadata and
+        index files are replaced in one step each, so readers never see them
+        partly written).
+
+        Shards are named `{shard_prefix}_{n:05d}.nc`. Several processes can
+        write shards of the same merged store at the same time, as long as
+        each uses a different `shard_prefix`: shards are added to the store
+        holding a lock on it, in whichever order they're finished, so
+        trajectory indexes in the merged store follow that order.
+
+        All the files of a merged store must have the same species dimension.
+        The species are taken from the first trajectory added to the writer,
+        or may be given explicitly using `species`, which is needed when
+        several processes write shards of the same store. Trajectories with
+        species outside the species dimension can't be added.
+
+        Any other keyword arguments (e.g., `layout`, `storage_policy`,
+        `write_buffer_size`, `title`) are passed to `TrajectoryStore.create`
+        for each shard. Global attributes also go into the merged store's
+        metadata file when it is created. Associated files can't be written
+        this way.
+        """
+        for arg in ('base_file', 'mode', 'associated_files'):
+            if arg in kwargs:
+                raise ValueError(f'{arg} may not be given for a sharded store')
+        if not str(store_dir).endswith('.aeic-store'):
+            raise ValueError('Merged TrajectoryStore must have ".aeic-store" extension')
+        if max_trajectories_per_shard is not None and max_trajectories_per_shard < 1:
+            raise ValueError('max_trajectories_per_shard must be at least 1')
+        if max_bytes_per_shard is not None and max_bytes_per_shard <= 0:
+            raise ValueError('max_bytes_per_shard must be positive')
+        if max_trajectories_per_shard is None and max_bytes_per_shard is None:
+            max_trajectories_per_shard = EXPORT_SHARD_SIZE
+        store_dir = Path(store_dir)
+        if store_dir.exists() and not store_dir.is_dir():
+            raise ValueError(f'Merged store "{store_dir}" is not a directory')
+        if not store_dir.parent.exists():
+            raise ValueError(
+                f'Parent directory of merged store "{store_dir}" does not exist'
+            )
+        store_dir.mkdir(exist_ok=True)
+        return ShardedTrajectoryWriter(
+            store_dir,
+            max_trajectories_per_shard,
+            max_bytes_per_shard,
+            shard_prefix,
+            kwargs,
+            sorted(species) if species is not None else None,
+        )
+
+    @staticmethod
+    @_holding_netcdf_lock
+    def union(
+        output: PathType,
+        members: list[PathType],
+        title: str | None = None,
+        comment: str | None = None,
+        history: str | None = None,
+        source: str | None = None,
+    ) -> None:
+        """Create a union store combining existing stores without moving them.
+
+        The union store is a NetCDF manifest file `output` (which must have
+        the extension ".aeic-union") listing the member stores, which may be
+        single NetCDF files or merged stores, by path (made absolute), along
+        with the field set hash and trajectory count of each. If all the
+        members are indexable, the manifest also holds a flight ID index
+        combining the members' indexes. No trajectory data is copied, so the
+        union can be created as quickly as the members' indexes can be read.
+
+        The members must have the same field sets (with the same digests),
+        species dimension, storage layout and associated file attributes. The
+        union store can be opened in READ mode like a merged store (see
+        "Union stores" in the class documentation).
+        """
+        output = Path(output)
+        if not output.name.endswith(UNION_STORE_SUFFIX):
+            raise ValueError(
+                f'Union TrajectoryStore must have "{UNION_STORE_SUFFIX}" extension'
+            )
+        if output.exists():
+            raise ValueError(f'Output file {output} already exists')
+        if not output.parent.exists():
+            raise ValueError(f'Parent directory of file {output} does not exist')
+        paths = [Path(m).resolve() for m in members]
+        if len(paths) == 0:
+            raise ValueError('No member stores given for union store')
+        if len(paths) != len(set(paths)):
+            raise ValueError('Member store paths must be distinct')
+
+        # Collect the members' trajectory counts and indexes, and check that
+        # they match each other.
+        member_data = []
+        flight_ids = []
+        trajectory_indexes = []
+        signature = None
+        index_offset = 0
+        for p in paths:
+            signature_p, count, index = _union_member(p)
+            if signature is None:
+                signature = signature_p
+            elif signature_p[-1] != signature[-1]:
+                raise ValueError(
+                    f'Species dimension of member store "{p}" does not match '
+                    f'the other members'
+                )
+            elif signature_p != signature:
+                raise ValueError(
+                    f'Field sets, storage layout or associated file attributes '
+                    f'of member store "{p}" do not match the other members'
+                )
+            member_data.append(dict(path=str(p), id_hash=signature[2], count=count))
+            if index is not None:
+                flight_ids.append(index[0])
+                trajectory_indexes.append(index[1] + index_offset)
+            index_offset += count
+        indexable = len(flight_ids) == len(paths)
+        if not indexable and len(flight_ids) > 0:
+            raise ValueError(
+                'Either all or none of the member stores must be indexable'
+            )
+
+        # Write the manifest, with the combined flight ID index.
+        dataset = nc4.Dataset(output, 'w', keepweakref=True)
+        try:
+            dataset.members = json.dumps(member_data)
+            dataset.created = datetime.now(tz=UTC).isoformat()
+            for attr, value in (
+                ('title', title),
+                ('comment', comment),
+                ('history', history),
+                ('source', source),
+            ):
+                if value is not None:
+                    setattr(dataset, attr, value)
+            dataset.createDimension('trajectory', None)
+            if indexable:
+                _write_index_group(
+                    dataset,
+                    np.concatenate(flight_ids),
+                    np.concatenate(trajectory_indexes),
+                )
+        except BaseException:
+            dataset.close()
+            output.unlink()
+            raise
+        dataset.close()
+
+    def export(
+        self,
+        output: PathType,
+        *,
+        layout: Layout | str | None = None,
+        storage_policy: StoragePolicy | str | None = None,
+        shard_size: int | None = None,
+    ) -> None:
+        """Copy the contents of the store to a new store in another format.
+
+        The format of the new store is determined by the name of `output`:
+
+        - ".aeic-columns": a memory-mapped column store (see "Column stores"
+          in the class documentation);
+        - ".aeic-store": a merged store, with `shard_size` trajectories in
+          each NetCDF file (default 100000);
+        - anything else: a single NetCDF file.
+
+        All field sets of the store (including those from associated files)
+        are written to the new store. For NetCDF output, the storage layout
+        and storage policy of the new files may be given, and default to
+        those of this store. This is the way to convert column stores back to
+        NetCDF files.
+        """
+        p = Path(output)
+        if p.exists():
+            raise ValueError(f'Output store "{p}" already exists')
+        if not p.parent.exists():
+            raise ValueError(f'Parent directory of output store "{p}" does not exist')
+        if self._write_enabled:
+            self._flush_write_buffer()
+
+        if p.name.endswith(COLUMN_STORE_SUFFIX):
+            if layout is not None or storage_policy is not None:
+                raise ValueError(
+                    'layout and storage_policy may not be given for column stores'
+                )
+            self._export_columns(p)
+            return
+
+        kwargs: dict[str, Any] = dict(
+            layout=layout if layout is not None else self.layout,
+            storage_policy=(
+                storage_policy if storage_policy is not None else self.storage_policy
+            ),
+            **{
+                k: v
+                for k, v in self.global_attributes.items()
+                if k in ('title', 'comment', 'history', 'source')
+            },
+        )
+        if not p.name.endswith('.aeic-store'):
+            with TrajectoryStore.create(base_file=p, **kwargs) as ts:
+                ts.add_many(self._iter_range(0, len(self)))
+            return
+
+        # For a merged store, write the NetCDF files in a temporary directory
+        # next to the output, then merge them.
+        shard_size = shard_size if shard_size is not None else EXPORT_SHARD_SIZE
+        if shard_size < 1:
+            raise ValueError('shard_size must be at least 1')
+        tmp_dir = Path(tempfile.mkdtemp(dir=p.parent, prefix=f'.{p.name}-'))
+        try:
+            shards = []
+            for k, start in enumerate(range(0, len(self), shard_size)):
+                shards.append(tmp_dir / f'{p.stem}_{k:04d}.nc')
+                with TrajectoryStore.create(base_file=shards[-1], **kwargs) as ts:
+                    ts.add_many(
+                        self._iter_range(start, min(start + shard_size, len(self)))
+                    )
+            TrajectoryStore.merge(
+                output_store=p,
+                input_stores=shards,  # type: ignore[arg-type]
+                title=kwargs.get('title'),
+                comment=kwargs.get('comment'),
+                history=kwargs.get('history'),
+                source=kwargs.get('source'),
+            )
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def _export_columns(self, output: Path) -> None:
+        """Write the contents of the store to a new column store."""
+        n = len(self)
+        fieldsets = [
+            FieldSet.from_registry(fs_name)
+            for fs_name in sorted(self._nc, key=lambda s: (s != BASE_FIELDSET_NAME, s))
+        ]
+
+        # Offsets of the first point of each trajectory in pointwise column
+        # files. All pointwise fields have the same number of points for a
+        # trajectory, so these can be found from any required pointwise field.
+        pointwise = [
+            (fs, name)
+            for fs in fieldsets
+            for name, metadata in fs.items()
+            if Dimension.POINT in metadata.dimensions
+        ]
+        offsets = None
+        if len(pointwise) > 0:
+            fs, name = next(
+                ((fs, name) for fs, name in pointwise if fs[name].required),
+                pointwise[0],
+            )
+            sizes = [np.zeros(1, dtype=np.int64)]
+            for start in range(0, n, EXPORT_BLOCK_SIZE):
+                rows = slice(start, min(start + EXPORT_BLOCK_SIZE, n))
+                data = self.read_field(name, rows)
+                if isinstance(data, SpeciesValues):
+                    data = next(iter(data.values()))
+                assert isinstance(data, RaggedArray)
+                sizes.append(data.row_sizes)
+            offsets = np.cumsum(np.concatenate(sizes))
+
+        writer = ColumnStoreWriter(output, n, offsets)
+        try:
+            for fs in fieldsets:
+                species = self._nc[fs.fieldset_name].species or []
+                for name, metadata in fs.items():
+                    column = writer.create_field(
+                        fs.fieldset_name, name, metadata, len(species)
+                    )
+                    if column is None:
+                        values = self.read_field(name)
+                        writer.write_strings(fs.fieldset_name, name, list(values))
+                        continue
+                    for start in range(0, n, EXPORT_BLOCK_SIZE):
+                        stop = min(start + EXPORT_BLOCK_SIZE, n)
+                        _write_column_block(
+                            column,
+                            self.read_field(name, slice(start, stop)),
+                            species,
+                            offsets,
+                            start,
+                            stop,
+                            metadata,
+                        )
+                    if isinstance(column, np.memmap):
+                        column.flush()
+                    del column
+
+            if self.indexable:
+                writer.write_index(*self._load_index())
+            attrs = {
+                k: (v.isoformat() if isinstance(v, datetime) else v)
+                for k, v in self.global_attributes.items()
+                if v is not None
+            }
+            fs_names = [fs.fieldset_name for fs in fieldsets]
+            fs_hashes = [fs.digest for fs in fieldsets]
+            m = hashlib.md5()
+            for h in fs_hashes:
+                m.update(h.encode('utf-8'))
+            writer.finish(
+                fieldset_names=fs_names,
+                fieldset_hashes=fs_hashes,
+                id_hash=m.hexdigest(),
+                layout=str(self.layout),
+                storage_policy=self.storage_policy.to_json(),
+                species={
+                    fs.fieldset_name: _species_names(self._nc[fs.fieldset_name].species)
+                    for fs in fieldsets
+                },
+                attributes=attrs,
+                indexable=bool(self.indexable),
+            )
+        except BaseException:
+            shutil.rmtree(output, ignore_errors=True)
+            raise
+
+    def subset(
+        self,
+        output: PathType,
+        where: Callable[[Mapping[str, Any]], Any] | Iterable[int] | np.ndarray,
+        *,
+        associated_files: list[PathType] | None = None,
+    ) -> int:
+        """Copy selected trajectories to a new store.
+
+        Parameters
+        ----------
+        output : PathType
+            Path of the base NetCDF file for the new store.
+        where : Callable | set[int] | np.ndarray
+            Trajectories to copy. A callable is called once with a read-only
+            mapping from field names to the values of the fields for all
+            trajectories in the store (as returned by `read_field`, and only
+            read when used) and must return a boolean mask over the store,
+            for example ``lambda f: f['total_fuel_mass'] > 1000``. A set of
+            flight IDs selects those flights (IDs not in the store are
+            ignored). Anything else is a boolean mask or a sequence of
+            trajectory indexes.
+        associated_files : list[PathType] | None, optional
+            Paths for new associated files, one for each associated file
+            that the store was opened with, in the same order. Each new file
+            holds the same field sets as the file it's copied from and is
+            linked to the new base file. Default is None: only the field sets
+            in the base file are copied.
+
+        Returns
+        -------
+        int
+            The number of trajectories copied.
+
+        The selected trajectories keep their order from this store. They are
+        copied with block reads and writes of the NetCDF variables, field set
+        by field set, without constructing `Trajectory` values, so this is
+        much faster than adding trajectories read from this store to a new
+        one. The new files use the storage layouts and storage policies of
+        the files they are copied from, and a new store made from an
+        indexable store gets a new flight ID index. The subset of a merged
+        store is a single NetCDF file (`export` can turn it into a merged
+        store if needed). Column stores can't be subsetted directly: export
+        them to NetCDF first.
+        """
+        if self.column_store:
+            raise ValueError(
+                'Cannot take subset of column store: export it to NetCDF first'
+            )
+        if not self.nc_linked:
+            raise RuntimeError('subset requires a store linked to NetCDF files')
+        if self._write_enabled:
+            self._flush_write_buffer()
+
+        paths = self._output_paths(output, associated_files, 'subset')
+        rows = self._subset_rows(where)
+
+        self._write_rows(paths, rows)
+        return len(rows)
+
+    def _output_paths(
+        self, output: PathType, associated_files: list[PathType] | None, what: str
+    ) -> list[Path]:
+        """Check the output paths for `subset` or `compact`: there must be one
+        for each associated file if there are any, none of them may exist yet,
+        and all of them must be different."""
+        sources = self._nc_files if associated_files is not None else self._nc_files[:1]
+        paths = [Path(output), *(Path(p) for p in associated_files or [])]
+        if len(paths) != len(sources):
+            raise ValueError(
+                f'Expected {len(sources) - 1} associated output files for {what}, '
+                f'got {len(paths) - 1}'
+            )
+        for p in paths:
+            if p.exists():
+                raise ValueError(f'Output file "{p}" already exists')
+            if not p.parent.exists():
+                raise ValueError(
+                    f'Parent directory of output file "{p}" does not exist'
+                )
+        if len({p.resolve() for p in paths}) != len(paths):
+            raise ValueError(f'Output files for {what} must be distinct')
+        return paths
+
+    def _write_rows(
+        self,
+        paths: list[Path],
+        rows: np.ndarray,
+        layout: Layout | None = None,
+        storage_policy: StoragePolicy | None = None,
+    ) -> None:
+        """Write the trajectories at the given indexes, in order, to a new
+        base NetCDF file and new associated files for the first few associated
+        files of the store.
+
+        The new files use the given storage layout and storage policy, or
+        those of the files they're copied from. If anything goes wrong, the
+        new files are removed.
+        """
+        flight_ids = (
+            np.asarray(self.read_field('flight_id', rows), dtype=np.int64)
+            if self.indexable
+            else None
+        )
+        created: list[TrajectoryStore.NcFiles] = []
+        try:
+            for path, src in zip(paths, self._nc_files):
+                base = created[0] if len(created) > 0 else None
+                dst = self._create_nc_file(
+                    path,
+                    set(src.fieldsets),
+                    src.species or [],
+                    associated_name=base.path[0] if base is not None else None,
+                    associated_hash=(
+                        base.dataset[0].id_hash if base is not None else None
+                    ),
+                    save=False,
+                    storage_policy=(
+                        storage_policy
+                        if storage_policy is not None
+                        else src.storage_policy
+                    ),
+                    layout=layout if layout is not None else self.Layout(src.layout),
+                )
+                created.append(dst)
+                with _NETCDF_LOCK:
+                    self._copy_rows(src, dst, rows)
+
+            # The new base file gets its own creation time and, if this store
+            # is indexable, a flight ID index for the copied trajectories.
+            with _NETCDF_LOCK:
+                dataset = created[0].dataset[0]
+                dataset.created = datetime.now(UTC).astimezone().isoformat()
+                if flight_ids is not None:
+                    _write_index_group(dataset, flight_ids)
+        except BaseException:
+            with _NETCDF_LOCK:
+                for nc_info in created:
+                    nc_info.dataset[0].close()
+            for p in paths[: len(created)]:
+                p.unlink(missing_ok=True)
+            raise
+        with _NETCDF_LOCK:
+            for nc_info in created:
+                nc_info.dataset[0].close()
+
+    def _subset_rows(
+        self, where: Callable[[Mapping[str, Any]], Any] | Iterable[int] | np.ndarray
+    ) -> np.ndarray:
+        """Find the sorted unique trajectory indexes selected by the `where`
+        argument of `subset`."""
+        if callable(where):
+            mask = np.asarray(where(_FieldColumns(self)))
+            if mask.dtype != np.bool_ or mask.shape != (len(self),):
+                raise ValueError(
+                    'subset predicate must return a boolean mask over the store'
+                )
+            return np.flatnonzero(mask).astype(np.int64)
+        if isinstance(where, set | frozenset):
+            idxs = self.flight_indices(np.fromiter(where, np.int64, len(where)))
+            return np.unique(idxs[idxs >= 0])
+        return np.unique(_normalize_indices(where, len(self)))  # type: ignore[arg-type]
+
+    def compact(
+        self,
+        output: PathType,
+        key: str | Mapping[int, Any] | Sequence[Any] | np.ndarray = 'flight_id',
+        *,
+        associated_files: list[PathType] | None = None,
+        layout: Layout | str | None = None,
+        storage_policy: StoragePolicy | str | None = None,
+        shard_size: int | None = None,
+        n_workers: int = 1,
+    ) -> None:
+        """Copy the store to a new store with the trajectories sorted by a key.
+
+        Trajectories are written to stores in the order that they're
+        simulated, which scatters trajectories with the same aircraft type,
+        route or departure date through the store. After compaction, all the
+        trajectories with a given key value (or range of values) are
+        consecutive in the new store, so reading them reads contiguous blocks
+        of the NetCDF files.
+
+        Parameters
+        ----------
+        output : PathType
+            Path of the new store: a merged store if the name ends with
+            ".aeic-store", and a single NetCDF file otherwise.
+        key : str | Mapping[int, Any] | Sequence[Any] | np.ndarray, optional
+            Sort key. As for the `by` argument of `aggregate`, this may be the
+            name of a per-trajectory field of the store; a mapping from flight
+            ID to key (for example, aircraft type or departure time from the
+            mission database), joined to the trajectories by their
+            `flight_id` field, with trajectories whose flight IDs are not in
+            the mapping sorted last; or a key for each trajectory.
+            Trajectories with equal keys keep their order from this store.
+            Default is "flight_id".
+        associated_files : list[PathType] | None, optional
+            Paths for new associated files, one for each associated file that
+            the store was opened with, as for `subset`. For merged store
+            output, these must be merged stores too, with each NetCDF file
+            linked to the matching file of the new base store. Default is
+            None: only the field sets in the base file are copied.
+        layout : Layout | str | None, optional
+            Storage layout for the new files. Default is None (the layout of
+            the files they're copied from).
+        storage_policy : StoragePolicy | str | None, optional
+            Storage policy (or the name of a preset policy) for the new files.
+            Default is None (the policy of the files they're copied from).
+        shard_size : int | None, optional
+            Trajectories per NetCDF file for merged store output (default
+            100000).
+        n_workers : int, optional
+            Number of worker processes writing the NetCDF files of merged
+            store output. Default is 1 (the files are written by this
+            process).
+
+        The data is copied with block reads and writes of the NetCDF
+        variables, as for `subset`. Single NetCDF file output is always
+        written by this process: use merged store output to spread the work
+        over more processes, each one reading its share of the sorted
+        trajectories and writing its own files.
+        """
+        if self.column_store:
+            raise ValueError('Cannot compact column store: export it to NetCDF first')
+        if not self.nc_linked:
+            raise RuntimeError('compact requires a store linked to NetCDF files')
+        if self._write_enabled:
+            self._flush_write_buffer()
+
+        paths = self._output_paths(output, associated_files, 'compact')
+        merged = paths[0].name.endswith('.aeic-store')
+        if any(p.name.endswith('.aeic-store') != merged for p in paths):
+            raise ValueError(
+                'Output files for compact must either all be merged stores or all '
+                'be single NetCDF files'
+            )
+        if n_workers < 1:
+            raise ValueError('n_workers must be at least 1')
+        if not merged and (n_workers > 1 or shard_size is not None):
+            raise ValueError(
+                'n_workers and shard_size may only be given for merged store '
+                '(".aeic-store") output'
+            )
+        shard_size = shard_size if shard_size is not None else EXPORT_SHARD_SIZE
+        if shard_size < 1:
+            raise ValueError('shard_size must be at least 1')
+        new_layout = self.Layout(layout) if layout is not None else None
+        policy = (
+            StoragePolicy.from_spec(storage_policy)
+            if storage_policy is not None
+            else None
+        )
+
+        rows = self._sort_order(key)
+        if not merged:
+            self._write_rows(paths, rows, new_layout, policy)
+            return
+
+        # Each part of the sorted trajectories becomes one NetCDF file in each
+        # of the output merged stores, with the same name in each.
+        parts = [
+            (f'{paths[0].stem}_{k:04d}.nc', rows[start : start + shard_size])
+            for k, start in enumerate(range(0, max(len(rows), 1), shard_size))
+        ]
+        for p in paths:
+            os.mkdir(p)
+        try:
+            if n_workers == 1:
+                for name, part in parts:
+                    self._write_rows(
+                        [p / name for p in paths], part, new_layout, policy
+                    )
+            else:
+                fieldsets = [
+                    FieldSet.from_registry(fs_name)
+                    for nc_files in self._nc_files
+                    for fs_name in sorted(nc_files.fieldsets)
+                ]
+                ctx = mp.get_context('spawn')
+                with ProcessPoolExecutor(max_workers=n_workers, mp_context=ctx) as pool:
+                    futures = [
+                        pool.submit(
+                            _compact_part,
+                            base_file=self.base_file,
+                            associated_files=self.associated_files,
+                            override=self.override,
+                            force_fieldset_matches=self.force_fieldset_matches,
+                            fieldsets=fieldsets,
+                            outputs=[p / name for p in paths],
+                            rows=part,
+                            layout=new_layout,
+                            storage_policy=policy,
+                        )
+                        for name, part in parts
+                    ]
+                    for f in futures:
+                        f.result()
+
+            attrs = self.global_attributes
+            for p in paths:
+                TrajectoryStore._write_merged_metadata(
+                    p,
+                    [(name, len(part)) for name, part in parts],
+                    title=attrs.get('title'),
+                    comment=attrs.get('comment'),
+                    history=attrs.get('history'),
+                    source=attrs.get('source'),
+                )
+            if self.indexable:
+                TrajectoryStore._create_merged_store_index(
+                    paths[0],
+                    [name for name, _ in parts],  # type: ignore[misc]
+                )
+        except BaseException:
+            for p in paths:
+                shutil.rmtree(p, ignore_errors=True)
+            raise
+
+    def _sort_order(
+        self, key: str | Mapping[int, Any] | Sequence[Any] | np.ndarray
+    ) -> np.ndarray:
+        """Trajectory indexes in order of the `key` argument of `compact`,
+        using a stable sort."""
+        if isinstance(key, str):
+            keys = self.read_field(key)
+            if not isinstance(keys, np.ndarray) or keys.ndim != 1:
+                raise ValueError(f'Cannot sort by field "{key}"')
+            return np.argsort(keys, kind='stable')
+
+        # Sort joined keys by rank among the distinct keys, with the group of
+        # trajectories with no key (labelled None) last.
+        labels, codes = self._aggregate_groups(key, None)
+        assert codes is not None
+        if len(codes) != len(self):
+            raise ValueError('Sort keys must be given for each trajectory')
+        ranked = sorted(
+            range(len(labels)), key=lambda g: (labels[g] is None, labels[g])
+        )
+        rank = np.empty(len(labels), dtype=np.int64)
+        rank[ranked] = np.arange(len(labels))
+        return np.argsort(rank[codes], kind='stable')
+
+    def _copy_rows(self, src: NcFiles, dst: NcFiles, rows: np.ndarray) -> None:
+        """Copy the trajectories at the given indexes from a set of NetCDF
+        files of this store to consecutive indexes of a new file with the same
+        field sets, a block at a time.
+
+        The indexes may be in any order. Each block is read in sorted order,
+        one file at a time, and rearranged in memory before writing. The new
+        file may use a different storage layout from the store's files.
+        """
+        points = dict.fromkeys(src.fieldsets, 0)
+        fieldsets = {
+            fs_name: FieldSet.from_registry(fs_name) for fs_name in src.fieldsets
+        }
+        for start in range(0, len(rows), EXPORT_BLOCK_SIZE):
+            block = rows[start : start + EXPORT_BLOCK_SIZE]
+            stop = start + len(block)
+            uniq, inverse = np.unique(block, return_inverse=True)
+            if np.all(np.diff(block) > 0):
+                # (Blocks of sorted indexes need no rearranging.)
+                inverse = None
+            plan = self._plan_reads(src, uniq)
+            for fs_name, fs in fieldsets.items():
+                group = dst.groups[fs_name][0]
+                flat = '_row_size' in group.variables
+                data, sizes = _join_group_rows(
+                    fs,
+                    [
+                        _read_group_rows(src.groups[fs_name][i], fs, local, flat)
+                        for i, local in plan
+                    ],
+                    inverse,
+                )
+                points[fs_name] += _write_group_rows(
+                    group, fs, len(block), data, sizes, start, points[fs_name]
+                )
+            dst.traj_var[0][start:stop] = np.arange(start, stop)
+
     def get_flight(self, flight_id: int) -> Trajectory | None:
         """Lookup a trajectory by flight ID."""
+        idx = int(self.flight_indices(np.array([flight_id]))[0])
+        if idx < 0:
+            return None
+        return self[idx]
+
+    def get_flights(self, flight_ids: Iterable[int]) -> list[Trajectory | None]:
+        """Lookup trajectories for many flight IDs at once.
+
+        Parameters
+        ----------
+        flight_ids : Iterable[int]
+            Flight IDs to look up.
+
+        Returns
+        -------
+        list[Trajectory | None]
+            Trajectories in the same order as `flight_ids`, with `None` for
+            any flight ID that isn't in the store.
+
+        The trajectories that are found are read in a single bulk operation
+        (see `__getitem__` with an index array), which is much faster than
+        calling `get_flight` in a loop.
+        """
+        idxs = self.flight_indices(flight_ids)
+        found = idxs >= 0
+        result: list[Trajectory | None] = [None] * len(idxs)
+        for pos, traj in zip(np.flatnonzero(found), self._get_many(idxs[found])):
+            result[pos] = traj
+        return result
+
+    def flight_ids(self) -> np.ndarray:
+        """Flight IDs of all trajectories in the store, in increasing order.
+
+        A simulation run resuming after an interruption (see "Checkpointing"
+        in the class documentation) can use this to skip the flights that are
+        already in the store.
+        """
+        return self._load_index()[0].copy()
+
+    def flight_indices(self, flight_ids: Iterable[int]) -> np.ndarray:
+        """Map flight IDs to trajectory indexes in the store.
+
+        Parameters
+        ----------
+        flight_ids : Iterable[int]
+            Flight IDs to look up.
+
+        Returns
+        -------
+        np.ndarray
+            Integer array of trajectory indexes, in the same order as
+            `flight_ids`, with -1 for flight IDs that aren't in the store. If
+            a flight ID appears more than once in the store, the index of one
+            of the matching trajectories is returned.
+        """
+        ids = np.asarray(
+            flight_ids if isinstance(flight_ids, np.ndarray) else list(flight_ids),
+            dtype=np.int64,
+        )
+        if ids.ndim != 1:
+            raise ValueError('flight IDs must be a one-dimensional sequence')
+        sorted_ids, traj_idxs = self._load_index()
+
+        # Binary search all the flight IDs at once, then check which ones we
+        # really found.
+        pos = np.searchsorted(sorted_ids, ids)
+        in_range = pos < len(sorted_ids)
+        found = in_range.copy()
+        found[in_range] = sorted_ids[pos[in_range]] == ids[in_range]
+        result = np.full(len(ids), -1, dtype=np.int64)
+        result[found] = traj_idxs[pos[found]]
+        return result
+
+    def _load_index(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return the flight ID index as in-memory arrays.
+
+        The flight IDs and trajectory indexes are stored in parallel in the
+        index group (in the base NetCDF file or, for merged stores, in the
+        separate `_index.nc` file), sorted by flight ID. We read them once and
+        cache them until the store is reindexed.
+        """
         if not self.indexable:
             raise RuntimeError('Cannot lookup by flight_id in non-indexable store')
 
         # Reindex lazily if needed.
         if self.index_stale:
-            self._reindex()
-
-        # The flight IDs and trajectory indexes are stored in parallel in the
-        # index group.
+            self._on_writer(self._reindex)
+
+        if self._index_arrays is None:
+            sorted_ids, traj_idxs = self._read_index_group()
+
+            # Files are added to merged stores by replacing the index file
+            # before the metadata file, so a reader that opened the store in
+            # between sees index entries for trajectories it doesn't have.
+            if self.merged_store and len(traj_idxs) > 0:
+                keep = traj_idxs < len(self)
+                if not keep.all():
+                    sorted_ids, traj_idxs = sorted_ids[keep], traj_idxs[keep]
+            self._index_arrays = (sorted_ids, traj_idxs)
+        return self._index_arrays
+
+    def _read_index_group(
+        self, length: int | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Read the flight ID index from the index group.
+
+        The index variables share the trajectory dimension with the data, so
+        once new trajectories have been written they extend past the end of
+        the index. In that case `length` gives the number of entries that
+        were indexed.
+        """
         assert self.index_group is not None
-        flight_ids = self.index_group.variables['flight_id'][:]
-        traj_idxs = self.index_group.variables['trajectory_index'][:]
+        with _NETCDF_LOCK:
+            vs = self.index_group.variables
+            return (
+                np.asarray(vs['flight_id'][:length], dtype=np.int64),
+                np.asarray(vs['trajectory_index'][:length], dtype=np.int64),
+            )
 
-        # Binary search in the flight IDs.
-        idx = bisect.bisect_left(flight_ids, flight_id)
+    def read_field(
+        self, name: str, indices: Sequence[int] | np.ndarray | slice | None = None
+    ) -> np.ndarray | RaggedArray | SpeciesValues:
+        """Read values of a single field for many trajectories at once.
 
-        # Check that we really found the flight ID.
-        if idx >= len(flight_ids) or flight_ids[idx] != flight_id:
-            return None
+        This reads the NetCDF variable holding the field in contiguous blocks
+        (one block per run of nearby indexes in each underlying NetCDF file)
+        without constructing `Trajectory` values, so is much faster than
+        indexing the store when only one or two fields are needed.
+
+        Parameters
+        ----------
+        name : str
+            Name of the field to read. This may be a field from any field set
+            in the store.
+        indices : Sequence[int] | np.ndarray | slice | None, optional
+            Trajectory indexes to read: a sequence of integer indexes, a
+            boolean mask over the whole store or a slice. Default is None (all
+            trajectories in the store).
+
+        Returns
+        -------
+        np.ndarray | RaggedArray | SpeciesValues
+            Values in the order of `indices`. Per-trajectory fields are
+            returned as an array with one entry per trajectory (with a trailing
+            thrust mode axis, in `ThrustMode` order, if the field is indexed
+            by thrust mode). Pointwise fields are returned as a `RaggedArray`.
+            Fields indexed by species are returned as a `SpeciesValues` value
+            holding one of these per species. Missing optional values appear
+            as the NetCDF fill value for the field. For column stores, when
+            `indices` is None or a slice with step 1, the arrays returned are
+            read-only views of the memory-mapped column files.
+        """
+        if self._write_enabled:
+            self._flush_write_buffer()
+        if not self.nc_linked:
+            raise RuntimeError('read_field requires a store linked to NetCDF files')
+
+        # Find the field set and NetCDF files holding the field.
+        fs_name, field = self._field_location(name)
+        nc_files = self._nc[fs_name]
+
+        # Column stores return views of the memory-mapped column files when a
+        # contiguous range of trajectories is requested.
+        if self.column_store:
+            view = _column_view(
+                nc_files.dataset[0],  # type: ignore[arg-type]
+                fs_name,
+                name,
+                field,
+                indices,
+                len(self),
+                nc_files.species,
+            )
+            if view is not None:
+                return view
+
+        rows = _normalize_indices(indices, len(self))
+
+        # Read the distinct requested rows from each file in turn, in sorted
+        # order, then rearrange to the order requested.
+        uniq, inverse = np.unique(rows, return_inverse=True)
+        blocks = []
+        with _NETCDF_LOCK:
+            for file_index, local in self._plan_reads(nc_files, uniq):
+                group = nc_files.groups[fs_name][file_index]
+                extents = _read_extents(group, local)
+                blocks.append(
+                    _read_field_rows(group.variables[name], field, local, extents)
+                )
+        has_point = Dimension.POINT in field.dimensions
+        if len(blocks) > 0:
+            data = np.concatenate(blocks)[inverse]
+        else:
+            data = np.empty((0,), dtype=object if has_point else field.field_type)
+        return _field_result(data, field, nc_files.species)
+
+    def read_points(
+        self,
+        name: str,
+        indices: Sequence[int] | np.ndarray | slice | None = None,
+        start: int | Sequence[int] | np.ndarray = 0,
+        stop: int | Sequence[int] | np.ndarray | None = None,
+    ) -> RaggedArray | SpeciesValues:
+        """Read a range of points of a pointwise field for many trajectories.
+
+        This is like `read_field`, but reads only points `start` to `stop`
+        (as for a slice) of each trajectory. For example, passing the
+        `n_climb` values of the trajectories as `start` and `n_climb +
+        n_cruise` as `stop` reads only the cruise phase of each trajectory.
+        With the ragged storage layout, only the requested points are read
+        from the NetCDF files; with the variable-length array layout, whole
+        trajectories have to be read.
+
+        Parameters
+        ----------
+        name : str
+            Name of the pointwise field to read.
+        indices : Sequence[int] | np.ndarray | slice | None, optional
+            Trajectory indexes to read, as for `read_field`. Default is None
+            (all trajectories in the store).
+        start : int | Sequence[int] | np.ndarray, optional
+            Index of the first point to read, either a single value for all
+            trajectories or one value per trajectory read. Default is 0.
+        stop : int | Sequence[int] | np.ndarray | None, optional
+            Index after the last point to read, either a single value for all
+            trajectories or one value per trajectory read. Default is None
+            (to the end of each trajectory).
+
+        Returns
+        -------
+        RaggedArray | SpeciesValues
+            Values in the order of `indices`, as a `RaggedArray` (or a
+            `SpeciesValues` value holding one of these per species, for fields
+            indexed by species). Ranges extending beyond the end of a
+            trajectory are truncated.
+        """
+        if self._write_enabled:
+            self._flush_write_buffer()
+        if not self.nc_linked:
+            raise RuntimeError('read_points requires a store linked to NetCDF files')
+
+        fs_name, field = self._field_location(name)
+        if Dimension.POINT not in field.dimensions:
+            raise ValueError(f'Field "{name}" is not a pointwise field')
+        nc_files = self._nc[fs_name]
+        rows = _normalize_indices(indices, len(self))
+        starts = np.broadcast_to(np.asarray(start, dtype=np.int64), rows.shape)
+        stops = np.broadcast_to(
+            np.asarray(np.iinfo(np.int64).max if stop is None else stop, np.int64),
+            rows.shape,
+        )
+        if np.any(starts < 0) or np.any(stops < 0):
+            raise ValueError('Point ranges must be non-negative')
 
-        # Look up the trajectory index in the same position as the flight ID we
-        # found and return the trajectory in that position.
-        return self[traj_idxs[idx]]
+        # Read in trajectory index order, then rearrange to the order
+        # requested.
+        order = np.argsort(rows, kind='stable')
+        starts, stops = starts[order], stops[order]
+        blocks = []
+        pos = 0
+        with _NETCDF_LOCK:
+            for file_index, local in self._plan_reads(nc_files, rows[order]):
+                s, e = starts[pos : pos + len(local)], stops[pos : pos + len(local)]
+                pos += len(local)
+                group = nc_files.groups[fs_name][file_index]
+                var = group.variables[name]
+                extents = _read_extents(group, local)
+                if extents is None:
+                    # Whole trajectories have to be read for variable-length
+                    # arrays.
+                    block = _read_rows(var, local)
+                    for idx in np.ndindex(block.shape):
+                        block[idx] = block[idx][s[idx[0]] : e[idx[0]]]
+                else:
+                    offsets, sizes = extents
+                    lo = offsets + np.minimum(s, sizes)
+                    hi = np.maximum(offsets + np.minimum(e, sizes), lo)
+                    block = _read_point_ranges(var, lo, hi)
+                blocks.append(block)
+        if len(blocks) > 0:
+            data = np.empty_like(np.concatenate(blocks))
+            data[order] = np.concatenate(blocks)
+        else:
+            data = np.empty((0,), dtype=object)
+        return _field_result(data, field, nc_files.species)
+
+    def aggregate(
+        self,
+        fields: str | Sequence[str],
+        stats: Sequence[str] = ('count', 'sum', 'mean'),
+        quantiles: Sequence[float] = (),
+        by: str | Mapping[int, Any] | Sequence[Any] | np.ndarray | None = None,
+        indices: Sequence[int] | np.ndarray | slice | None = None,
+    ) -> dict[Any, Any]:
+        """Compute summary statistics of per-trajectory fields over the store.
+
+        Each field is read using `read_field` (so with one read per
+        underlying NetCDF file when all trajectories are included) and the
+        statistics are computed using NumPy, without constructing any
+        `Trajectory` values. Missing values of optional fields (and NaNs) are
+        left out of all statistics.
+
+        Parameters
+        ----------
+        fields : str | Sequence[str]
+            Names of the per-trajectory numeric fields to summarize.
+        stats : Sequence[str], optional
+            Statistics to compute, from "count" (number of values), "sum",
+            "mean", "std" (population standard deviation), "min" and "max".
+            Default is count, sum and mean.
+        quantiles : Sequence[float], optional
+            Quantiles to compute (between 0 and 1, using linear interpolation
+            like `np.quantile`). The result for quantile `q` is named
+            `f"q{q:g}"`, so "q0.5" for the median. Default is no quantiles.
+        by : str | Mapping[int, Any] | Sequence[Any] | np.ndarray | None
+            Grouping for the statistics. This may be the name of a
+            per-trajectory field of the store; a mapping from flight ID to
+            group key (for example, aircraft type from the mission database),
+            joined to the trajectories by their `flight_id` field, with
+            trajectories whose flight IDs are not in the mapping grouped
+            under None; or a group key for each trajectory included. Default
+            is None (no grouping).
+        indices : Sequence[int] | np.ndarray | slice | None, optional
+            Trajectories to include, as for `read_field`. Default is None
+            (all trajectories in the store).
+
+        Returns
+        -------
+        dict
+            Without grouping, a dictionary mapping each field name to a
+            dictionary of statistics by name. With grouping, a dictionary
+            mapping each group key to one of those. Statistics of fields
+            indexed by thrust mode are `ThrustModeValues`, and statistics of
+            fields indexed by species are `SpeciesValues`. Statistics other
+            than count and sum are NaN for groups with no values.
+        """
+        if isinstance(fields, str):
+            fields = [fields]
+        for stat in stats:
+            if stat not in AGGREGATE_STATS:
+                raise ValueError(f'Unknown statistic "{stat}"')
+        for q in quantiles:
+            if not 0 <= q <= 1:
+                raise ValueError('Quantiles must be between 0 and 1')
+        names = list(stats) + [f'q{q:g}' for q in quantiles]
+
+        # Work out the group of each trajectory.
+        labels, codes = self._aggregate_groups(by, indices)
+
+        # Compute statistics for each column of each field (there's more than
+        # one column for fields indexed by thrust mode or species), giving an
+        # array of values by group for each statistic.
+        results: dict[str, Any] = {}
+        for name in fields:
+            fs_name, field = self._field_location(name)
+            if Dimension.POINT in field.dimensions or field.field_type is str:
+                raise ValueError(
+                    f'Field "{name}" is not a per-trajectory numeric field'
+                )
+            with _NETCDF_LOCK:
+                var = self._nc[fs_name].groups[fs_name][0].variables[name]
+                fill = var.get_fill_value()
+            data = self.read_field(name, indices)
+            columns = data if isinstance(data, SpeciesValues) else {None: data}
+            by_column = {}
+            for key, values in columns.items():
+                assert isinstance(values, np.ndarray)
+                if codes is None:
+                    codes = np.zeros(len(values), dtype=np.int64)
+                if len(values) != len(codes):
+                    raise ValueError('Group keys must be given for each trajectory')
+                values = values.reshape(len(values), -1)
+                parts = [
+                    _group_stats(
+                        values[:, k], fill, codes, len(labels), stats, quantiles
+                    )
+                    for k in range(values.shape[1])
+                ]
+                by_column[key] = {
+                    n: np.stack([p[n] for p in parts], axis=1) for n in names
+                }
+            results[name] = (field, by_column)
+
+        def value(field: FieldMetadata, column: np.ndarray) -> Any:
+            if Dimension.THRUST_MODE in field.dimensions:
+                return ThrustModeValues(column)
+            return column[0]
+
+        grouped = {}
+        for g, label in enumerate(labels):
+            grouped[label] = {
+                name: {
+                    n: (
+                        SpeciesValues(
+                            {sp: value(field, c[n][g]) for sp, c in by_column.items()}
+                        )
+                        if Dimension.SPECIES in field.dimensions
+                        else value(field, by_column[None][n][g])
+                    )
+                    for n in names
+                }
+                for name, (field, by_column) in results.items()
+            }
+        return grouped[None] if by is None else grouped
+
+    def _aggregate_groups(
+        self,
+        by: str | Mapping[int, Any] | Sequence[Any] | np.ndarray | None,
+        indices: Sequence[int] | np.ndarray | slice | None,
+    ) -> tuple[list[Any], np.ndarray | None]:
+        """Group keys and the group index of each trajectory for `aggregate`.
+        (No grouping gives a single group with key None, and None for the
+        group indexes, which are all zero.)"""
+        if by is None:
+            return [None], None
+        if isinstance(by, Mapping):
+            flight_ids = np.asarray(self.read_field('flight_id', indices))
+            code_of: dict[Any, int] = {}
+            ids = np.fromiter(by.keys(), dtype=np.int64, count=len(by))
+            id_codes = np.fromiter(
+                (code_of.setdefault(v, len(code_of)) for v in by.values()),
+                dtype=np.int64,
+                count=len(by),
+            )
+            labels = list(code_of)
+            order = np.argsort(ids, kind='stable')
+            ids = ids[order]
+            id_codes = id_codes[order]
+            pos = np.minimum(np.searchsorted(ids, flight_ids), max(len(ids) - 1, 0))
+            found = np.zeros(len(flight_ids), dtype=bool)
+            if len(ids) > 0:
+                found = ids[pos] == flight_ids
+            codes = np.full(len(flight_ids), len(labels), dtype=np.int64)
+            codes[found] = id_codes[pos[found]]
+            if not found.all():
+                labels.append(None)
+            return labels, codes
+        if isinstance(by, str):
+            keys = self.read_field(by, indices)
+            if not isinstance(keys, np.ndarray) or keys.ndim != 1:
+                raise ValueError(f'Cannot group by field "{by}"')
+        else:
+            keys = np.asarray(by)
+        uniq, codes = np.unique(keys, return_inverse=True)
+        return uniq.tolist(), codes.reshape(-1)
 
     def __enter__(self):
         return self
@@ -870,6 +3613,12 @@ class TrajectoryStore:
 
     def __len__(self):
         """Count number of trajectories in store."""
+        if self._read_length is not None:
+            return self._read_length
+        if self._writer is not None and self.nc_linked:
+            # Trajectories queued for the writer thread aren't in the files
+            # yet, but the store knows how many it has been given.
+            return self._next_index
         if self.nc_linked:
             # Normally, use the base field set for length calculations.
             # Sometimes we need the length of a store that doesn't contain the
@@ -879,37 +3628,166 @@ class TrajectoryStore:
             if check_fs not in self._nc:
                 check_fs = next(iter(self._nc))
 
-            # Return the sum of the trajectory dimension lengths in all of the
-            # NetCDF4 Datasets associated with the field set we're using to
-            # measure the length. (There will be multiple Datasets if we're
-            # using a merged store.)
-            return sum(len(d) for d in self._nc[check_fs].traj_dim)
+            # Return the total of the trajectory dimension lengths in all of
+            # the NetCDF4 Datasets associated with the field set we're using
+            # to measure the length. (There will be multiple Datasets if we're
+            # using a merged store.) Trajectories waiting in the write buffer
+            # are counted too.
+            with _NETCDF_LOCK:
+                n = self._shard_bounds(self._nc[check_fs])[-1]
+            if self.mode == self.FileMode.READ:
+                self._read_length = n
+            return n + len(self._write_buffer)
         return len(self._trajectories)
 
-    def __getitem__(self, idx) -> Trajectory:
-        """Retrieve a trajectory by numeric index (in order of addition)."""
+    @overload
+    def __getitem__(self, idx: int | np.integer) -> Trajectory: ...
 
-        # If the requested index is in the LRU trajectory cache, return it
-        # immediately.
-        if idx in self._trajectories:
-            return self._trajectories[idx]
+    @overload
+    def __getitem__(
+        self, idx: slice | Sequence[int] | np.ndarray
+    ) -> list[Trajectory]: ...
 
-        # Otherwise, if the store is linked to external NetCDF files, attempt
-        # to load the requested trajectory into the cache.
-        if self.nc_linked:
-            self._load_trajectory(idx)
+    def __getitem__(self, idx):
+        """Retrieve trajectories by numeric index (in order of addition).
 
-        # Load failed or the index is unknown.
-        if idx not in self._trajectories:
-            raise IndexError('Trajectory index out of range')
+        Indexing with an integer returns a single trajectory. Indexing with a
+        slice, a sequence of integers or a boolean mask over the store returns
+        a list of trajectories. For file-backed stores, trajectories that are
+        not already in the trajectory cache are read from the NetCDF files in
+        blocks, with one read per NetCDF variable for each run of nearby
+        indexes in each underlying file, and added to the cache.
+        """
+        if isinstance(idx, int | np.integer):
+            if idx < 0:
+                idx += len(self)
+            return self._get_many(np.array([idx], dtype=np.int64))[0]
+        return self._get_many(_normalize_indices(idx, len(self)))
+
+    def _get_many(self, rows: np.ndarray) -> list[Trajectory]:
+        """Retrieve trajectories by index, loading any that are not cached."""
+
+        # Take trajectories from the LRU trajectory cache where we can. (We
+        # hold on to references here, since loading other trajectories may
+        # evict these from the cache.)
+        found: dict[int, Trajectory] = {}
+        missing: set[int] = set()
+        with self._cache_lock:
+            for i in rows.tolist():
+                if i in found or i in missing:
+                    continue
+                traj = self._trajectories.get(i)
+                if traj is not None:
+                    found[i] = traj
+                else:
+                    missing.add(i)
+
+        # Otherwise, if the store is linked to external NetCDF files, attempt
+        # to load the requested trajectories into the cache. (Any buffered
+        # trajectories are written out first so that they can be read back.)
+        if len(missing) > 0:
+            if not self.nc_linked or min(missing) < 0 or max(missing) >= len(self):
+                raise IndexError('Trajectory index out of range')
+            self._flush_write_buffer()
+            found.update(
+                self._load_trajectories(np.array(sorted(missing), dtype=np.int64))
+            )
 
-        # Return the trajectory from the cache.
-        return self._trajectories[idx]
+        return [found[i] for i in rows.tolist()]
 
     def __iter__(self) -> Iterator[Trajectory]:
         """Iterator over trajectories in store in index order."""
         return _TrajectoryStoreIterator(self)
 
+    def iter(
+        self, prefetch: int = 2, block: int = ITER_BLOCK_SIZE
+    ) -> Iterator[Trajectory]:
+        """Iterate over trajectories in index order with read-ahead.
+
+        Blocks of `block` trajectories are read and decoded by a dedicated
+        I/O thread, which stays up to `prefetch` blocks ahead of the consumer.
+        This overlaps NetCDF reading and decompression with whatever the
+        caller does with each trajectory. The memory held in prefetched blocks
+        is also limited to the trajectory cache size (`cache_size_mb`).
+
+        All NetCDF calls made while the iteration is in progress, from the I/O
+        thread or from the consuming thread (e.g., indexing the store inside
+        the loop), are serialized, so the underlying libraries are never called
+        from two threads at once.
+
+        With `prefetch=0`, this is the same as normal iteration over the
+        store.
+        """
+        if prefetch < 0 or block < 1:
+            raise ValueError('prefetch must be non-negative and block positive')
+        if prefetch == 0 or not self.nc_linked:
+            return _TrajectoryStoreIterator(self, block)
+        if self._write_enabled:
+            self._flush_write_buffer()
+        return self._prefetch_iter(prefetch, block)
+
+    def _prefetch_iter(self, prefetch: int, block: int) -> Iterator[Trajectory]:
+        """Generator for prefetching iteration (see `iter`)."""
+        nitems = len(self)
+        budget = self._trajectories.maxsize
+
+        # Blocks read by the I/O thread are passed to the consumer through a
+        # queue, bounded both by the number of blocks and by the total size of
+        # the trajectories they hold.
+        queue: deque[tuple[list[Trajectory], int] | BaseException] = deque()
+        queued_bytes = 0
+        cond = threading.Condition()
+        stop = threading.Event()
+
+        def reader():
+            nonlocal queued_bytes
+            try:
+                for start in range(0, nitems, block):
+                    rows = np.arange(start, min(start + block, nitems))
+                    loaded = self._read_trajectories(rows)
+                    trajs = [loaded[i] for i in rows.tolist()]
+                    nbytes = sum(t.nbytes for t in trajs)
+                    with cond:
+                        while not stop.is_set() and (
+                            len(queue) >= prefetch
+                            or (len(queue) > 0 and queued_bytes + nbytes > budget)
+                        ):
+                            cond.wait()
+                        if stop.is_set():
+                            return
+                        queue.append((trajs, nbytes))
+                        queued_bytes += nbytes
+                        cond.notify_all()
+            except BaseException as exc:
+                with cond:
+                    queue.append(exc)
+                    cond.notify_all()
+
+        thread = threading.Thread(target=reader, daemon=True)
+        thread.start()
+        try:
+            for start in range(0, nitems, block):
+                with cond:
+                    while len(queue) == 0:
+                        cond.wait()
+                    item = queue.popleft()
+                    if isinstance(item, BaseException):
+                        raise item
+                    trajs, nbytes = item
+                    queued_bytes -= nbytes
+                    cond.notify_all()
+                # Prefetched trajectories are added to the trajectory cache
+                # here, in the consuming thread.
+                with self._cache_lock:
+                    for i, traj in enumerate(trajs):
+                        self._trajectories[start + i] = traj
+                yield from trajs
+        finally:
+            stop.set()
+            with cond:
+                cond.notify_all()
+            thread.join()
+
     def _create(self):
         """Create a new NetCDF file (or files) for writing trajectories.
 
@@ -934,7 +3812,9 @@ class TrajectoryStore:
 
         # Create the base NetCDF file.
         assert self.base_file is not None
-        species = proto.species
+        species = (
+            self._create_species if self._create_species is not None else proto.species
+        )
         self._create_nc_file(self.base_file, base_nc_fieldsets, species)
 
         # Create the associated NetCDF files. The `associated_name` and
@@ -954,7 +3834,8 @@ class TrajectoryStore:
                 associated_hash=base_nc_file.dataset[0].id_hash,
             )
 
-    def _retrieve_nc_species_values(self, dataset: nc4.Dataset) -> list[Species] | None:
+    @staticmethod
+    def _retrieve_nc_species_values(dataset: nc4.Dataset) -> list[Species] | None:
         """Retrieve species values from a NetCDF Dataset's species dimension.
 
         If the Dataset does not have a species dimension, return None.
@@ -971,6 +3852,7 @@ class TrajectoryStore:
             for i in range(len(var))
         ]
 
+    @_holding_netcdf_lock
     def _create_nc_file(
         self,
         nc_file: str | Path,
@@ -979,7 +3861,13 @@ class TrajectoryStore:
         associated_name: Path | None = None,
         associated_hash: str | None = None,
         save: bool = True,
+        storage_policy: StoragePolicy | None = None,
+        layout: Layout | None = None,
     ) -> TrajectoryStore.NcFiles:
+        # Files use the store's layout unless told otherwise (when copying
+        # files with another layout).
+        layout = layout if layout is not None else self.layout
+
         # Ensure output directory exists.
         nc_file = Path(nc_file).resolve()
         if not nc_file.parent.exists():
@@ -1031,6 +3919,12 @@ class TrajectoryStore:
             m.update(h.encode('utf-8'))
         dataset.id_hash = m.hexdigest()
 
+        # Record the storage layout used for pointwise data and the
+        # compression and chunking policy used for all variables.
+        dataset.layout = str(layout)
+        policy = storage_policy if storage_policy is not None else self.storage_policy
+        dataset.storage_policy = policy.to_json()
+
         # Set up associated file attributes, if applicable.
         if associated_name is not None:
             dataset.associated_name = str(associated_name)
@@ -1043,7 +3937,9 @@ class TrajectoryStore:
         # Variable length types for floating point and integer per-point data.
         # (NetCDF4 handles variable-length strings natively so we add Python's
         # string type here.)
-        vl_types = _create_vl_types(dataset, fieldsets)
+        vl_types = (
+            _create_vl_types(dataset, fieldsets) if layout == self.Layout.VLEN else {}
+        )
 
         # Iterate over provided field set names.
         for fs_name in fieldsets:
@@ -1057,23 +3953,77 @@ class TrajectoryStore:
             g = dataset.createGroup(fs_name)
             groups[fs_name] = [g]
 
+            # In the ragged layout, the points of all trajectories are stored
+            # contiguously along a "point" dimension belonging to the group,
+            # and the number of points in each trajectory and the position of
+            # its first point are stored in per-trajectory variables. (The
+            # `_row_size` variable is a CF "count variable" for the contiguous
+            # ragged array representation; `_row_offset` allows direct access
+            # to any trajectory without summing the row sizes.)
+            ragged = layout == self.Layout.RAGGED and any(
+                Dimension.POINT in metadata.dimensions for metadata in fs.values()
+            )
+            if ragged:
+                g.createDimension('point', None)
+                v = g.createVariable('_row_size', np.int64, ('trajectory',))
+                v.sample_dimension = 'point'
+                g.createVariable('_row_offset', np.int64, ('trajectory',))
+
             # For each variable in the field set:
             for field_name, metadata in fs.items():
-                # Determine the NetCDF variable type: if it's a per-point
-                # variable, look up the appropriate variable length type
-                # created earlier.
-                field_type = metadata.field_type
-                if Dimension.POINT in metadata.dimensions:
-                    field_type = vl_types.get(metadata.field_type, None)
-                    if field_type is None:
+                # Ragged pointwise variables are indexed by the point
+                # dimension instead of the trajectory dimension, and can be
+                # chunked and compressed like ordinary variables.
+                pointwise = Dimension.POINT in metadata.dimensions
+                if ragged and pointwise:
+                    if metadata.field_type is str:
                         raise ValueError(
-                            f'Unsupported field type {metadata.field_type} '
-                            f'for variable "{field_name}" in field set "{fs_name}"'
+                            f'Pointwise string variable "{field_name}" in field '
+                            f'set "{fs_name}" not supported in ragged layout'
                         )
-
-                # Create a variable of the appropriate NetCDF type, indexed by
-                # the calculated dimension set.
-                v = g.createVariable(field_name, field_type, metadata.dimensions.netcdf)
+                    dims = ('point', *metadata.dimensions.netcdf[1:])
+                    v = g.createVariable(
+                        field_name,
+                        metadata.field_type,
+                        dims,
+                        **policy.variable_kwargs(
+                            fs_name,
+                            field_name,
+                            metadata,
+                            [len(dataset.dimensions[d]) for d in dims[1:]],
+                            ragged=True,
+                        ),
+                    )
+                else:
+                    # Determine the NetCDF variable type: if it's a per-point
+                    # variable, look up the appropriate variable length type
+                    # created earlier.
+                    field_type = metadata.field_type
+                    if Dimension.POINT in metadata.dimensions:
+                        field_type = vl_types.get(metadata.field_type, None)
+                        if field_type is None:
+                            raise ValueError(
+                                f'Unsupported field type {metadata.field_type} '
+                                f'for variable "{field_name}" in field set '
+                                f'"{fs_name}"'
+                            )
+
+                    # Create a variable of the appropriate NetCDF type, indexed
+                    # by the calculated dimension set, with compression and
+                    # chunking set by the storage policy.
+                    dims = metadata.dimensions.netcdf
+                    v = g.createVariable(
+                        field_name,
+                        field_type,
+                        dims,
+                        **policy.variable_kwargs(
+                            fs_name,
+                            field_name,
+                            metadata,
+                            [len(dataset.dimensions[d]) for d in dims[1:]],
+                            vlen=pointwise,
+                        ),
+                    )
 
                 # Add metadata to variable.
                 v.description = metadata.description
@@ -1109,6 +4059,7 @@ class TrajectoryStore:
             species=species,
             size_index=None,
             groups=groups,
+            layout=layout,
         )
         if save:
             self._nc_files.append(file_info)
@@ -1141,7 +4092,14 @@ class TrajectoryStore:
         # Open any associated NetCDF files.
         for name in self.associated_files:
             assert isinstance(name, PathType)
-            associated_file = self._open_nc_file(name, check_associated=base_nc_file)
+            if Path(name).is_dir():
+                associated_file = self._open_merged_store(
+                    name, check_associated=base_nc_file
+                )
+            else:
+                associated_file = self._open_nc_file(
+                    name, check_associated=base_nc_file
+                )
             self._associated_open_checks(name, associated_file)
 
     def _open_nc_file(
@@ -1211,31 +4169,8 @@ class TrajectoryStore:
             )
 
         # The field sets in the file should match the definitions in the
-        # registry.
-        for fs_name, fs_hash in zip(fieldset_names, fieldset_hashes):
-            fs = FieldSet.from_registry(fs_name)
-            if fs.digest != fs_hash:
-                if not self.force_fieldset_matches:
-                    raise ValueError(
-                        f'Field set hash for field set "{fs_name}" in file {nc_file} '
-                        f'does not match hash of FieldSet in registry'
-                    )
-                warnings.warn(
-                    f'Field set hash for field set "{fs_name}" in file {nc_file} '
-                    f'does not match hash of FieldSet in registry, but '
-                    f'force_fieldset_matches is True so continuing anyway',
-                    RuntimeWarning,
-                )
-
-        # The ID hash is made up of all the field set hashes in the file.
-        m = hashlib.md5()
-        for h in fieldset_hashes:
-            m.update(h.encode('utf-8'))
-        if id_hash != m.hexdigest():
-            raise ValueError(
-                f'id_hash in NetCDF file {nc_file} does not match calculated '
-                f'hash from field set hashes'
-            )
+        # registry, and the ID hash should match the field set hashes.
+        self._check_fieldset_hashes(nc_file, fieldset_names, fieldset_hashes, id_hash)
 
         # For an associated file, check that the base file it's associated with
         # matches what we expect.
@@ -1267,7 +4202,88 @@ class TrajectoryStore:
             history=history,
             source=source,
             created=created,
+            layout=_nc_layout(dataset, nc_file),
+            storage_policy=_nc_storage_policy(dataset),
+        )
+
+    def _check_fieldset_hashes(
+        self,
+        path: Path,
+        fieldset_names: list[str],
+        fieldset_hashes: list[str],
+        id_hash: str,
+    ) -> None:
+        """Check field set hashes recorded in a file against the field set
+        registry, and check the file's ID hash."""
+        for fs_name, fs_hash in zip(fieldset_names, fieldset_hashes):
+            fs = FieldSet.from_registry(fs_name)
+            if fs.digest != fs_hash:
+                if not self.force_fieldset_matches:
+                    raise ValueError(
+                        f'Field set hash for field set "{fs_name}" in file {path} '
+                        f'does not match hash of FieldSet in registry'
+                    )
+                warnings.warn(
+                    f'Field set hash for field set "{fs_name}" in file {path} '
+                    f'does not match hash of FieldSet in registry, but '
+                    f'force_fieldset_matches is True so continuing anyway',
+                    RuntimeWarning,
+                )
+
+        # The ID hash is made up of all the field set hashes in the file.
+        m = hashlib.md5()
+        for h in fieldset_hashes:
+            m.update(h.encode('utf-8'))
+        if id_hash != m.hexdigest():
+            raise ValueError(
+                f'id_hash in NetCDF file {path} does not match calculated '
+                f'hash from field set hashes'
+            )
+
+    def _open_columns(self):
+        """Open an existing column store for reading trajectories.
+
+        The column files are presented to the rest of the store using
+        stand-ins for the NetCDF objects used by the reading code, with one
+        `NcFiles` entry per field set (because field sets from different
+        files of the store that was exported may have different species
+        dimensions)."""
+        assert self.base_file is not None
+        path = Path(self.base_file).resolve()
+        dataset = ColumnDataset(path)
+        self._check_fieldset_hashes(
+            path, dataset.fieldset_names, dataset.fieldset_hashes, dataset.id_hash
         )
+        if dataset.fieldset_names[0] != BASE_FIELDSET_NAME:
+            raise ValueError(f'Base field set missing from column store {path}')
+        created = getattr(dataset, 'created', None)
+        policy = getattr(dataset, 'storage_policy', None)
+        for fs_name in dataset.fieldset_names:
+            species = dataset.species(fs_name)
+            nc_files = TrajectoryStore.NcFiles(
+                path=[path],
+                fieldsets={fs_name},
+                dataset=[dataset],  # type: ignore[list-item]
+                traj_dim=[dataset.dimensions['trajectory']],  # type: ignore[list-item]
+                traj_var=[dataset.variables['trajectory']],  # type: ignore[list-item]
+                species=[Species[s] for s in species] if species is not None else None,
+                groups={fs_name: [dataset.groups[fs_name]]},  # type: ignore[list-item]
+                size_index=[dataset.length],
+                title=getattr(dataset, 'title', None),
+                comment=getattr(dataset, 'comment', None),
+                history=getattr(dataset, 'history', None),
+                source=getattr(dataset, 'source', None),
+                created=datetime.fromisoformat(created) if created else None,
+                layout=dataset.layout,
+                storage_policy=(
+                    StoragePolicy.from_json(policy) if policy is not None else None
+                ),
+            )
+            self._base_open_checks(nc_files)
+
+        if '_index' in dataset.groups:
+            self.index_group = dataset.groups['_index']  # type: ignore[assignment]
+            self.indexable = True
 
     def _open_merged(self):
         """Open an existing merged store file for reading trajectories."""
@@ -1284,13 +4300,20 @@ class TrajectoryStore:
                 'Appending to merged TrajectoryStore files is not supported'
             )
 
-        # Open index file.
-        index_file = Path(self.base_file) / '_index.nc'
-        if index_file.exists():
-            self.index_dataset = nc4.Dataset(index_file, mode='r', keepweakref=True)
-            self.index_group = self.index_dataset.groups['_index']
-            self.indexable = True
-
+        # Open index file. (The index of a union store is held in its manifest
+        # file.)
+        if self.union_store:
+            self.index_dataset = nc4.Dataset(self.base_file, mode='r', keepweakref=True)
+            if '_index' in self.index_dataset.groups:
+                self.index_group = self.index_dataset.groups['_index']
+                self.indexable = True
+        else:
+            index_file = Path(self.base_file) / '_index.nc'
+            if index_file.exists():
+                self.index_dataset = nc4.Dataset(index_file, mode='r', keepweakref=True)
+                self.index_group = self.index_dataset.groups['_index']
+                self.indexable = True
+
         # Open any associated NetCDF files.
         for name in self.associated_files:
             assert isinstance(name, PathType)
@@ -1307,9 +4330,10 @@ class TrajectoryStore:
         """Open a merged store.
 
         This method opens multiple NetCDF files in a merged store directory
-        that are either a base store or an associated store. It performs
-        consistency checks on the contents of the store and returns a `NcFiles`
-        object with information about the files.
+        (or listed, through their member stores, in the manifest of a union
+        store) that are either a base store or an associated store. It
+        performs consistency checks on the contents of the store and returns a
+        `NcFiles` object with information about the files.
         """
 
         # Ensure input file exists.
@@ -1319,26 +4343,34 @@ class TrajectoryStore:
 
         # Read metadata file. This contains information about the files
         # composing the merged store, as well as store level global attribute
-        # metadata values.
-        metadata_file = store_dir / 'metadata.json'
-        if not metadata_file.exists():
-            raise ValueError(f'Metadata file missing from merged store {store_dir}')
-        with open(metadata_file) as f:
-            metadata = json.load(f)
+        # metadata values. (For union stores, the same information is
+        # collected from the manifest file and the member stores.)
+        if store_dir.name.endswith(UNION_STORE_SUFFIX):
+            metadata_file = store_dir
+            metadata = _read_union_manifest(store_dir)
+        else:
+            metadata_file = store_dir / 'metadata.json'
+            if not metadata_file.exists():
+                raise ValueError(f'Metadata file missing from merged store {store_dir}')
+            with open(metadata_file) as f:
+                metadata = json.load(f)
 
-        # Get paths to NetCDF files.
+        # Get paths to NetCDF files and their trajectory counts.
         nc_files = [store_dir / s[0] for s in metadata.get('stores', [])]
         if len(nc_files) == 0:
             raise ValueError(f'No stores listed in metadata file {metadata_file}')
-
-        # Open NetCDF4 datasets in read mode for each NetCDF file.
-        dataset = [
-            nc4.Dataset(nc_file, mode='r', keepweakref=True) for nc_file in nc_files
-        ]
-
-        # Retrieve trajectory dimensions and variables.
-        traj_dim = [ds.dimensions['trajectory'] for ds in dataset]
-        traj_var = [ds.variables['trajectory'] for ds in dataset]
+        counts = [int(s[1]) for s in metadata['stores']]
+
+        # The NetCDF files are opened when they're first used, and checked
+        # against the first file then. Only the first file is opened here, to
+        # get the attributes of the store. That keeps opening a store with
+        # thousands of files quick, and keeps the number of open files within
+        # the store's limit.
+        files = _MergedFiles(self._open_files, store_dir, nc_files, counts)
+        dataset = files.view(lambda ds: ds)
+        traj_dim = files.view(lambda ds: ds.dimensions['trajectory'])
+        traj_var = files.view(lambda ds: ds.variables['trajectory'])
+        first = dataset[0]
 
         # Retrieve global attributes from JSON data (created when merged store
         # is created).
@@ -1359,23 +4391,17 @@ class TrajectoryStore:
             assert isinstance(val, list)
             return val
 
-        fieldset_names = get_list(dataset[0], 'fieldset_names')
-        fieldset_hashes = get_list(dataset[0], 'fieldset_hashes')
-        id_hash = dataset[0].id_hash
-        associated_name = getattr(dataset[0], 'associated_name', None)
-        associated_hash = getattr(dataset[0], 'associated_hash', None)
+        fieldset_names = get_list(first, 'fieldset_names')
+        fieldset_hashes = get_list(first, 'fieldset_hashes')
+        id_hash = first.id_hash
+        associated_name = getattr(first, 'associated_name', None)
+        associated_hash = getattr(first, 'associated_hash', None)
+        group_names = [k for k in first.groups.keys() if k[0] != '_']
+        species = self._retrieve_nc_species_values(first)
+        layout = _nc_layout(first, store_dir)
+        storage_policy = _nc_storage_policy(first)
 
         # Check consistency.
-        for ds in dataset:
-            check_groups = {}
-            for k in ds.groups.keys():
-                if k[0] != '_':
-                    check_groups[k] = [ds.groups[k] for ds in dataset]
-            if set(check_groups.keys()) != set(fieldset_names):
-                raise ValueError(
-                    f'Field set names in global attribute do not match NetCDF groups '
-                    f'in store {store_dir}'
-                )
         for fs_name, fs_hash in zip(fieldset_names, fieldset_hashes):
             fs = FieldSet.from_registry(fs_name)
             if fs.digest != fs_hash:
@@ -1400,6 +4426,11 @@ class TrajectoryStore:
                 f'id_hash in store {store_dir} does not match calculated '
                 f'hash from field set hashes'
             )
+        if any(h != id_hash for h in metadata.get('member_hashes', [])):
+            raise ValueError(
+                f'Field set hashes of member stores of union store {store_dir} '
+                f'do not match'
+            )
         if check_associated is not None:
             if associated_name is None or associated_hash is None:
                 raise ValueError(
@@ -1411,15 +4442,12 @@ class TrajectoryStore:
                     f'not match hash of base file {check_associated.path}'
                 )
 
-        # Retrieve groups for each field set: take from first dataset, since
-        # we've checked consistency across all datasets already.
-        groups = {}
-        for k in dataset[0].groups.keys():
-            if k[0] != '_':
-                groups[k] = [ds.groups[k] for ds in dataset]
-
-        # Retrieve species actually used in the NetCDF files.
-        species = self._retrieve_nc_species_values(dataset[0])
+        # Groups for each field set: the files all have the same groups as the
+        # first one (checked as they're opened).
+        groups = {
+            k: files.view(functools.partial(_dataset_group, name=k))
+            for k in group_names
+        }
 
         return TrajectoryStore.NcFiles(
             path=nc_files,
@@ -1429,12 +4457,14 @@ class TrajectoryStore:
             traj_var=traj_var,
             species=species,
             groups=groups,
-            size_index=list(itertools.accumulate([len(td) for td in traj_dim])),
+            size_index=list(itertools.accumulate(counts)),
             title=title,
             comment=comment,
             history=history,
             source=source,
             created=created,
+            layout=layout,
+            storage_policy=storage_policy,
         )
 
     def _base_open_checks(self, base_nc_file: NcFiles):
@@ -1449,6 +4479,12 @@ class TrajectoryStore:
             self.global_attributes['source'] = base_nc_file.source
         self.global_attributes['created'] = base_nc_file.created
 
+        # Any associated files created from this store use the same storage
+        # layout as the base file.
+        self.layout = self.Layout(base_nc_file.layout)
+        if base_nc_file.storage_policy is not None:
+            self.storage_policy = base_nc_file.storage_policy
+
         # Check that the field sets in the base NetCDF file exist in the field
         # set registry. There is a 1-to-1 relation between NetCDF groups and
         # field sets.
@@ -1462,29 +4498,30 @@ class TrajectoryStore:
             # Field set from registry.
             fs = FieldSet.from_registry(fs_name)
 
-            for g in base_nc_file.groups[fs_name]:
-                # Field set constructed from NetCDF group for comparison.
-                netcdf_fs = FieldSet.from_netcdf_group(g)
+            # Field set constructed from NetCDF group for comparison. (The
+            # other files of a merged store are checked against the first one
+            # when they're opened.)
+            netcdf_fs = FieldSet.from_netcdf_group(base_nc_file.groups[fs_name][0])
 
-                # Now we can check that the fields in the field set exist in the
-                # relevant NetCDF group and that they have the right types and
-                # shapes.
-                for n in fs.fields:
-                    if n not in netcdf_fs.fields:
-                        raise ValueError(
-                            f'Field "{n}" in FieldSet with name "{fs_name}" not '
-                            f'found in NetCDF file'
-                        )
-                    if fs.fields[n] != netcdf_fs.fields[n]:
-                        raise ValueError(
-                            f'Field "{n}" in FieldSet with name "{fs_name}" is '
-                            f'incompatible with field in NetCDF file'
-                        )
-                if hash(fs) != hash(netcdf_fs):
+            # Now we can check that the fields in the field set exist in the
+            # relevant NetCDF group and that they have the right types and
+            # shapes.
+            for n in fs.fields:
+                if n not in netcdf_fs.fields:
+                    raise ValueError(
+                        f'Field "{n}" in FieldSet with name "{fs_name}" not '
+                        f'found in NetCDF file'
+                    )
+                if fs.fields[n] != netcdf_fs.fields[n]:
                     raise ValueError(
-                        f'FieldSet with name "{fs_name}" in base NetCDF file is '
-                        f'incompatible with FieldSet in registry'
+                        f'Field "{n}" in FieldSet with name "{fs_name}" is '
+                        f'incompatible with field in NetCDF file'
                     )
+            if hash(fs) != hash(netcdf_fs):
+                raise ValueError(
+                    f'FieldSet with name "{fs_name}" in base NetCDF file is '
+                    f'incompatible with FieldSet in registry'
+                )
 
         # Save file information under fieldset names in _nc dictionary.
         self._nc_files.append(base_nc_file)
@@ -1504,36 +4541,93 @@ class TrajectoryStore:
                 )
 
     def _reindex(self):
-        """Regenerate flight ID index."""
-
-        # NOTE: Takes about 1.5s on a store with 1 million trajectories.
+        """Bring the flight ID index up to date.
+
+        Flight IDs added since the last reindex are sorted and merged into the
+        existing sorted index, and only the part of the index group from the
+        first changed entry onwards is rewritten. (For stores that grow by
+        appending trajectories with increasing flight IDs, that's just the new
+        entries at the end.) If the index doesn't match the store, or if the
+        number of new flight IDs passes the compaction threshold set by
+        `INDEX_COMPACTION_FRACTION`, the whole index is rebuilt instead.
+        """
 
         if not self.indexable or not self.index_stale:
             return
 
+        # The index is built from the data in the NetCDF files, so any buffered
+        # trajectories need to be written out first.
+        self._flush_write_buffer()
+
+        new_ids = np.asarray(self._pending_flight_ids, dtype=np.int64)
+        new_idxs = np.asarray(self._pending_indexes, dtype=np.int64)
+        self._pending_flight_ids = []
+        self._pending_indexes = []
+
+        # Trajectories before the new ones should already be indexed. (A store
+        # that wasn't closed cleanly may have entries that were never filled
+        # in, which show up as negative trajectory indexes.)
+        assert self.index_group is not None
+        nold = self._next_index - len(new_ids)
+        if self._index_arrays is None:
+            self._index_arrays = self._read_index_group(nold)
+        old_ids, old_idxs = self._index_arrays
+        if (
+            len(old_ids) == nold
+            and (nold == 0 or old_idxs.min() >= 0)
+            and len(new_ids) <= INDEX_COMPACTION_FRACTION * nold
+        ):
+            self._merge_index(new_ids, new_idxs)
+        else:
+            self._rebuild_index()
+
+        # We've just updated the index, so it's definitely not stale.
+        self.index_stale = False
+
+    def _merge_index(self, new_ids: np.ndarray, new_idxs: np.ndarray) -> None:
+        """Merge new flight IDs into the existing index."""
+
+        assert self._index_arrays is not None
+        assert self.index_group is not None
+        old_ids, old_idxs = self._index_arrays
+
+        sorted_ids, traj_idxs, start = _merge_index_entries(
+            old_ids, old_idxs, new_ids, new_idxs
+        )
+        vs = self.index_group.variables
+        vs['flight_id'][start:] = sorted_ids[start:]
+        vs['trajectory_index'][start:] = traj_idxs[start:]
+        self._index_arrays = (sorted_ids, traj_idxs)
+
+    def _rebuild_index(self) -> None:
+        """Regenerate the whole flight ID index from the store's data."""
+
+        # NOTE: Takes about 1.5s on a store with 1 million trajectories.
+
         # Get the NetCDF4 groups for the base field set.
         gs = self._nc[BASE_FIELDSET_NAME].groups[BASE_FIELDSET_NAME]
 
         # Extract flight IDs from all trajectories in the order of the files in
         # the store (for a merged store, there may be more than one file).
-        flight_ids = []
-        for g in gs:
-            flight_ids += list(g.variables['flight_id'][:])
+        flight_ids = np.concatenate(
+            [np.asarray(g.variables['flight_id'][:], dtype=np.int64) for g in gs]
+        )
 
-        # Pair up the flight IDs with the indexes of the trajectories in the
-        # store and sort the pairs into flight ID order so that we can binary
-        # search the index.
-        id_pairs = sorted(enumerate(flight_ids), key=lambda x: x[1])
+        # Sort the trajectory indexes into flight ID order so that we can
+        # binary search the index. (A stable sort keeps duplicate flight IDs in
+        # trajectory order.)
+        order = np.argsort(flight_ids, kind='stable')
+        sorted_ids = flight_ids[order]
 
-        # Save the index information into the index group.
+        # Save the index information into the index group, and keep the
+        # in-memory copy for lookups.
         assert self.index_group is not None
-        self.index_group.variables['flight_id'][:] = [id for _, id in id_pairs]
-        self.index_group.variables['trajectory_index'][:] = [idx for idx, _ in id_pairs]
-
-        # We've just remade the index, so it's definitely not stale.
-        self.index_stale = False
+        self.index_group.variables['flight_id'][:] = sorted_ids
+        self.index_group.variables['trajectory_index'][:] = order
+        self._index_arrays = (sorted_ids, order.astype(np.int64))
 
     @staticmethod
+    @_holding_netcdf_lock
     def _create_merged_store_index(
         output_store: PathType, input_stores: list[PathType]
     ):
@@ -1553,100 +4647,375 @@ class TrajectoryStore:
             )
             assert ts.index_group is not None
             vs = ts.index_group.variables
-            flight_ids += list(vs['flight_id'][:])
-            trajectory_indexes += [
-                idx + index_offset for idx in vs['trajectory_index'][:]
-            ]
+            flight_ids.append(np.asarray(vs['flight_id'][:], dtype=np.int64))
+            trajectory_indexes.append(
+                np.asarray(vs['trajectory_index'][:], dtype=np.int64) + index_offset
+            )
             index_offset += len(ts)
-        id_pairs = sorted(zip(trajectory_indexes, flight_ids), key=lambda x: x[1])
-        index_group.variables['flight_id'][:] = [id for _, id in id_pairs]
-        index_group.variables['trajectory_index'][:] = [idx for idx, _ in id_pairs]
+        all_ids = np.concatenate(flight_ids)
+        order = np.argsort(all_ids, kind='stable')
+        index_group.variables['flight_id'][:] = all_ids[order]
+        index_group.variables['trajectory_index'][:] = np.concatenate(
+            trajectory_indexes
+        )[order]
         index_dataset.close()
 
-    def _load_trajectory(self, index: int) -> None:
-        """Load a trajectory at the given index from the NetCDF file(s)."""
-        data = {}
-        npoints: int | None = None
+    @staticmethod
+    @_holding_netcdf_lock
+    def _extend_merged_store_index(
+        store_dir: PathType, new_ids: np.ndarray, new_idxs: np.ndarray
+    ) -> None:
+        """Merge new entries into the index of a merged store (creating the
+        index file if there isn't one yet).
+
+        The merged index is written to a new file that then replaces the old
+        one in one step: readers may have the index file open, and they don't
+        take the store's lock.
+        """
+        index_file = Path(store_dir) / '_index.nc'
+        if index_file.exists():
+            index_dataset = nc4.Dataset(index_file, 'r', keepweakref=True)
+            try:
+                vs = index_dataset.groups['_index'].variables
+                new_ids, new_idxs, _ = _merge_index_entries(
+                    np.asarray(vs['flight_id'][:], dtype=np.int64),
+                    np.asarray(vs['trajectory_index'][:], dtype=np.int64),
+                    new_ids,
+                    new_idxs,
+                )
+            finally:
+                index_dataset.close()
+        tmp = Path(store_dir) / '._index.nc.tmp'
+        index_dataset = nc4.Dataset(tmp, 'w', keepweakref=True)
+        try:
+            index_dataset.createDimension('trajectory', None)
+            _write_index_group(index_dataset, new_ids, new_idxs)
+        except BaseException:
+            index_dataset.close()
+            tmp.unlink()
+            raise
+        index_dataset.close()
+        os.replace(tmp, index_file)
 
-        # Handle field sets one by one.
+    def _field_location(self, name: str) -> tuple[str, FieldMetadata]:
+        """Find the field set containing a named field, returning the field
+        set name and the field metadata."""
         for fs_name in self._nc:
-            # Look up the field set in the field set registry.
             fs = FieldSet.from_registry(fs_name)
+            if name in fs:
+                return fs_name, fs[name]
+        raise ValueError(f'Data field "{name}" not found in TrajectoryStore')
+
+    def _make_projection(
+        self, fieldsets: list[str] | None, fields: list[str] | None
+    ) -> dict[str, list[str]]:
+        """Find the fields to read for each field set for a field projection,
+        checking that the field sets and fields exist in the store."""
+        selected: dict[str, set[str]] = {}
+        for fs_name in fieldsets or []:
+            if fs_name not in self._nc:
+                raise ValueError(f'Field set "{fs_name}" not found in TrajectoryStore')
+            selected.setdefault(fs_name, set()).update(FieldSet.from_registry(fs_name))
+        for name in fields or []:
+            fs_name, _ = self._field_location(name)
+            selected.setdefault(fs_name, set()).add(name)
+
+        # Fields are kept in store and field set order, so that reads happen
+        # in the same order as for a store without a projection.
+        return {
+            fs_name: [
+                n for n in FieldSet.from_registry(fs_name) if n in selected[fs_name]
+            ]
+            for fs_name in self._nc
+            if fs_name in selected
+        }
 
-            # File information for the field set and the NetCDF group for
-            # variables in the field set.
-            nc_files = self._nc[fs_name]
-            file_index = 0
-            group_index = index
-
-            # If this is a merged store, find the right file and index into the
-            # right group in that file.
-            if nc_files.size_index is not None:
-                file_index = bisect.bisect_left(nc_files.size_index, index + 1)
-                if file_index >= len(nc_files.size_index):
-                    return
-                group_index = index - nc_files.size_index[file_index]
-            group = nc_files.groups[fs_name][file_index]
+    def _npoints_probe(self) -> tuple[str, str] | None:
+        """Pointwise field read only to find trajectory lengths.
 
-            # Read data from NetCDF variables.
-            for name, field in fs.items():
-                if name not in group.variables:
-                    raise ValueError(
-                        f'Data field "{name}" does not exist in NetCDF file'
-                    )
-                val = self._read_from_nc_var(
-                    group.variables[name],
-                    group_index,
-                    name,
-                    field,
-                    nc_files.species or [],
-                )
-                data[name] = val
-                if Dimension.POINT in field.dimensions and npoints is None:
+        Trajectories need to know their number of points. That comes from the
+        pointwise fields read, or from the point counts of the ragged storage
+        layout, but if a field projection includes no pointwise fields, a
+        single pointwise field is read as well, just for its lengths.
+        """
+        if self._projection is None:
+            return None
+        candidates = []
+        for fs_name in self._nc:
+            for name, field in FieldSet.from_registry(fs_name).items():
+                if Dimension.POINT not in field.dimensions:
+                    continue
+                if name in self._projection.get(fs_name, []):
+                    return None
+                if Dimension.SPECIES not in field.dimensions:
+                    candidates.append((fs_name, name))
+        return candidates[0] if len(candidates) > 0 else None
+
+    def _shard_bounds(self, nc_files: NcFiles) -> list[int]:
+        """Cumulative trajectory counts through the NetCDF files holding a
+        field set.
+
+        For merged stores (including merged associated stores opened with a
+        single file base store), this is the size index computed when the store
+        was opened. Single file stores can grow, so we use the current length
+        of the trajectory dimension.
+        """
+        if len(nc_files.dataset) > 1 and nc_files.size_index is not None:
+            return nc_files.size_index
+        return [len(nc_files.traj_dim[0])]
+
+    def _plan_reads(
+        self, nc_files: NcFiles, rows: np.ndarray
+    ) -> list[tuple[int, np.ndarray]]:
+        """Split sorted unique trajectory indexes by underlying NetCDF file.
+
+        Returns a list of (file index, indexes within file) pairs, in file
+        order.
+        """
+        bounds = self._shard_bounds(nc_files)
+        if len(rows) > 0 and rows[-1] >= bounds[-1]:
+            raise IndexError('Trajectory index out of range')
+        file_of = np.searchsorted(bounds, rows, side='right')
+        plan = []
+        for file_index in np.unique(file_of):
+            offset = 0 if file_index == 0 else bounds[file_index - 1]
+            plan.append((int(file_index), rows[file_of == file_index] - offset))
+        return plan
+
+    def _load_trajectories(self, rows: np.ndarray) -> dict[int, Trajectory]:
+        """Load trajectories at the given sorted unique indexes from the
+        NetCDF file(s), save them in the trajectory cache and return them."""
+        loaded = self._read_trajectories(rows)
+        with self._cache_lock:
+            for index, traj in loaded.items():
+                self._trajectories[index] = traj
+        return loaded
+
+    def _read_trajectories(self, rows: np.ndarray) -> dict[int, Trajectory]:
+        """Read trajectories at the given sorted unique indexes from the
+        NetCDF file(s). (For lazy stores, just make views of them.)
+
+        Each NetCDF variable is read once for each run of nearby indexes in
+        each underlying NetCDF file. Only the reading is done holding the
+        NetCDF lock: decoding the data and constructing the trajectories is
+        done outside it, so that other threads can use the NetCDF libraries in
+        the meantime. This does not touch the trajectory cache, so it is safe
+        to call from the prefetching I/O thread.
+        """
+        if self.lazy:
+            if len(rows) > 0 and (rows[0] < 0 or rows[-1] >= len(self)):
+                raise IndexError('Trajectory index out of range')
+            fieldsets = list(self._projection or self._nc)
+            fields = None
+            if self._projection is not None:
+                fields = {name for names in self._projection.values() for name in names}
+            return {
+                index: LazyTrajectory(_StoreFieldLoader(self, index, fields), fieldsets)
+                for index in rows.tolist()
+            }
+
+        # Fields to read from each field set: all of them, unless the store
+        # has a field projection.
+        projection = self._projection
+        probe = self._npoints_probe()
+        if projection is None:
+            read_fields = {
+                fs_name: list(FieldSet.from_registry(fs_name)) for fs_name in self._nc
+            }
+        else:
+            read_fields = {
+                fs_name: list(names) for fs_name, names in projection.items()
+            }
+            if probe is not None:
+                read_fields.setdefault(probe[0], [])
+
+        # Raw data blocks, as (position in `rows`, field name, field metadata,
+        # species, fill value, data block) tuples, and trajectory lengths found
+        # without decoding pointwise fields, as (position in `rows`, lengths)
+        # tuples.
+        raw: list[tuple[int, str, FieldMetadata, list[Species], Any, np.ndarray]] = []
+        lengths: list[tuple[int, np.ndarray]] = []
+        with _NETCDF_LOCK:
+            # Handle field sets one by one.
+            for fs_name in self._nc:
+                if fs_name not in read_fields:
+                    continue
+
+                # Look up the field set in the field set registry.
+                fs = FieldSet.from_registry(fs_name)
+
+                # File information for the field set: for a merged store, the
+                # trajectories may be spread across a number of files.
+                nc_files = self._nc[fs_name]
+                species = nc_files.species or []
+                pos = 0
+                for file_index, local in self._plan_reads(nc_files, rows):
+                    group = nc_files.groups[fs_name][file_index]
+                    extents = _read_extents(group, local)
+                    if extents is not None:
+                        lengths.append((pos, extents[1]))
+                    elif probe is not None and probe[0] == fs_name:
+                        var = group.variables[probe[1]]
+                        block = _read_rows(var, local)
+                        lengths.append((pos, np.array([len(v) for v in block])))
+
+                    # Read data from NetCDF variables.
+                    for name in read_fields[fs_name]:
+                        field = fs[name]
+                        if name not in group.variables:
+                            raise ValueError(
+                                f'Data field "{name}" does not exist in NetCDF file'
+                            )
+                        var = group.variables[name]
+                        raw.append(
+                            (
+                                pos,
+                                name,
+                                field,
+                                species,
+                                var.get_fill_value(),
+                                _read_field_rows(var, field, local, extents),
+                            )
+                        )
+                    pos += len(local)
+
+        # Field values for each trajectory, keyed by position in `rows`.
+        data: list[dict[str, Any]] = [{} for _ in range(len(rows))]
+        npoints: list[int | None] = [None] * len(rows)
+        for pos, sizes in lengths:
+            npoints[pos : pos + len(sizes)] = sizes.tolist()
+        for pos, name, field, species, fill, block in raw:
+            vals = _decode_rows(fill, block, field, name, species)
+            has_point = Dimension.POINT in field.dimensions
+            for k, val in enumerate(vals):
+                data[pos + k][name] = val
+                if has_point and npoints[pos + k] is None and val is not None:
                     if Dimension.SPECIES in field.dimensions:
                         # Get number of points from arbitrary entry in the
                         # SpeciesValues dictionary here.
-                        npoints = len(next(iter(data[name].values())))
+                        npoints[pos + k] = len(next(iter(val.values())))
                     else:
                         # Data should be a simple Numpy array here.
-                        npoints = len(data[name])
-
-        # Construct the return trajectory.
-        assert npoints is not None
-        traj = Trajectory(npoints=npoints)
+                        npoints[pos + k] = len(val)
+
+        # Construct the trajectories.
+        # (Trajectories from a store with a field projection carry only the
+        # projected fields: they have the data dictionary of the field sets
+        # involved, but no values at all for the other fields.)
+        extra_fieldsets = [
+            FieldSet.from_registry(fs_name)
+            for fs_name in self._nc
+            if fs_name != BASE_FIELDSET_NAME
+            and (projection is None or fs_name in projection)
+        ]
+        keep = None
+        if projection is not None:
+            keep = {name for names in projection.values() for name in names}
+        loaded = {}
+        for index, n, values in zip(rows.tolist(), npoints, data):
+            assert n is not None
+            traj = Trajectory(npoints=n)
+            for fs in extra_fieldsets:
+                traj.add_fields(fs)
+            if keep is not None:
+                traj.X_data = {k: v for k, v in traj.X_data.items() if k in keep}
+            for k, v in values.items():
+                setattr(traj, k, v)
+            loaded[index] = traj
+        return loaded
+
+    def _read_lazy_field(self, index: int, name: str) -> Any:
+        """Read the value of a field of a trajectory for a lazy trajectory
+        view."""
+        if not self._nc:
+            raise RuntimeError('TrajectoryStore is closed')
+        try:
+            fs_name, field = self._field_location(name)
+        except ValueError:
+            fs_name = None
+        if fs_name is None or (
+            self._projection is not None
+            and name not in self._projection.get(fs_name, [])
+        ):
+            raise AttributeError(f"'Trajectory' object has no attribute '{name}'")
+        return self._read_trajectory_field(index, fs_name, name, field)
+
+    def _read_lazy_npoints(self, index: int) -> int:
+        """Find the number of points in a trajectory for a lazy trajectory
+        view: from the point counts of the ragged layout, or from the length
+        of a pointwise field."""
+        if not self._nc:
+            raise RuntimeError('TrajectoryStore is closed')
+        rows = np.array([index], dtype=np.int64)
+        with _NETCDF_LOCK:
+            for fs_name, nc_files in self._nc.items():
+                ((file_index, local),) = self._plan_reads(nc_files, rows)
+                extents = _read_extents(nc_files.groups[fs_name][file_index], local)
+                if extents is not None:
+                    return int(extents[1][0])
         for fs_name in self._nc:
-            if fs_name != BASE_FIELDSET_NAME:
-                traj.add_fields(FieldSet.from_registry(fs_name))
-        for k, v in data.items():
-            setattr(traj, k, v)
-
-        # Save the trajectory we've just loaded into the cache.
-        self._trajectories[index] = traj
-
-    def _write_trajectory(self, index: int) -> None:
-        """Write a trajectory at the given index to the NetCDF file(s)."""
-
-        # Look up the trajectory to write and write to files. We use a
-        # `_write_data` helper function so that we can also use `_write_data`
-        # for creating associated files.
-        self._write_data(traj=self._trajectories[index], index=index)
+            for name, field in FieldSet.from_registry(fs_name).items():
+                if (
+                    Dimension.POINT in field.dimensions
+                    and Dimension.SPECIES not in field.dimensions
+                ):
+                    value = self._read_trajectory_field(index, fs_name, name, field)
+                    if value is not None:
+                        return len(value)
+        raise ValueError('Cannot find number of points in trajectory')
+
+    def _read_trajectory_field(
+        self, index: int, fs_name: str, name: str, field: FieldMetadata
+    ) -> Any:
+        """Read and decode the value of a single field of a single
+        trajectory."""
+        nc_files = self._nc[fs_name]
+        rows = np.array([index], dtype=np.int64)
+        with _NETCDF_LOCK:
+            ((file_index, local),) = self._plan_reads(nc_files, rows)
+            group = nc_files.groups[fs_name][file_index]
+            if name not in group.variables:
+                raise ValueError(f'Data field "{name}" does not exist in NetCDF file')
+            extents = None
+            if Dimension.POINT in field.dimensions:
+                extents = _read_extents(group, local)
+            var = group.variables[name]
+            fill = var.get_fill_value()
+            block = _read_field_rows(var, field, local, extents)
+        return _decode_rows(fill, block, field, name, nc_files.species or [])[0]
+
+    def _recache(self, index: int, trajectory: Trajectory) -> None:
+        """Update the trajectory cache for a change in the size of a cached
+        trajectory (when a lazy trajectory loads a field)."""
+        with self._cache_lock:
+            if index not in self._trajectories:
+                return
+            try:
+                self._trajectories[index] = trajectory
+            except ValueError:
+                # Too big for the cache.
+                del self._trajectories[index]
 
-    def _write_data(
+    @_holding_netcdf_lock
+    def _write_block(
         self,
         *,
-        index: int,
-        traj: Trajectory | None = None,
-        data: Any | None = None,
+        start: int,
+        items: Sequence[Any],
         single_nc_file: TrajectoryStore.NcFiles | None = None,
         fieldsets: list[str] | None = None,
     ) -> None:
-        """Write a trajectory at the given index to the NetCDF file(s)."""
+        """Write a block of consecutive trajectories to the NetCDF file(s).
 
-        # Check: should be one or the other. We're either saving a real
-        # trajectory (called from `_write_trajectory`) or writing data to an
-        # associated file (called from `create_associated`).
-        if traj is None and data is None:
-            raise ValueError('Either traj or data must be provided')
+        The items to write are either trajectories (when called from `add` or
+        `save`) or "associated data" values implementing the `HasFieldSets`
+        protocol (when called from `create_associated`). The items are written
+        at indexes `start`, `start + 1`, ..., using one NetCDF write per
+        variable for the whole block wherever possible.
+        """
+        if len(items) == 0:
+            return
+        stop = start + len(items)
 
         # In the normal case, we handle all the field sets in the store. When
         # creating an associated NetCDF file, we only handle the specified
@@ -1654,28 +5023,165 @@ class TrajectoryStore:
         if fieldsets is None:
             fieldsets = list(self._nc.keys())
 
-        # Handle field sets one by one.
+        # Handle field sets one by one, keeping track of the files whose
+        # trajectory coordinate variable we've filled in.
+        written_files = []
         for fs_name in fieldsets:
             # File information for the field set and the NetCDF group for
             # variables in the field set.
             fs = FieldSet.from_registry(fs_name)
             nc_file = single_nc_file or self._nc[fs_name]
             group = nc_file.groups[fs_name][0]
+            ragged = '_row_size' in group.variables
 
+            # Variables with a leading underscore are internal and are not
+            # fields. Pointwise fields in the ragged layout are written
+            # together, below.
             for name in group.variables:
-                field = fs[name]
-                var = group.variables[name]
+                if name.startswith('_') or (
+                    ragged and Dimension.POINT in fs[name].dimensions
+                ):
+                    continue
+                self._write_block_to_nc_var(
+                    group.variables[name],
+                    start,
+                    name,
+                    fs[name],
+                    [getattr(item, name) for item in items],
+                    nc_file.species or [],
+                )
+            if ragged:
+                self._write_ragged_block(group, start, fs, nc_file.species, items)
 
-                # Get data either from the trajectory or the "associated data"
-                # we've been passed.
-                val = None
-                if traj is not None:
-                    val = getattr(traj, name)
-                elif data is not None:
-                    val = getattr(data, name)
+            if all(nc_file is not f for f in written_files):
+                nc_file.traj_var[0][start:stop] = np.arange(start, stop)
+                written_files.append(nc_file)
+
+    def _write_block_to_nc_var(
+        self,
+        var: nc4.Variable,
+        start: int,
+        name: str,
+        field: FieldMetadata,
+        vals: list[Any],
+        species: list[Species],
+    ) -> None:
+        """Write a block of values to a NetCDF variable starting at the given
+        index. (`species` are the species of the file's species dimension.)"""
+
+        # Missing optional values are skipped (leaving the NetCDF fill value in
+        # place), so blocks containing them are written value by value.
+        if any(val is None for val in vals):
+            for i, val in enumerate(vals):
+                self._write_to_nc_var(var, start + i, name, field, val, species)
+            return
+
+        # Values indexed by species or thrust mode are gathered into a single
+        # array for the block.
+        if (
+            Dimension.SPECIES in field.dimensions
+            or Dimension.THRUST_MODE in field.dimensions
+        ):
+            var[start : start + len(vals)] = _encode_rows(
+                vals, field, name, species, var.get_fill_value()
+            )
+            return
+
+        # Pointwise values (saved as variable length types) and strings are
+        # written from object arrays: we fill these element by element to
+        # stop Numpy from trying to build a 2-D array from equal length
+        # trajectories. (The NetCDF library insists on each element of a
+        # variable length block having exactly the variable's base type.)
+        if field.field_type is str:
+            block = np.empty(len(vals), dtype=object)
+            for i, val in enumerate(vals):
+                block[i] = val
+        elif Dimension.POINT in field.dimensions:
+            block = np.empty(len(vals), dtype=object)
+            for i, val in enumerate(vals):
+                block[i] = np.asarray(val, dtype=field.field_type)
+        else:
+            block = np.asarray(vals, dtype=field.field_type)
+        var[start : start + len(vals)] = block
 
-                self._write_to_nc_var(var, index, name, field, val)
-                nc_file.traj_var[0][index] = index
+    def _write_ragged_block(
+        self,
+        group: nc4.Group,
+        start: int,
+        fs: FieldSet,
+        species: list[Species] | None,
+        items: Sequence[Any],
+    ) -> None:
+        """Write the pointwise fields of a block of consecutive trajectories
+        to a NetCDF group using the ragged layout.
+
+        The points of the new trajectories are appended to the group's point
+        dimension, with one NetCDF write per variable for the whole block.
+        Missing optional values are stored as runs of the variable's fill
+        value.
+        """
+        stop = start + len(items)
+        fields = [(n, f) for n, f in fs.items() if Dimension.POINT in f.dimensions]
+        values = {n: [getattr(item, n) for item in items] for n, _ in fields}
+
+        # Determine the number of points in each trajectory from whichever
+        # pointwise values are present, checking that they're consistent.
+        sizes = np.full(len(items), -1, dtype=np.int64)
+        for name, field in fields:
+            for i, val in enumerate(values[name]):
+                if val is None:
+                    if field.required:
+                        raise ValueError(
+                            f'Data field "{name}" is None at index {start + i}'
+                        )
+                    continue
+                if Dimension.SPECIES in field.dimensions:
+                    n = len(next(iter(val.values()), []))
+                else:
+                    n = len(val)
+                if sizes[i] < 0:
+                    sizes[i] = n
+                elif sizes[i] != n:
+                    raise ValueError(
+                        f'Pointwise data fields in field set "{fs.fieldset_name}" '
+                        f'have inconsistent lengths at index {start + i}'
+                    )
+        sizes[sizes < 0] = 0
+
+        # Trajectories are always written in order, so the new points go at
+        # the end of the point dimension.
+        first = len(group.dimensions['point'])
+        offsets = np.cumsum(sizes) - sizes
+        group.variables['_row_size'][start:stop] = sizes
+        group.variables['_row_offset'][start:stop] = first + offsets
+        total = int(sizes.sum())
+        if total == 0:
+            return
+
+        for name, field in fields:
+            var = group.variables[name]
+            vals = values[name]
+            if Dimension.SPECIES in field.dimensions:
+                sp_list = species or []
+                block = np.full(
+                    (total, len(sp_list)), var.get_fill_value(), dtype=field.field_type
+                )
+                for off, val in zip(offsets, vals):
+                    if val is None:
+                        continue
+                    for si, sp in enumerate(sp_list):
+                        if sp in val:
+                            block[off : off + len(val[sp]), si] = val[sp]
+            elif any(val is None for val in vals):
+                block = np.full(total, var.get_fill_value(), dtype=field.field_type)
+                for off, val in zip(offsets, vals):
+                    if val is not None:
+                        block[off : off + len(val)] = val
+            else:
+                block = np.concatenate(
+                    [np.asarray(val, dtype=field.field_type) for val in vals]
+                )
+            var[first : first + total] = block
 
     def _write_to_nc_var(
         self,
@@ -1684,6 +5190,7 @@ class TrajectoryStore:
         name: str,
         field: FieldMetadata,
         val: Any,
+        species: list[Species],
     ) -> None:
         """Write a value to a NetCDF variable at the given index."""
 
@@ -1693,83 +5200,21 @@ class TrajectoryStore:
                 raise ValueError(f'Data field "{name}" is None at index {index}')
             return
 
-        # Save data to NetCDF variable, handling species and thrust modes. At
-        # this point, we assume that all the types are correct, since these
-        # will have been checked earlier. Numpy array values are saved as
-        # variable length types of the appropriate base type.
-        has_sp = Dimension.SPECIES in field.dimensions
-        has_tm = Dimension.THRUST_MODE in field.dimensions
-        match (has_sp, has_tm):
-            case (False, False):
-                # float, np.ndarray
-                var[index] = val
-            case (False, True):
-                # ThrustModeValues
-                for ti, tm in enumerate(ThrustMode):
-                    var[index, ti] = val[tm]
-            case (True, False):
-                # SpeciesValues[float], SpeciesValues[np.ndarray]
-                for si, sp in enumerate(Species):
-                    if sp in val:
-                        var[index, si] = val[sp]
-            case (True, True):
-                # SpeciesValues[ThrustModeValues]
-                for si, sp in enumerate(Species):
-                    for ti, tm in enumerate(ThrustMode):
-                        if sp in val and tm in val[sp]:
-                            var[index, si, ti] = val[sp][tm]
-
-    def _read_from_nc_var(
-        self,
-        var: nc4.Variable,
-        index: int,
-        name: str,
-        field: FieldMetadata,
-        species: list[Species],
-    ) -> Any:
-        """Read a value from a NetCDF variable at the given index."""
-
-        # Make sure the netCDF4 package doesn't return masked arrays.
-        var.set_auto_mask(False)
-
-        # Read data from NetCDF variable, handling species and thrust modes.
-        match (
-            Dimension.SPECIES in field.dimensions,
-            Dimension.THRUST_MODE in field.dimensions,
-            Dimension.POINT in field.dimensions,
+        # Save data to NetCDF variable. At this point, we assume that all the
+        # types are correct, since these will have been checked earlier. Numpy
+        # array values are saved as variable length types of the appropriate
+        # base type. Values indexed by species and thrust mode are written as
+        # a whole row in one go.
+        if (
+            Dimension.SPECIES in field.dimensions
+            or Dimension.THRUST_MODE in field.dimensions
         ):
-            case (False, False, False):
-                # float
-                if var[index] == var.get_fill_value():
-                    return None
-                return var[index]
-            case (False, False, True):
-                # np.ndarray
-                if all(var[index] == var.get_fill_value()):
-                    return None
-                return var[index]
-            case (True, False, False) | (True, False, True):
-                # SpeciesValues[float] | SpeciesValues[np.ndarray]
-                return SpeciesValues(
-                    {sp: var[index, si] for si, sp in enumerate(species)}
-                )
-            case (False, True, False):
-                # ThrustModeValues
-                return ThrustModeValues(
-                    {tm: var[index, ti] for ti, tm in enumerate(ThrustMode)}
-                )
-            case (True, True, False):
-                # SpeciesValues[ThrustModeValues]
-                return SpeciesValues[ThrustModeValues](
-                    {
-                        sp: ThrustModeValues(
-                            {tm: var[index, si, ti] for ti, tm in enumerate(ThrustMode)}
-                        )
-                        for si, sp in enumerate(species)
-                    }
-                )
-            case _:
-                raise ValueError(f'Invalid combination of dimensions for field {name}')
+            var[index] = _encode_rows(
+                [val], field, name, species, var.get_fill_value()
+            )[0]
+        else:
+            # float, np.ndarray
+            var[index] = val
 
     def _check_file_paths(self, paths: list[PathType], mode: FileMode) -> None:
         # Ensure all input paths are distinct.
@@ -1783,6 +5228,14 @@ class TrajectoryStore:
             for p in resolved_paths:
                 if p.exists():
                     raise ValueError(f'Input file {p} already exists')
+                if p.name.endswith(COLUMN_STORE_SUFFIX):
+                    raise ValueError(
+                        f'Column store {p} cannot be created directly: use export'
+                    )
+                if p.name.endswith(UNION_STORE_SUFFIX):
+                    raise ValueError(
+                        f'Union store {p} cannot be created directly: use union'
+                    )
                 if not p.parent.exists():
                     raise ValueError(f'Parent directory of file {p} does not exist')
         else:
@@ -1792,24 +5245,53 @@ class TrajectoryStore:
                     raise ValueError(f'Input file {p} does not exist')
 
             # Checks related to merged stores:
-            #  - If any input paths are files, then all must be files (normal
-            #    store).
-            #  - If any input paths are directories, then all must be
-            #    directories (merged store).
+            #  - If the base path is a directory (merged store), then all
+            #    associated paths must be directories too.
+            #  - If the base path is a file (normal store), associated paths
+            #    may be files or directories: merged associated stores are
+            #    produced by the parallel mode of `create_associated`.
             #  - For a merged store, all input directories must have a name
             #    suffix of ".aeic-store".
             #  - For a merged store, only reading is allowed (no appending).
-            #  - For a merged store, all directories must contain a
+            #  - For a merged base store, all directories must contain a
             #    metadata.json file and the same number of NetCDF files.
-            self.merged_store = any(p.is_dir() for p in resolved_paths)
-            normal = any(p.is_file() for p in resolved_paths)
-            if self.merged_store and normal:
+            #
+            # Column stores are also directories, but are handled separately:
+            # they may only be opened for reading, and without associated
+            # files.
+            if str(resolved_paths[0].name).endswith(COLUMN_STORE_SUFFIX):
+                self.column_store = True
+                if mode != TrajectoryStore.FileMode.READ:
+                    raise ValueError('Column stores may only be opened in READ mode')
+                if len(resolved_paths) > 1:
+                    raise ValueError(
+                        'Associated files may not be used with column stores'
+                    )
+                return
+            unions = [p.name.endswith(UNION_STORE_SUFFIX) for p in resolved_paths]
+            if unions[0]:
+                self.merged_store = self.union_store = True
+                if mode != TrajectoryStore.FileMode.READ:
+                    raise ValueError('Union stores may only be opened in READ mode')
+                if not all(u or p.is_dir() for u, p in zip(unions, resolved_paths)):
+                    raise ValueError(
+                        'Associated files of a union store must be union or '
+                        'merged stores'
+                    )
+                return
+            if any(unions):
+                raise ValueError(
+                    'Union stores may only be associated with union stores'
+                )
+            self.merged_store = resolved_paths[0].is_dir()
+            dirs = [p for p in resolved_paths if p.is_dir()]
+            if self.merged_store and len(dirs) != len(resolved_paths):
                 raise ValueError('Invalid mix of files and directories in input paths')
-            if self.merged_store:
+            if len(dirs) > 0:
                 if mode != TrajectoryStore.FileMode.READ:
                     raise ValueError('Merged stores may only be opened in READ mode')
                 num_files: int | None = None
-                for p in resolved_paths:
+                for p in dirs:
                     if not str(p.name).endswith('.aeic-store'):
                         raise ValueError(
                             f'Merged store directory "{p}" does not have '
@@ -1825,7 +5307,7 @@ class TrajectoryStore:
                     nfiles = len(metadata.get('stores', []))
                     if num_files is None:
                         num_files = nfiles
-                    elif nfiles != num_files:
+                    elif nfiles != num_files and self.merged_store:
                         raise ValueError(
                             'All merged store directories must contain '
                             'the same number of NetCDF files'
@@ -1842,6 +5324,18 @@ class TrajectoryStore:
         comment: str | None = None,
         history: str | None = None,
         source: str | None = None,
+        write_buffer_size: int | None = None,
+        write_buffer_mb: float | None = None,
+        write_behind: bool | None = None,
+        checkpoint_every: int | None = None,
+        checkpoint_seconds: float | None = None,
+        concurrent: bool | None = None,
+        layout: Layout | str | None = None,
+        storage_policy: StoragePolicy | str | None = None,
+        fieldsets: list[str] | None = None,
+        fields: list[str] | None = None,
+        lazy: bool | None = None,
+        max_open_files: int | None = None,
     ):
         """Check constructor input arguments based on file mode."""
 
@@ -1866,6 +5360,69 @@ class TrajectoryStore:
         if source is not None:
             self.global_attributes['source'] = source
 
+        write_buffer_ok = mode in (self.FileMode.CREATE, self.FileMode.APPEND)
+        if not write_buffer_ok and (
+            write_buffer_size is not None or write_buffer_mb is not None
+        ):
+            raise ValueError(
+                'write_buffer_size and write_buffer_mb may only be specified '
+                'in CREATE and APPEND modes'
+            )
+        if write_buffer_size is not None and write_buffer_size < 1:
+            raise ValueError('write_buffer_size must be at least 1')
+        if write_buffer_mb is not None and write_buffer_mb <= 0:
+            raise ValueError('write_buffer_mb must be positive')
+        if write_behind and not write_buffer_ok:
+            raise ValueError(
+                'write_behind may only be specified in CREATE and APPEND modes'
+            )
+        if not write_buffer_ok and (
+            checkpoint_every is not None or checkpoint_seconds is not None
+        ):
+            raise ValueError(
+                'checkpoint_every and checkpoint_seconds may only be specified '
+                'in CREATE and APPEND modes'
+            )
+        if checkpoint_every is not None and checkpoint_every < 1:
+            raise ValueError('checkpoint_every must be at least 1')
+        if checkpoint_seconds is not None and checkpoint_seconds <= 0:
+            raise ValueError('checkpoint_seconds must be positive')
+
+        concurrent_ok = mode == self.FileMode.READ
+        if concurrent and not concurrent_ok:
+            raise ValueError('concurrent may only be specified in READ mode')
+
+        # Trajectories with only some of their fields can't be written back.
+        projection_ok = mode == self.FileMode.READ
+        if (fieldsets is not None or fields is not None) and not projection_ok:
+            raise ValueError('fieldsets and fields may only be specified in READ mode')
+        if lazy and not projection_ok:
+            raise ValueError('lazy may only be specified in READ mode')
+        self.lazy = bool(lazy)
+
+        # Only merged stores, which are read-only, open files as needed.
+        if max_open_files is not None and mode != self.FileMode.READ:
+            raise ValueError('max_open_files may only be specified in READ mode')
+        if max_open_files is not None and max_open_files < 1:
+            raise ValueError('max_open_files must be at least 1')
+        self._open_files = _OpenFileLRU(
+            max_open_files if max_open_files is not None else MAX_OPEN_FILES
+        )
+
+        # The layout of existing files is recorded in the files.
+        layout_ok = mode == self.FileMode.CREATE
+        if layout is not None and not layout_ok:
+            raise ValueError('layout may only be specified in CREATE mode')
+        try:
+            self.layout = self.Layout(layout if layout is not None else 'vlen')
+        except ValueError:
+            raise ValueError(f'Unknown storage layout "{layout}"')
+
+        # The same goes for the storage policy.
+        if storage_policy is not None and not layout_ok:
+            raise ValueError('storage_policy may only be specified in CREATE mode')
+        self.storage_policy = StoragePolicy.from_spec(storage_policy)
+
         # Setting base_file=None in CREATE mode creates an empty TrajectoryStore.
         # We can switch to a file-backed store later using the save method, but
         # in the meantime, the trajectory cache is limited in size and cannot
@@ -2006,6 +5563,1104 @@ class TrajectoryStore:
         return check_paths
 
 
+class ShardedTrajectoryWriter:
+    """Writer for the shards of a merged store, returned by
+    `TrajectoryStore.create_sharded`.
+
+    Trajectories are added using `add` and `add_many`, as for a
+    `TrajectoryStore` in CREATE mode, and the writer should be closed (or
+    used as a context manager) to add the last shard to the merged store. If
+    the body of the `with` statement raises an exception, the shard being
+    written is deleted instead of being added to the store (shards that were
+    already added stay in the store).
+    """
+
+    def __init__(
+        self,
+        store_dir: Path,
+        max_trajectories: int | None,
+        max_bytes: int | None,
+        prefix: str,
+        create_kwargs: dict[str, Any],
+        species: list[Species] | None = None,
+    ):
+        self.store_dir = store_dir
+        self.max_trajectories = max_trajectories
+        self.max_bytes = max_bytes
+        self.prefix = prefix
+        self._create_kwargs = create_kwargs
+        self._attributes = {
+            k: create_kwargs.get(k) for k in ('title', 'comment', 'history', 'source')
+        }
+
+        # Species dimension used for every shard: fixed by the first
+        # trajectory added, if not given.
+        self.species = species
+
+        # Shards written so far, the shard being written and its size, and
+        # the total number of trajectories added.
+        self.shards: list[Path] = []
+        self._store: TrajectoryStore | None = None
+        self._shard_path: Path | None = None
+        self._shard_count = 0
+        self._shard_bytes = 0
+        self._count = 0
+        self._next_shard = 0
+
+    def __len__(self) -> int:
+        """Number of trajectories added using this writer."""
+        return self._count
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, _exc_type, exc, tb):
+        if exc is not None:
+            self._discard_shard()
+        else:
+            self.close()
+        return False
+
+    def add(self, trajectory: Trajectory) -> int:
+        """Add a trajectory and return its index among the trajectories added
+        using this writer."""
+        nbytes = self._nbytes(trajectory)
+        if self.species is None:
+            self.species = trajectory.species
+        if self._store is not None and self._shard_full(0, nbytes):
+            self._finish_shard()
+        if self._store is None:
+            self._start_shard()
+        self._add_block([trajectory], nbytes)
+        return self._count - 1
+
+    def add_many(self, trajectories: Iterable[Trajectory]) -> list[int]:
+        """Add multiple trajectories, returning their indexes among the
+        trajectories added using this writer.
+
+        Trajectories are written to each shard in blocks, as for
+        `TrajectoryStore.add_many`.
+        """
+        indexes = []
+        block: list[Trajectory] = []
+        block_bytes = 0
+        for trajectory in trajectories:
+            nbytes = self._nbytes(trajectory)
+            if self.species is None:
+                self.species = trajectory.species
+            if self._store is None:
+                self._start_shard()
+            if self._shard_full(len(block), block_bytes + nbytes):
+                self._add_block(block, block_bytes)
+                block = []
+                block_bytes = 0
+                self._finish_shard()
+                self._start_shard()
+            block.append(trajectory)
+            block_bytes += nbytes
+            indexes.append(self._count + len(block) - 1)
+            if len(block) >= ADD_MANY_BLOCK_SIZE:
+                self._add_block(block, block_bytes)
+                block = []
+                block_bytes = 0
+        self._add_block(block, block_bytes)
+        return indexes
+
+    def sync(self) -> None:
+        """Synchronize pending writes to the shard being written."""
+        if self._store is not None:
+            self._store.sync()
+
+    def close(self) -> None:
+        """Finish the shard being written and add it to the merged store."""
+        if self._store is not None:
+            self._finish_shard()
+
+    def _add_block(self, block: list[Trajectory], nbytes: int) -> None:
+        # Trajectories are only counted once they've been written, so the
+        # counts stay right if a write fails.
+        if len(block) > 0:
+            assert self._store is not None
+            self._store.add_many(block)
+            self._shard_count += len(block)
+            self._shard_bytes += nbytes
+            self._count += len(block)
+
+    def _nbytes(self, trajectory: Trajectory) -> int:
+        # Measuring trajectories isn't free, so is only done if needed.
+        return trajectory.nbytes if self.max_bytes is not None else 0
+
+    def _shard_full(self, pending: int, nbytes: int) -> bool:
+        """Check whether adding a trajectory would overfill the current shard,
+        given `pending` trajectories not yet written to it and `nbytes` bytes
+        of those and the new trajectory. (A shard always gets at least one
+        trajectory.)"""
+        count = self._shard_count + pending
+        if count == 0:
+            return False
+        if self.max_trajectories is not None:
+            if count >= self.max_trajectories:
+                return True
+        if self.max_bytes is not None:
+            if self._shard_bytes + nbytes > self.max_bytes:
+                return True
+        return False
+
+    def _start_shard(self) -> None:
+        # Skip over names already in use (from earlier runs with the same
+        # prefix, for example).
+        while True:
+            path = self.store_dir / f'{self.prefix}_{self._next_shard:05d}.nc'
+            self._next_shard += 1
+            if not path.exists():
+                break
+        self._shard_path = path
+        self._store = TrajectoryStore.create(base_file=path, **self._create_kwargs)
+        self._store._create_species = self.species
+        self._shard_count = 0
+        self._shard_bytes = 0
+
+    def _finish_shard(self) -> None:
+        assert self._store is not None and self._shard_path is not None
+        store, path = self._store, self._shard_path
+        self._store = None
+        self._shard_path = None
+        store.close()
+        if self._shard_count > 0:
+            TrajectoryStore._register_merged_files(
+                self.store_dir, [path], self._attributes
+            )
+            self.shards.append(path)
+
+    def _discard_shard(self) -> None:
+        """Close and delete the shard being written, without adding it to the
+        merged store."""
+        if self._store is None:
+            return
+        assert self._shard_path is not None
+        store, path = self._store, self._shard_path
+        self._store = None
+        self._shard_path = None
+        # The shard is deleted anyway, so errors closing it are ignored: they
+        # would only hide the exception that got us here.
+        with contextlib.suppress(Exception):
+            store.close()
+        path.unlink(missing_ok=True)
+
+
+@contextlib.contextmanager
+def _merged_store_lock(store_dir: Path) -> Iterator[None]:
+    """Hold an exclusive lock on a merged store directory while changing its
+    metadata and index files."""
+    with open(store_dir / '.lock', 'a') as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def _check_associated_result(associated_data: Any, fieldsets: list[str]) -> None:
+    """Check that a result from a `create_associated` mapping function has the
+    field sets we expect."""
+    if not isinstance(associated_data, HasFieldSets):
+        raise ValueError(
+            'Result of mapping_function must implement HasFieldSets protocol'
+        )
+    assoc_field_sets = associated_data.FIELD_SETS
+    assert isinstance(assoc_field_sets, list)
+    if len(assoc_field_sets) != len(fieldsets):
+        raise ValueError(
+            'Result of mapping_function must contain all field sets '
+            'specified for associated NetCDF file'
+        )
+    if set(fs.fieldset_name for fs in assoc_field_sets) != set(fieldsets):
+        raise ValueError(
+            'Field sets in mapping_function result must match field sets '
+            'specified for associated NetCDF file'
+        )
+
+
+def _associated_species(fieldsets: list[str], associated_data: Any) -> list[Species]:
+    """Determine the species needed in the species dimension of an associated
+    NetCDF file from a `create_associated` mapping function result."""
+    _check_associated_result(associated_data, fieldsets)
+    species = set()
+    for fs_name in fieldsets:
+        fs = FieldSet.from_registry(fs_name)
+        for f, metadata in fs.fields.items():
+            if Dimension.SPECIES in metadata.dimensions:
+                species.update(getattr(associated_data, f).keys())
+    return sorted(species)
+
+
+def _create_associated_part(
+    *,
+    base_file: PathType,
+    associated_files: AssociatedFiles,
+    override: bool,
+    force_fieldset_matches: bool,
+    output_file: Path,
+    fieldsets: list[str],
+    species: list[Species],
+    associated_name: Path,
+    associated_hash: str,
+    storage_policy: StoragePolicy,
+    start: int,
+    stop: int,
+    mapping_function: AssociatedFileCreateFn,
+    args: tuple,
+    kwargs: dict,
+) -> int:
+    """Worker process function for parallel `create_associated`.
+
+    Opens the base store read-only and writes the mapping function results for
+    trajectories `start` to `stop` to a new associated NetCDF file, returning
+    the number of trajectories written."""
+    with TrajectoryStore.open(
+        base_file=base_file,
+        associated_files=associated_files,
+        override=override,
+        force_fieldset_matches=force_fieldset_matches,
+    ) as ts:
+        nc_info = ts._create_nc_file(
+            output_file,
+            set(fieldsets),
+            species,
+            save=False,
+            associated_name=associated_name,
+            associated_hash=associated_hash,
+            storage_policy=storage_policy,
+        )
+        try:
+            ts._write_associated(
+                nc_info,
+                fieldsets,
+                (
+                    mapping_function(traj, *args, **kwargs)
+                    for traj in ts._iter_range(start, stop)
+                ),
+            )
+        finally:
+            nc_info.dataset[0].close()
+    return stop - start
+
+
+def _compact_part(
+    *,
+    base_file: PathType,
+    associated_files: AssociatedFiles,
+    override: bool,
+    force_fieldset_matches: bool,
+    fieldsets: list[FieldSet],
+    outputs: list[Path],
+    rows: np.ndarray,
+    layout: TrajectoryStore.Layout | None,
+    storage_policy: StoragePolicy | None,
+) -> None:
+    """Worker process function for parallel `compact`.
+
+    Opens the store read-only and writes the trajectories at the given
+    indexes to new NetCDF files, one for the base field sets and one for each
+    associated file to be copied."""
+
+    # Field sets defined outside AEIC (which aren't registered in a new
+    # process until the module defining them is imported) are registered
+    # from the definitions passed from the parent process.
+    for fs in fieldsets:
+        if not FieldSet.known(fs.fieldset_name):
+            FieldSet(fs.fieldset_name, **fs.fields)
+
+    with TrajectoryStore.open(
+        base_file=base_file,
+        associated_files=associated_files,
+        override=override,
+        force_fieldset_matches=force_fieldset_matches,
+    ) as ts:
+        ts._write_rows(outputs, rows, layout, storage_policy)
+
+
+def _map_reduce_part(
+    *,
+    open_kwargs: dict[str, Any],
+    start: int | None,
+    stop: int | None,
+    map_fn: Callable[..., Any],
+    reduce_fn: Callable[[Any, Any], Any],
+    args: tuple,
+    kwargs: dict,
+) -> tuple[bool, Any]:
+    """Worker process function for `map_reduce`.
+
+    Opens the store read-only and combines the results of the map function
+    for trajectories `start` to `stop` (or the whole store, if these are
+    None). Returns a flag saying whether there were any trajectories, and the
+    combined result."""
+    result = None
+    have_result = False
+    with TrajectoryStore.open(**open_kwargs) as ts:
+        if start is None or stop is None:
+            start, stop = 0, len(ts)
+        for traj in ts._iter_range(start, stop):
+            value = map_fn(traj, *args, **kwargs)
+            result = reduce_fn(result, value) if have_result else value
+            have_result = True
+    return have_result, result
+
+
+# Maximum gap between trajectory indexes that are read as part of the same
+# contiguous block. Reading a few unneeded trajectories is much cheaper than
+# making an extra NetCDF read call.
+
+READ_RUN_MAX_GAP = 16
+
+# The same for reads of points from variables in the ragged storage layout:
+# point ranges separated by at most this many points are read together.
+
+READ_RUN_MAX_POINT_GAP = 4096
+
+
+def _index_runs(rows: np.ndarray, max_gap: int = READ_RUN_MAX_GAP) -> list[slice]:
+    """Split sorted unique indexes into runs of nearby indexes.
+
+    Each run is returned as a slice covering the indexes in the run."""
+    if len(rows) == 0:
+        return []
+    breaks = np.nonzero(np.diff(rows) > max_gap)[0] + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks, [len(rows)]))
+    return [slice(int(rows[a]), int(rows[b - 1]) + 1) for a, b in zip(starts, ends)]
+
+
+def _read_rows(var: nc4.Variable, rows: np.ndarray) -> np.ndarray:
+    """Read the given sorted unique trajectory indexes from a NetCDF variable,
+    using one read per run of nearby indexes."""
+
+    # Make sure the netCDF4 package doesn't return masked arrays.
+    var.set_auto_mask(False)
+
+    blocks = []
+    for run in _index_runs(rows):
+        block = var[run]
+        wanted = rows[(rows >= run.start) & (rows < run.stop)] - run.start
+        blocks.append(block[wanted])
+    return np.concatenate(blocks)
+
+
+def _read_extents(
+    group: nc4.Group, rows: np.ndarray
+) -> tuple[np.ndarray, np.ndarray] | None:
+    """Read the point offsets and sizes for the given sorted trajectory
+    indexes from a NetCDF group using the ragged storage layout.
+
+    Returns None for groups using the variable-length array layout."""
+    if '_row_size' not in group.variables:
+        return None
+    offsets = _read_rows(group.variables['_row_offset'], rows)
+    sizes = _read_rows(group.variables['_row_size'], rows)
+    return offsets.astype(np.int64), sizes.astype(np.int64)
+
+
+def _read_point_ranges(
+    var: nc4.Variable, starts: np.ndarray, stops: np.ndarray
+) -> np.ndarray:
+    """Read ranges of points from a pointwise variable in the ragged storage
+    layout.
+
+    Returns an object array with one entry per range, each entry holding the
+    array of values for the range (for variables with a species dimension,
+    the object array has a second axis over species, to match the structure
+    of variable-length array reads). Nearby ranges are read using a single
+    NetCDF read.
+    """
+    var.set_auto_mask(False)
+    extra = var.shape[1:]
+    result = np.empty((len(starts), *extra), dtype=object)
+    if len(starts) == 0:
+        return result
+
+    # Group the ranges into runs, in order of position in the file.
+    order = np.argsort(starts, kind='stable')
+    run_start = 0
+    while run_start < len(order):
+        p0 = int(starts[order[run_start]])
+        p1 = int(stops[order[run_start]])
+        run_stop = run_start + 1
+        while (
+            run_stop < len(order)
+            and starts[order[run_stop]] - p1 <= READ_RUN_MAX_POINT_GAP
+        ):
+            p1 = max(p1, int(stops[order[run_stop]]))
+            run_stop += 1
+
+        # One read for the run, then copy out each range. (Copying means that
+        # trajectories don't hold references to the whole block.)
+        block = var[p0:p1]
+        for i in order[run_start:run_stop]:
+            values = block[starts[i] - p0 : stops[i] - p0]
+            if len(extra) == 0:
+                result[i] = values.copy()
+            else:
+                for k in range(extra[0]):
+                    result[i, k] = values[:, k].copy()
+        run_start = run_stop
+    return result
+
+
+def _read_field_rows(
+    var: nc4.Variable,
+    field: FieldMetadata,
+    rows: np.ndarray,
+    extents: tuple[np.ndarray, np.ndarray] | None,
+) -> np.ndarray:
+    """Read the given sorted trajectory indexes from the NetCDF variable for
+    a field, for either storage layout. (`extents` are the point offsets and
+    sizes for the rows from `_read_extents`.)"""
+    if extents is not None and Dimension.POINT in field.dimensions:
+        offsets, sizes = extents
+        return _read_point_ranges(var, offsets, offsets + sizes)
+    return _read_rows(var, rows)
+
+
+def _point_ranges(starts: np.ndarray, sizes: np.ndarray) -> np.ndarray:
+    """Indexes of all the points in the ranges with the given starts and
+    sizes, concatenated in order."""
+    return np.repeat(starts - (np.cumsum(sizes) - sizes), sizes) + np.arange(
+        int(sizes.sum())
+    )
+
+
+def _read_group_rows(
+    group: nc4.Group, fs: FieldSet, rows: np.ndarray, flat: bool
+) -> tuple[dict[str, np.ndarray], np.ndarray | None]:
+    """Read all the variables of a field set's NetCDF group for the given
+    sorted trajectory indexes, for copying to another file.
+
+    If `flat` is true and the group uses the ragged layout, pointwise
+    variables are returned as flat arrays of points, along with the sizes of
+    the trajectories. Otherwise pointwise variables are returned as object
+    arrays holding an array per trajectory (as read from the variable-length
+    array layout) and the sizes are None.
+    """
+    extents = _read_extents(group, rows)
+    sizes = extents[1] if flat and extents is not None else None
+    points = _point_ranges(*extents) if sizes is not None else None  # type: ignore[misc]
+    data = {}
+    for name, var in group.variables.items():
+        if name.startswith('_'):
+            continue
+        if points is not None and Dimension.POINT in fs[name].dimensions:
+            data[name] = _read_points(var, points)
+        else:
+            data[name] = _read_field_rows(var, fs[name], rows, extents)
+    return data, sizes
+
+
+def _join_group_rows(
+    fs: FieldSet,
+    parts: list[tuple[dict[str, np.ndarray], np.ndarray | None]],
+    inverse: np.ndarray | None,
+) -> tuple[dict[str, np.ndarray], np.ndarray | None]:
+    """Join the results of `_read_group_rows` for consecutive files, then
+    rearrange the trajectories to the order given by `inverse` (indexes into
+    the joined trajectories, or None to keep them in the order read)."""
+    data = {name: np.concatenate([d[name] for d, _ in parts]) for name in parts[0][0]}
+    sizes = None
+    if parts[0][1] is not None:
+        sizes = np.concatenate([s for _, s in parts])  # type: ignore[misc]
+    if inverse is None:
+        return data, sizes
+
+    points = None
+    if sizes is not None:
+        points = _point_ranges((np.cumsum(sizes) - sizes)[inverse], sizes[inverse])
+        sizes = sizes[inverse]
+    for name, values in data.items():
+        if points is not None and Dimension.POINT in fs[name].dimensions:
+            data[name] = values[points]
+        else:
+            data[name] = values[inverse]
+    return data, sizes
+
+
+def _write_group_rows(
+    group: nc4.Group,
+    fs: FieldSet,
+    n: int,
+    data: dict[str, np.ndarray],
+    sizes: np.ndarray | None,
+    start: int,
+    first_point: int,
+) -> int:
+    """Write `n` trajectories read by `_read_group_rows` to consecutive
+    trajectories of a field set's NetCDF group in a new file, starting at
+    index `start`.
+
+    Pointwise data read as object arrays is converted to the ragged layout
+    if the new group uses it, with the number of points of each trajectory
+    taken from its longest pointwise value and missing values stored as runs
+    of fill values. In the ragged layout, the points of the trajectories are
+    written from point `first_point` onwards. Returns the number of points
+    written.
+    """
+    stop = start + n
+    if '_row_size' not in group.variables:
+        for name, values in data.items():
+            group.variables[name][start:stop] = values
+        return 0
+
+    pointwise = [name for name in data if Dimension.POINT in fs[name].dimensions]
+    if sizes is None:
+        sizes = np.zeros(n, dtype=np.int64)
+        lengths = np.vectorize(len, otypes=[np.int64])
+        for name in pointwise:
+            if n > 0:
+                sizes = np.maximum(sizes, lengths(data[name]).reshape(n, -1).max(1))
+        offsets = np.cumsum(sizes) - sizes
+        for name in pointwise:
+            values = data[name].reshape(n, -1)
+            var = group.variables[name]
+            block = np.full(
+                (int(sizes.sum()), values.shape[1]),
+                var.get_fill_value(),
+                dtype=var.dtype,
+            )
+            for i, row in enumerate(values):
+                for k, v in enumerate(row):
+                    block[offsets[i] : offsets[i] + len(v), k] = v
+            data[name] = block.reshape(-1, *var.shape[1:])
+
+    total = int(sizes.sum())
+    group.variables['_row_size'][start:stop] = sizes
+    group.variables['_row_offset'][start:stop] = first_point + np.cumsum(sizes) - sizes
+    for name, values in data.items():
+        if name not in pointwise:
+            group.variables[name][start:stop] = values
+        elif total > 0:
+            group.variables[name][first_point : first_point + total] = values
+    return total
+
+
+def _write_index_group(
+    dataset: nc4.Dataset, flight_ids: np.ndarray, indexes: np.ndarray | None = None
+) -> None:
+    """Create the flight ID index group in a new NetCDF file, for
+    trajectories with the given flight IDs and indexes (by default, indexes
+    from zero)."""
+    order = np.argsort(flight_ids, kind='stable')
+    group = dataset.createGroup('_index')
+    group.createVariable('flight_id', np.int64, ('trajectory',))
+    group.createVariable('trajectory_index', np.int64, ('trajectory',))
+    if len(flight_ids) > 0:
+        group.variables['flight_id'][:] = flight_ids[order]
+        group.variables['trajectory_index'][:] = (
+            order if indexes is None else indexes[order]
+        )
+
+
+def _read_points(var: nc4.Variable, points: np.ndarray) -> np.ndarray:
+    """Read the given points from a pointwise variable in the ragged storage
+    layout, using one read per run of nearby points."""
+    var.set_auto_mask(False)
+    order = np.argsort(points, kind='stable')
+    ordered = points[order]
+    result = np.empty((len(points), *var.shape[1:]), dtype=var.dtype)
+    pos = 0
+    for run in _index_runs(ordered, READ_RUN_MAX_POINT_GAP):
+        end = pos + int(np.searchsorted(ordered[pos:], run.stop))
+        result[order[pos:end]] = var[run][ordered[pos:end] - run.start]
+        pos = end
+    return result
+
+
+def _field_result(
+    data: np.ndarray, field: FieldMetadata, species: list[Species] | None
+) -> np.ndarray | RaggedArray | SpeciesValues:
+    """Convert rows read from a NetCDF variable to the form returned by
+    `read_field` and `read_points`."""
+    has_point = Dimension.POINT in field.dimensions
+
+    def convert(d: np.ndarray) -> np.ndarray | RaggedArray:
+        if has_point:
+            return RaggedArray.from_rows(
+                [np.asarray(r, dtype=field.field_type) for r in d],
+                dtype=field.field_type,
+            )
+        return d
+
+    if Dimension.SPECIES in field.dimensions:
+        species = species or []
+        if len(data) == 0:
+            return SpeciesValues({sp: convert(data) for sp in species})
+        return SpeciesValues(
+            {sp: convert(data[:, si]) for si, sp in enumerate(species)}
+        )
+    return convert(data)
+
+
+def _decode_rows(
+    fill: Any,
+    block: np.ndarray,
+    field: FieldMetadata,
+    name: str,
+    species: list[Species],
+) -> list[Any]:
+    """Convert a block of rows read from a NetCDF variable to field values.
+
+    Missing values (equal to `fill`, the variable's fill value) are returned
+    as None for fields not indexed by species or thrust mode.
+    """
+    match (
+        Dimension.SPECIES in field.dimensions,
+        Dimension.THRUST_MODE in field.dimensions,
+        Dimension.POINT in field.dimensions,
+    ):
+        case (False, False, False):
+            # float
+            missing = block == fill
+            return [None if m else v for m, v in zip(missing, block)]
+        case (False, False, True):
+            # np.ndarray
+            return [None if np.all(v == fill) else v for v in block]
+        case (True, False, False) | (True, False, True):
+            # SpeciesValues[float] | SpeciesValues[np.ndarray]
+            return [
+                SpeciesValues({sp: row[si] for si, sp in enumerate(species)})
+                for row in block
+            ]
+        case (False, True, False):
+            # ThrustModeValues
+            return [
+                ThrustModeValues({tm: row[ti] for ti, tm in enumerate(ThrustMode)})
+                for row in block
+            ]
+        case (True, True, False):
+            # SpeciesValues[ThrustModeValues]
+            return [
+                SpeciesValues[ThrustModeValues](
+                    {
+                        sp: ThrustModeValues(
+                            {tm: row[si, ti] for ti, tm in enumerate(ThrustMode)}
+                        )
+                        for si, sp in enumerate(species)
+                    }
+                )
+                for row in block
+            ]
+        case _:
+            raise ValueError(f'Invalid combination of dimensions for field {name}')
+
+
+def _encode_rows(
+    vals: list[Any],
+    field: FieldMetadata,
+    name: str,
+    species: list[Species],
+    fill: Any,
+) -> np.ndarray:
+    """Convert values of a field indexed by species and/or thrust mode to a
+    block of rows for a NetCDF variable (the reverse of `_decode_rows`).
+
+    `species` are the species of the file's species dimension. Species (and,
+    for per-species thrust mode values, thrust modes) missing from a value
+    are left as `fill`, or as empty arrays for pointwise fields. Species not
+    in the file's species dimension can't be written, so raise an error.
+    """
+    has_sp = Dimension.SPECIES in field.dimensions
+    has_tm = Dimension.THRUST_MODE in field.dimensions
+    if has_sp:
+        known = set(species)
+        for val in vals:
+            extra = set(val) - known
+            if len(extra) > 0:
+                raise ValueError(
+                    f'Species {sorted(sp.name for sp in extra)} in data field '
+                    f'"{name}" are not in the species dimension of the NetCDF '
+                    f'file {sorted(sp.name for sp in species)}'
+                )
+    shape = (
+        len(vals),
+        *((len(species),) if has_sp else ()),
+        *((len(ThrustMode),) if has_tm else ()),
+    )
+
+    # Pointwise values are saved as variable length types, so are written from
+    # object arrays.
+    if Dimension.POINT in field.dimensions:
+        block = np.empty(shape, dtype=object)
+        empty = np.empty(0, dtype=field.field_type)
+        for i, val in enumerate(vals):
+            for si, sp in enumerate(species):
+                block[i, si] = (
+                    np.asarray(val[sp], dtype=field.field_type) if sp in val else empty
+                )
+        return block
+
+    block = np.full(shape, fill, dtype=field.field_type)
+    match (has_sp, has_tm):
+        case (False, True):
+            # ThrustModeValues
+            for i, val in enumerate(vals):
+                block[i] = [val[tm] for tm in ThrustMode]
+        case (True, False):
+            # SpeciesValues[float]
+            for i, val in enumerate(vals):
+                for si, sp in enumerate(species):
+                    if sp in val:
+                        block[i, si] = val[sp]
+        case (True, True):
+            # SpeciesValues[ThrustModeValues]
+            for i, val in enumerate(vals):
+                for si, sp in enumerate(species):
+                    if sp in val:
+                        tm_val = val[sp]
+                        for ti, tm in enumerate(ThrustMode):
+                            if tm in tm_val:
+                                block[i, si, ti] = tm_val[tm]
+    return block
+
+
+def _normalize_indices(
+    indices: Sequence[int] | np.ndarray | slice | None, length: int
+) -> np.ndarray:
+    """Convert the different ways of specifying a set of trajectory indexes
+    to an array of non-negative integer indexes."""
+    if indices is None:
+        return np.arange(length, dtype=np.int64)
+    if isinstance(indices, slice):
+        return np.arange(*indices.indices(length), dtype=np.int64)
+    arr = np.asarray(indices)
+    if arr.dtype == np.bool_:
+        if arr.shape != (length,):
+            raise IndexError('Boolean index must have the same length as the store')
+        return np.nonzero(arr)[0].astype(np.int64)
+    if arr.size == 0:
+        return np.empty(0, dtype=np.int64)
+    if not np.issubdtype(arr.dtype, np.integer) or arr.ndim != 1:
+        raise IndexError('Trajectory indexes must be a 1-D sequence of integers')
+    arr = np.where(arr < 0, arr + length, arr).astype(np.int64)
+    if np.any(arr < 0) or np.any(arr >= length):
+        raise IndexError('Trajectory index out of range')
+    return arr
+
+
+def _merge_index_entries(
+    old_ids: np.ndarray,
+    old_idxs: np.ndarray,
+    new_ids: np.ndarray,
+    new_idxs: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray, int]:
+    """Merge new entries into a sorted flight ID index.
+
+    Returns the merged flight IDs and trajectory indexes, plus the position of
+    the first entry that differs from the old index (everything before that
+    is unchanged, so doesn't need to be written out again). The new entries
+    must all have higher trajectory indexes than the old ones.
+    """
+
+    # Sort the new entries (a stable sort keeps duplicate flight IDs in
+    # trajectory order), then insert them after any existing entries with the
+    # same flight ID, which all have lower trajectory indexes.
+    order = np.argsort(new_ids, kind='stable')
+    new_ids = new_ids[order]
+    new_idxs = new_idxs[order]
+    pos = np.searchsorted(old_ids, new_ids, side='right')
+    sorted_ids = np.insert(old_ids, pos, new_ids)
+    traj_idxs = np.insert(old_idxs, pos, new_idxs)
+    start = int(pos[0]) if len(pos) > 0 else len(old_ids)
+    return sorted_ids, traj_idxs, start
+
+
+def _dataset_group(dataset: nc4.Dataset, name: str) -> nc4.Group:
+    return dataset.groups[name]
+
+
+def _union_member(
+    path: Path,
+) -> tuple[tuple, int, tuple[np.ndarray, np.ndarray] | None]:
+    """Signature (as for `_merged_file_signature`, without the associated
+    name), trajectory count and flight ID index (if the store is indexable)
+    of a member store of a union store."""
+    if not path.exists():
+        raise ValueError(f'Member store "{path}" does not exist')
+    if path.is_dir():
+        if not path.name.endswith('.aeic-store'):
+            raise ValueError(f'Member store "{path}" is not a merged store')
+        metadata_file = path / 'metadata.json'
+        if not metadata_file.exists():
+            raise ValueError(f'Metadata file missing from merged store {path}')
+        with open(metadata_file) as f:
+            stores = json.load(f).get('stores', [])
+        if len(stores) == 0:
+            raise ValueError(f'No stores listed in metadata file {metadata_file}')
+        first = path / stores[0][0]
+        count = sum(int(s[1]) for s in stores)
+        index_file = path / '_index.nc'
+        index_path = index_file if index_file.exists() else None
+    elif path.suffix == '.nc':
+        first = path
+        count = None
+        index_path = path
+    else:
+        raise ValueError(f'Member store "{path}" is not a NetCDF file or merged store')
+
+    with _NETCDF_LOCK:
+        dataset = nc4.Dataset(first, 'r', keepweakref=True)
+        try:
+            names, hashes, id_hash, layout, _, associated_hash, species = (
+                _merged_file_signature(dataset, path)
+            )
+            if count is None:
+                count = len(dataset.dimensions['trajectory'])
+        finally:
+            dataset.close()
+
+        index = None
+        if index_path is not None:
+            dataset = nc4.Dataset(index_path, 'r', keepweakref=True)
+            try:
+                if '_index' in dataset.groups:
+                    vs = dataset.groups['_index'].variables
+                    index = (
+                        np.asarray(vs['flight_id'][:], dtype=np.int64),
+                        np.asarray(vs['trajectory_index'][:], dtype=np.int64),
+                    )
+            finally:
+                dataset.close()
+
+    return (names, hashes, id_hash, layout, associated_hash, species), count, index
+
+
+def _read_union_manifest(path: Path) -> dict[str, Any]:
+    """Read the manifest of a union store, returning the same information as
+    the metadata file of a merged store: the NetCDF files of all the members,
+    in order, with their trajectory counts, and the global attributes. The
+    members' field set hashes are also returned, as "member_hashes"."""
+    with _NETCDF_LOCK:
+        dataset = nc4.Dataset(path, 'r', keepweakref=True)
+        try:
+            attrs = {k: dataset.getncattr(k) for k in dataset.ncattrs()}
+        finally:
+            dataset.close()
+    if 'members' not in attrs:
+        raise ValueError(f'Member list missing from union store {path}')
+    members = json.loads(attrs.pop('members'))
+    if len(members) == 0:
+        raise ValueError(f'No member stores listed in union store {path}')
+
+    # Member paths are absolute, but relative paths (in manifests written by
+    # hand) are taken relative to the manifest's directory.
+    stores = []
+    for member in members:
+        p = path.parent / member['path']
+        if not p.exists():
+            raise ValueError(f'Member store "{p}" of union store {path} does not exist')
+        if p.is_dir():
+            with open(p / 'metadata.json') as f:
+                files = [(str(p / s[0]), int(s[1])) for s in json.load(f)['stores']]
+            if sum(n for _, n in files) != member['count']:
+                raise ValueError(
+                    f'Trajectory count of member store "{p}" does not match '
+                    f'union store {path}'
+                )
+            stores.extend(files)
+        else:
+            stores.append((str(p), member['count']))
+
+    attrs.update(stores=stores, member_hashes=[m['id_hash'] for m in members])
+    return attrs
+
+
+def _merged_file_signature(dataset: nc4.Dataset, path: PathType) -> tuple:
+    """Attributes of a NetCDF file that must be the same for all files in a
+    merged store: field set names and digests, storage layout, associated
+    file attributes and species dimension. (Values of all the files are
+    decoded using the species of the first file.)"""
+
+    def as_list(value: Any) -> list[str]:
+        return [value] if isinstance(value, str) else list(value)
+
+    return (
+        as_list(dataset.fieldset_names),
+        as_list(dataset.fieldset_hashes),
+        dataset.id_hash,
+        _nc_layout(dataset, path),
+        getattr(dataset, 'associated_name', None),
+        getattr(dataset, 'associated_hash', None),
+        _species_names(TrajectoryStore._retrieve_nc_species_values(dataset)),
+    )
+
+
+def _group_stats(
+    values: np.ndarray,
+    fill: Any,
+    codes: np.ndarray,
+    ngroups: int,
+    stats: Sequence[str],
+    quantiles: Sequence[float],
+) -> dict[str, np.ndarray]:
+    """Statistics of a column of values by group for `aggregate`.
+
+    `codes` gives the group index of each value. Values equal to the fill
+    value, and NaNs, are left out. Returns an array of values by group for
+    each statistic.
+    """
+    v = values.astype(np.float64)
+    valid = (values != fill) & ~np.isnan(v)
+    v = v[valid]
+    c = codes[valid]
+
+    # Counts, sums and moments don't need the values to be sorted.
+    count = np.bincount(c, minlength=ngroups)
+    total = np.bincount(c, weights=v, minlength=ngroups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = total / count
+    result: dict[str, np.ndarray] = {}
+    for stat in stats:
+        match stat:
+            case 'count':
+                result[stat] = count
+            case 'sum':
+                result[stat] = total
+            case 'mean':
+                result[stat] = mean
+            case 'std':
+                dev = np.bincount(c, weights=(v - mean[c]) ** 2, minlength=ngroups)
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    result[stat] = np.sqrt(dev / count)
+
+    # Order statistics come from the values sorted by group and then value:
+    # each group's values are then a contiguous sorted segment.
+    if 'min' in stats or 'max' in stats or len(quantiles) > 0:
+        order = np.lexsort((v, c))
+        sv = v[order]
+        starts = np.concatenate([[0], np.cumsum(count)[:-1]])
+        some = count > 0
+        last = np.maximum(count - 1, 0)
+
+        def at(pos: np.ndarray) -> np.ndarray:
+            out = np.full(ngroups, np.nan)
+            out[some] = sv[(starts + pos)[some]]
+            return out
+
+        if 'min' in stats:
+            result['min'] = at(np.zeros(ngroups, dtype=np.int64))
+        if 'max' in stats:
+            result['max'] = at(last)
+        for q in quantiles:
+            pos = q * last
+            lo = np.floor(pos).astype(np.int64)
+            hi = np.ceil(pos).astype(np.int64)
+            result[f'q{q:g}'] = at(lo) + (pos - lo) * (at(hi) - at(lo))
+    return result
+
+
+def _nc_layout(dataset: nc4.Dataset, path: PathType) -> str:
+    """Storage layout used for pointwise data in a NetCDF file. (Files
+    written before the layout attribute was introduced use variable-length
+    arrays.)"""
+    layout = getattr(dataset, 'layout', TrajectoryStore.Layout.VLEN.value)
+    if layout not in set(TrajectoryStore.Layout):
+        raise ValueError(f'Unknown storage layout "{layout}" in NetCDF file {path}')
+    return layout
+
+
+def _species_names(species: list[Species] | None) -> list[str] | None:
+    return [sp.name for sp in species] if species is not None else None
+
+
+def _write_column_block(
+    column: np.ndarray,
+    data: np.ndarray | RaggedArray | SpeciesValues,
+    species: list[Species],
+    offsets: np.ndarray | None,
+    start: int,
+    stop: int,
+    metadata: FieldMetadata,
+) -> None:
+    """Copy values for trajectories `start` to `stop` returned by `read_field`
+    into a column file being written for a column store."""
+    if isinstance(data, SpeciesValues):
+        parts = [(si, data[sp]) for si, sp in enumerate(species)]
+    else:
+        parts = [(None, data)]
+    for si, part in parts:
+        if not isinstance(part, RaggedArray):
+            if si is None:
+                column[start:stop] = part
+            else:
+                column[start:stop, si] = part
+            continue
+
+        assert offsets is not None
+        lo, hi = int(offsets[start]), int(offsets[stop])
+        target = column[lo:hi] if si is None else column[lo:hi, si]
+        sizes = np.diff(offsets[start : stop + 1])
+        if np.array_equal(part.row_sizes, sizes):
+            target[...] = part.values
+            continue
+
+        # Missing optional values (which may not have the same number of
+        # points as the trajectory) are stored as fill values.
+        target[...] = column_fill_value(metadata.field_type)
+        for k in range(len(part)):
+            if len(part[k]) == sizes[k]:
+                pos = int(offsets[start + k]) - lo
+                target[pos : pos + sizes[k]] = part[k]
+
+
+def _column_view(
+    dataset: ColumnDataset,
+    fs_name: str,
+    name: str,
+    field: FieldMetadata,
+    indices: Sequence[int] | np.ndarray | slice | None,
+    length: int,
+    species: list[Species] | None,
+) -> np.ndarray | RaggedArray | SpeciesValues | None:
+    """Read a field for a contiguous range of trajectories from a column
+    store as views of the memory-mapped column files, without copying.
+    Returns None if the indexes are not a contiguous range."""
+    if indices is None:
+        start, stop = 0, length
+    elif isinstance(indices, slice):
+        start, stop, step = indices.indices(length)
+        if step != 1:
+            return None
+        stop = max(start, stop)
+    else:
+        return None
+    if field.field_type is str:
+        return None
+
+    data = dataset.groups[fs_name].variables[name].data
+    if Dimension.POINT in field.dimensions:
+        assert dataset.offsets is not None
+        offsets = np.asarray(dataset.offsets[start : stop + 1])
+        values = data[offsets[0] : offsets[-1]]
+        offsets = offsets - offsets[0]
+
+        def select(v: np.ndarray) -> np.ndarray | RaggedArray:
+            return RaggedArray(values=v, offsets=offsets)
+    else:
+        values = data[start:stop]
+
+        def select(v: np.ndarray) -> np.ndarray | RaggedArray:
+            return v
+
+    if Dimension.SPECIES in field.dimensions:
+        return SpeciesValues(
+            {sp: select(values[:, si]) for si, sp in enumerate(species or [])}
+        )
+    return select(values)
+
+
+def _nc_storage_policy(dataset: nc4.Dataset) -> StoragePolicy | None:
+    """Storage policy recorded in a NetCDF file, if any."""
+    s = getattr(dataset, 'storage_policy', None)
+    return StoragePolicy.from_json(s) if s is not None else None
+
+
 def _create_dimensions(
     dataset: nc4.Dataset, fieldsets: set[str], species: list[Species]
 ) -> tuple[nc4.Dimension, nc4.Variable]:
@@ -2,7 +2,7 @@
 from __future__ import annotations
 
 from copy import deepcopy
-from typing import Any
+from typing import Any, Protocol
 
 import numpy as np
 
@@ -70,6 +70,19 @@ BASE_FIELDS = FieldSet(
 """Base field set included in every trajectory."""
 
 
+def _value_nbytes(v: Any) -> int:
+    """Size in bytes of a data field value."""
+    if isinstance(v, np.ndarray | np.generic):
+        return v.nbytes
+    if isinstance(v, SpeciesValues | ThrustModeValues):
+        return sum(_value_nbytes(x) for x in v.values())
+    if isinstance(v, str):
+        return len(v)
+    if v is None:
+        return 0
+    return 8
+
+
 class Trajectory:
     """Class representing a 1-D trajectory with various data fields and
     metadata.
@@ -199,14 +212,14 @@ class Trajectory:
 
     @property
     def nbytes(self) -> int:
-        """Calculate approximate memory size of the trajectory in bytes.
+        """Calculate the memory size of the trajectory's data in bytes.
 
-        (This only needs to be approximate because it's just used for sizing
-        the `TrajectoryStore` LRU cache.)"""
-        size = 0
-        for f in self.X_data_dictionary.values():
-            size += f.nbytes(self.X_npoints)
-        return size
+        This is the total size of the data values actually held by the
+        trajectory (so, for example, only species that are present count for
+        species-indexed fields). It is used for sizing the `TrajectoryStore`
+        trajectory cache and write buffer. Python object overheads are not
+        included."""
+        return sum(_value_nbytes(v) for v in self.X_data.values())
 
     def __hash__(self):
         """The hash of a trajectory is based on its data dictionary."""
@@ -318,7 +331,7 @@ class Trajectory:
         trajectory."""
         species = set()
         for name, field in self.X_data_dictionary.items():
-            if Dimension.SPECIES in field.dimensions:
+            if Dimension.SPECIES in field.dimensions and name in self.X_data:
                 assert isinstance(self.X_data[name], SpeciesValues)
                 species.update(self.X_data[name].keys())
         return sorted(species)
@@ -342,3 +355,157 @@ class Trajectory:
             if name in self.X_data:
                 new_traj.X_data[name] = deepcopy(self.X_data[name])
         return new_traj
+
+
+class FieldLoader(Protocol):
+    """Source of field values for a `LazyTrajectory`."""
+
+    fields: set[str] | None
+    """Names of the fields the loader can supply, or None for all the fields
+    of the trajectory's field sets."""
+
+    def load_field(self, name: str) -> Any:
+        """Read the value of a field. (Raises `AttributeError` if the field
+        is not available.)"""
+        ...
+
+    def load_npoints(self) -> int:
+        """Find the number of points in the trajectory."""
+        ...
+
+    def resized(self, trajectory: LazyTrajectory) -> None:
+        """Called after a field value is loaded into the trajectory, whose
+        size has therefore changed."""
+        ...
+
+
+def _value_npoints(v: Any) -> int | None:
+    """Number of points in a pointwise field value, if it can be told from
+    the value itself."""
+    if isinstance(v, np.ndarray):
+        return len(v)
+    if isinstance(v, SpeciesValues) and len(v) > 0:
+        return _value_npoints(next(iter(v.values())))
+    return None
+
+
+class LazyTrajectory(Trajectory):
+    """A trajectory whose field values are loaded on first access.
+
+    A lazy trajectory starts out with the data dictionary of its field sets,
+    but no field values. The first time a field is accessed, its value is
+    read using the trajectory's `FieldLoader` and kept, so each field is read
+    at most once, and fields that are never accessed are never read. (The
+    number of points in the trajectory is loaded in the same way when it's
+    first needed, unless it can be told from a pointwise field value that's
+    already been loaded.) Operations that need all the field values, like
+    comparison and copying, load everything first; `copy` returns an
+    ordinary `Trajectory`.
+    """
+
+    FIXED_FIELDS = Trajectory.FIXED_FIELDS | {
+        'X_loader',  # Source of field values.
+        'X_lazy_npoints',  # Number of points, if known yet.
+    }
+
+    def __init__(
+        self,
+        loader: FieldLoader,
+        fieldsets: list[str] | None = None,
+        npoints: int | None = None,
+    ):
+        # (The base class constructor fills in empty values for every field,
+        # which is just what we don't want here.)
+        self.X_loader = loader
+        self.X_lazy_npoints = npoints
+        self.X_data_dictionary = BASE_FIELDS
+        self.X_fieldsets = {BASE_FIELDS.fieldset_name}
+        self.X_data = {}
+        for fs_name in sorted(set(fieldsets or []) - {BASE_FIELDSET_NAME}):
+            fs = FieldSet.from_registry(fs_name)
+            self._check_fieldset(fs)
+            self.X_fieldsets.add(fs_name)
+            self.X_data_dictionary = self.X_data_dictionary.merge(fs)
+
+    @property
+    def X_npoints(self) -> int:
+        if self.X_lazy_npoints is None:
+            self.X_lazy_npoints = self.X_loader.load_npoints()
+        return self.X_lazy_npoints
+
+    @X_npoints.setter
+    def X_npoints(self, npoints: int):
+        self.X_lazy_npoints = npoints
+
+    __hash__ = Trajectory.__hash__
+
+    def __getattr__(self, name: str) -> Any:
+        if name not in self.FIXED_FIELDS and name in self.X_data_dictionary:
+            if name not in self.X_data:
+                self._load(name)
+        return super().__getattr__(name)
+
+    def __setattr__(self, name: str, value: Any):
+        # Assigning a field that hasn't been loaded yet just sets it.
+        if (
+            name not in self.FIXED_FIELDS
+            and name in self.X_data_dictionary
+            and name not in self.X_data
+        ):
+            self.X_data[name] = self.X_data_dictionary[name].convert_in(
+                value, name, self.X_npoints
+            )
+            return
+        super().__setattr__(name, value)
+
+    def __eq__(self, other: object) -> bool:
+        self.load_all()
+        if isinstance(other, LazyTrajectory):
+            other.load_all()
+        return super().__eq__(other)
+
+    def approx_eq(self, other: object) -> bool:
+        self.load_all()
+        if isinstance(other, LazyTrajectory):
+            other.load_all()
+        return super().approx_eq(other)
+
+    @property
+    def loaded_fields(self) -> set[str]:
+        """Names of fields whose values have been loaded."""
+        return set(self.X_data)
+
+    def load_all(self) -> None:
+        """Load the values of all fields that haven't been loaded yet (of
+        those the loader can supply)."""
+        fields = self.X_loader.fields
+        for name in self.X_data_dictionary:
+            if name not in self.X_data and (fields is None or name in fields):
+                self._load(name)
+
+    @property
+    def species(self) -> list[Species]:
+        self.load_all()
+        return super().species
+
+    def copy_point(self, from_idx: int, to_idx: int):
+        self.load_all()
+        super().copy_point(from_idx, to_idx)
+
+    def copy(self) -> Trajectory:
+        self.load_all()
+        return super().copy()
+
+    def _load(self, name: str) -> None:
+        field = self.X_data_dictionary[name]
+        value = self.X_loader.load_field(name)
+
+        # Per-trajectory values don't depend on the number of points, so
+        # there's no need to find it just to convert them.
+        npoints = 0
+        if Dimension.POINT in field.dimensions:
+            if self.X_lazy_npoints is None:
+                self.X_lazy_npoints = _value_npoints(value)
+            npoints = self.X_npoints
+        self.X_data[name] = field.convert_in(value, name, npoints)
+        self.X_loader.resized(self)
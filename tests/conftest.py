@@ -16,6 +16,16 @@ TEST_DATA_DIR = (Path(__file__).parent / 'data').resolve()
 os.environ['AEIC_PATH'] = str(TEST_DATA_DIR)
 
 
+def pytest_addoption(parser):
+    """Add command line options."""
+    parser.addoption(
+        '--benchmarks',
+        action='store_true',
+        default=False,
+        help='Run long-running benchmark tests.',
+    )
+
+
 def pytest_configure(config):
     """Register custom markers."""
     config.addinivalue_line(
@@ -23,6 +33,20 @@ def pytest_configure(config):
         'config_updates(**kwargs): '
         'Mark test to update default config with given key-value pairs.',
     )
+    config.addinivalue_line(
+        'markers',
+        'benchmark: Mark test as a benchmark, only run with --benchmarks.',
+    )
+
+
+def pytest_collection_modifyitems(config, items):
+    """Skip benchmark tests unless they were asked for."""
+    if config.getoption('--benchmarks'):
+        return
+    skip = pytest.mark.skip(reason='benchmark: run with --benchmarks')
+    for item in items:
+        if item.get_closest_marker('benchmark') is not None:
+            item.add_marker(skip)
 
 
 @pytest.fixture
@@ -1,25 +1,33 @@
 # TODO: Remove this when we move to Python 3.14+.
 from __future__ import annotations
 
+import json
+import multiprocessing as mp
+import operator
+import os
 import random
 import threading
+import warnings
 from dataclasses import dataclass
 from datetime import datetime
 from pathlib import Path
 from typing import ClassVar
 
+import netCDF4 as nc4
 import numpy as np
 import pytest
 
-from AEIC.performance.types import ThrustModeValues
+from AEIC.performance.types import ThrustMode, ThrustModeValues
 from AEIC.trajectories import (
     Dimension,
     Dimensions,
     FieldMetadata,
     FieldSet,
+    FieldStorage,
+    StoragePolicy,
     TrajectoryStore,
 )
-from AEIC.trajectories.trajectory import Trajectory
+from AEIC.trajectories.trajectory import LazyTrajectory, Trajectory
 from AEIC.types import Species, SpeciesValues
 
 
@@ -191,6 +199,22 @@ def make_test_trajectory(
     return t
 
 
+def make_species_test_trajectory(
+    npoints: int, seed: int, species: list[Species]
+) -> Trajectory:
+    # Test trajectory with complex extra fields for the given species, with
+    # values that identify the species (by its position in `species`).
+    t = make_test_trajectory(npoints, seed, complex_extras=True)
+    t.tot = SpeciesValues({sp: float(i + 1) for i, sp in enumerate(species)})
+    t.seg = SpeciesValues(
+        {sp: np.full(npoints, i + 1.0) for i, sp in enumerate(species)}
+    )
+    t.tm2 = SpeciesValues(
+        {sp: ThrustModeValues(*([i + 1.0] * 4)) for i, sp in enumerate(species)}
+    )
+    return t
+
+
 def test_init_checking():
     # Missing NetCDF file name when creating or appending.
     with pytest.raises(ValueError):
@@ -509,6 +533,100 @@ def test_create_associated(tmp_path: Path):
         assert ts_read[1].mf is not None
 
 
+def complex_extras_for(traj: Trajectory, scale: float) -> ComplexExtras:
+    # Deterministic mapping function for create_associated tests. (Must be a
+    # module-level function so that it can be used from worker processes.)
+    v = float(traj.flight_id) * scale
+    return ComplexExtras(
+        tot=SpeciesValues({Species.CO2: v, Species.H2O: 2 * v}),
+        seg=SpeciesValues(
+            {Species.CO2: traj.fuel_flow * scale, Species.H2O: traj.altitude}
+        ),
+        tm=ThrustModeValues(v, v + 1, v + 2, v + 3),
+        tm2=SpeciesValues(
+            {
+                Species.CO2: ThrustModeValues(v, 0.0, 0.0, v),
+                Species.H2O: ThrustModeValues(0.0, v, v, 0.0),
+            }
+        ),
+    )
+
+
+def _check_associated_values(ts: TrajectoryStore, scale: float):
+    for traj in ts:
+        v = float(traj.flight_id) * scale
+        assert traj.tot[Species.H2O] == 2 * v
+        assert np.allclose(traj.seg[Species.CO2], traj.fuel_flow * scale)
+        assert traj.tm[ThrustMode.CLIMB] == v + 2
+        assert traj.tm2[Species.H2O][ThrustMode.APPROACH] == v
+
+
+def test_create_associated_parallel(tmp_path: Path):
+    # Single file base store: partitioned into one part per worker.
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(5 + i % 7, 100 + i) for i in range(40))
+
+    serial_path = tmp_path / 'serial.nc'
+    parallel_path = tmp_path / 'parallel.aeic-store'
+    with TrajectoryStore.open(base_file=path) as ts:
+        ts.create_associated(serial_path, ['complex_extras'], complex_extras_for, 2.0)
+        ts.create_associated(
+            parallel_path, ['complex_extras'], complex_extras_for, 2.0, n_workers=2
+        )
+        with pytest.raises(ValueError):
+            ts.create_associated(
+                tmp_path / 'bad.nc',
+                ['complex_extras'],
+                complex_extras_for,
+                2.0,
+                n_workers=2,
+            )
+
+    with open(parallel_path / 'metadata.json') as f:
+        metadata = json.load(f)
+    assert [n for _, n in metadata['stores']] == [20, 20]
+
+    with (
+        TrajectoryStore.open(base_file=path, associated_files=[serial_path]) as ts1,
+        TrajectoryStore.open(base_file=path, associated_files=[parallel_path]) as ts2,
+    ):
+        assert len(ts2) == 40
+        assert ts2.files[1].fieldsets == {'complex_extras'}
+        _check_associated_values(ts2, 2.0)
+        for t1, t2 in zip(ts1, ts2):
+            assert t1.approx_eq(t2)
+
+    # Appending to a base store with a merged associated store isn't possible.
+    with pytest.raises(ValueError):
+        TrajectoryStore.append(base_file=path, associated_files=[parallel_path])
+
+    # Merged base store: one part per base NetCDF file.
+    paths = []
+    for i in range(3):
+        paths.append(tmp_path / f'base{i}.nc')
+        with TrajectoryStore.create(base_file=paths[-1]) as ts:
+            ts.add_many(make_test_trajectory(10, i * 10 + j) for j in range(i + 2))
+    merged_base = tmp_path / 'merged_base.aeic-store'
+    TrajectoryStore.merge(input_stores=paths, output_store=merged_base)
+    merged_assoc = tmp_path / 'merged_assoc.aeic-store'
+    with TrajectoryStore.open(base_file=merged_base) as ts:
+        ts.create_associated(
+            merged_assoc,
+            ['complex_extras'],
+            complex_extras_for,
+            0.5,
+            n_workers=2,
+            species=[Species.H2O, Species.CO2],
+        )
+    with TrajectoryStore.open(
+        base_file=merged_base, associated_files=[merged_assoc]
+    ) as ts:
+        assert len(ts) == 9
+        assert [p.name for p in ts.files[1].path] == [p.name for p in paths]
+        _check_associated_values(ts, 0.5)
+
+
 def test_fieldset_override(tmp_path: Path):
     # For this test, we need to create a base file with some extra fields, then
     # we need to create an associated file with the same extra fields but
@@ -711,6 +829,24 @@ def test_indexing(tmp_path: Path):
             assert traj is not None
             assert traj.flight_id == s
 
+        # 5. Bulk lookups, including missing flight IDs.
+        query = np.array(seeds[::-3] + [1, 20000])
+        idxs = ts_read.flight_indices(query)
+        assert idxs[-2] == -1 and idxs[-1] == -1
+        for s, i in zip(seeds[::-3], idxs[:-2]):
+            assert seeds[i] == s
+        trajs = ts_read.get_flights(query)
+        assert trajs[-2] is None and trajs[-1] is None
+        assert [t.flight_id for t in trajs[:-2]] == seeds[::-3]
+        assert ts_read.get_flight(1) is None
+
+    # 6. Lookups see trajectories appended since the index was loaded.
+    with TrajectoryStore.append(base_file=path) as ts_append:
+        assert ts_append.flight_indices([seeds[0]])[0] == 0
+        ts_append.add(make_test_trajectory(10, 1))
+        assert ts_append.flight_indices([1])[0] == ntrajs
+        assert ts_append.get_flights([1])[0].name == 'traj_1'
+
 
 def test_merged_store_indexing(tmp_path: Path):
     # 1. Create a unique set of flight IDs.
@@ -738,6 +874,248 @@ def test_merged_store_indexing(tmp_path: Path):
             assert traj is not None
             assert traj.flight_id == s
 
+        # 6. Bulk lookup across shards.
+        trajs = ts_read.get_flights(np.array(seeds[::7]))
+        assert [t.flight_id for t in trajs] == seeds[::7]
+        idxs = ts_read.flight_indices(seeds)
+        assert np.array_equal(idxs, np.arange(ntrajs))
+
+
+def test_extend_merged(tmp_path: Path):
+    # 1. Create individual trajectory stores with unique flight IDs.
+    ntrajs = 500
+    seeds = random.sample(range(10000, 100000), ntrajs)
+    paths = []
+    for i in range(5):
+        path = tmp_path / f'test{i}.nc'
+        paths.append(path)
+        with TrajectoryStore.create(base_file=path) as ts:
+            for s in seeds[i * 100 : (i + 1) * 100]:
+                ts.add(make_test_trajectory(10, s))
+
+    # 2. Merge some of the stores, then add the others in two steps.
+    merged_path = tmp_path / 'merged.aeic-store'
+    TrajectoryStore.merge(
+        input_stores=paths[:2], output_store=merged_path, title='Extended'
+    )
+    TrajectoryStore.extend_merged(merged_path, paths[2:3])
+    TrajectoryStore.extend_merged(merged_path, paths[3:])
+    assert not any(p.exists() for p in paths)
+
+    # 3. The extended store looks just like a store made by one merge.
+    with TrajectoryStore.open(base_file=merged_path) as ts_read:
+        assert len(ts_read) == ntrajs
+        assert ts_read.global_attributes['title'] == 'Extended'
+        assert ts_read[250].flight_id == seeds[250]
+        assert ts_read[499].name == f'traj_{seeds[499]}'
+        idxs = ts_read.flight_indices(seeds)
+        assert np.array_equal(idxs, np.arange(ntrajs))
+        sorted_ids, _ = ts_read._load_index()
+        assert np.array_equal(sorted_ids, np.sort(seeds))
+
+    # 4. Files with different field sets or names already in the store are
+    # rejected, and left where they are.
+    bad_path = tmp_path / 'bad.nc'
+    with TrajectoryStore.create(base_file=bad_path) as ts:
+        ts.add(make_test_trajectory(10, 1, simple_extras=True))
+    with pytest.raises(ValueError, match='do not match'):
+        TrajectoryStore.extend_merged(merged_path, [bad_path])
+    assert bad_path.exists()
+    dup_path = tmp_path / 'test0.nc'
+    with TrajectoryStore.create(base_file=dup_path) as ts:
+        ts.add(make_test_trajectory(10, 2))
+    with pytest.raises(ValueError, match='already in merged store'):
+        TrajectoryStore.extend_merged(merged_path, [dup_path])
+    with TrajectoryStore.open(base_file=merged_path) as ts_read:
+        assert len(ts_read) == ntrajs
+
+
+def test_extend_merged_species(tmp_path: Path):
+    # Files whose species dimension differs from the merged store's are
+    # rejected, since their values would be read under the wrong species.
+    paths = []
+    for i, species in enumerate(
+        ([Species.CO2, Species.H2O], [Species.CO2, Species.H2O], [Species.NOx])
+    ):
+        path = tmp_path / f'test{i}.nc'
+        paths.append(path)
+        with TrajectoryStore.create(base_file=path) as ts:
+            ts.add(make_species_test_trajectory(10, i, species))
+    merged_path = tmp_path / 'merged.aeic-store'
+    TrajectoryStore.merge(input_stores=paths[:1], output_store=merged_path)
+    with pytest.raises(ValueError, match=r'Species dimension of ".*test2\.nc"'):
+        TrajectoryStore.extend_merged(merged_path, [paths[2]])
+    assert paths[2].exists()
+    TrajectoryStore.extend_merged(merged_path, [paths[1]])
+    with TrajectoryStore.open(base_file=merged_path) as ts_read:
+        assert len(ts_read) == 2
+        assert ts_read[1].tot[Species.H2O] == 2.0
+
+
+def test_union_store(tmp_path: Path):
+    # 1. Create two single file stores and a merged store.
+    seeds = random.sample(range(10000, 100000), 300)
+    paths = []
+    for i in range(4):
+        path = tmp_path / f'test{i}.nc'
+        paths.append(path)
+        with TrajectoryStore.create(base_file=path) as ts:
+            for s in seeds[i * 75 : (i + 1) * 75]:
+                ts.add(make_test_trajectory(10, s))
+    merged_path = tmp_path / 'merged.aeic-store'
+    TrajectoryStore.merge(input_stores=paths[2:], output_store=merged_path)
+
+    # 2. Combine them in a union store: nothing is moved.
+    union_path = tmp_path / 'runs.aeic-union'
+    TrajectoryStore.union(union_path, [paths[0], merged_path, paths[1]], title='Runs')
+    assert paths[0].exists() and paths[1].exists()
+    expected = seeds[:75] + seeds[150:] + seeds[75:150]
+
+    # 3. The union store reads like a merged store, and the members can still
+    # be used on their own.
+    with TrajectoryStore.open(base_file=union_path, max_open_files=2) as ts_read:
+        assert len(ts_read) == 300
+        assert ts_read.global_attributes['title'] == 'Runs'
+        assert ts_read[80].flight_id == expected[80]
+        assert [t.name for t in ts_read[::50]] == [f'traj_{s}' for s in expected[::50]]
+        idxs = ts_read.flight_indices(seeds)
+        assert np.array_equal(idxs, [expected.index(s) for s in seeds])
+        assert ts_read.get_flight(seeds[100]).flight_id == seeds[100]
+    with TrajectoryStore.open(base_file=paths[1]) as ts_read:
+        assert len(ts_read) == 75
+
+    # 4. Members that have changed since the union was created are rejected.
+    with TrajectoryStore.append(base_file=paths[1]) as ts:
+        ts.add(make_test_trajectory(10, 5))
+    with TrajectoryStore.open(base_file=union_path) as ts_read:
+        assert ts_read[0].flight_id == expected[0]
+        with pytest.raises(ValueError, match='does not match metadata'):
+            ts_read[299]
+    TrajectoryStore.extend_merged(merged_path, [paths[1]])
+    with pytest.raises(ValueError, match='does not match union store'):
+        TrajectoryStore.open(base_file=union_path)
+
+    # 5. Members must match each other, and union stores are only made by
+    # `union` and only opened for reading.
+    bad_path = tmp_path / 'bad.nc'
+    with TrajectoryStore.create(base_file=bad_path) as ts:
+        ts.add(make_test_trajectory(10, 1, simple_extras=True))
+    with pytest.raises(ValueError, match='do not match'):
+        TrajectoryStore.union(tmp_path / 'bad.aeic-union', [paths[0], bad_path])
+    assert not (tmp_path / 'bad.aeic-union').exists()
+    with pytest.raises(ValueError, match='extension'):
+        TrajectoryStore.union(tmp_path / 'bad.nc4', [paths[0]])
+    with pytest.raises(ValueError, match='already exists'):
+        TrajectoryStore.union(union_path, [paths[0]])
+    with pytest.raises(ValueError, match='cannot be created directly'):
+        TrajectoryStore.create(base_file=tmp_path / 'new.aeic-union')
+    with pytest.raises(ValueError, match='READ mode'):
+        TrajectoryStore.append(base_file=union_path)
+
+
+def test_union_store_associated(tmp_path: Path):
+    # Unions of base files and of their associated files open together.
+    bases = []
+    extras = []
+    full = []
+    for i in range(2):
+        bases.append(tmp_path / f'test{i}.nc')
+        extras.append(tmp_path / f'extra{i}.nc')
+        with TrajectoryStore.create(
+            base_file=bases[-1], associated_files=[(extras[-1], ['complex_extras'])]
+        ) as ts:
+            for j in range(10):
+                t = make_test_trajectory(j + 5, i * 10 + j)
+                t.add_fields(ComplexExtras.random(j + 5))
+                ts.add(t)
+                full.append(t)
+    union_path = tmp_path / 'base.aeic-union'
+    extra_union_path = tmp_path / 'extra.aeic-union'
+    TrajectoryStore.union(union_path, bases)
+    TrajectoryStore.union(extra_union_path, extras)
+    with TrajectoryStore.open(
+        base_file=union_path, associated_files=[extra_union_path]
+    ) as ts:
+        assert len(ts) == 20
+        assert ts[:] == full
+        assert ts.get_flight(15) == full[15]
+
+    # Associated unions need a union base store.
+    with pytest.raises(ValueError, match='union'):
+        TrajectoryStore.open(base_file=bases[0], associated_files=[extra_union_path])
+
+
+def test_union_store_species(tmp_path: Path):
+    # Members are decoded with the species of the first member, so members
+    # with a different species dimension are rejected.
+    paths = []
+    for i, species in enumerate(
+        ([Species.CO2, Species.H2O], [Species.CO2, Species.H2O], [Species.NOx])
+    ):
+        path = tmp_path / f'test{i}.nc'
+        paths.append(path)
+        with TrajectoryStore.create(base_file=path) as ts:
+            ts.add(make_species_test_trajectory(10, i, species))
+    with pytest.raises(ValueError, match=r'Species dimension of member store'):
+        TrajectoryStore.union(tmp_path / 'bad.aeic-union', paths)
+    assert not (tmp_path / 'bad.aeic-union').exists()
+
+    union_path = tmp_path / 'good.aeic-union'
+    TrajectoryStore.union(union_path, paths[:2])
+    with TrajectoryStore.open(base_file=union_path) as ts:
+        assert len(ts) == 2
+        assert ts[1].tot[Species.H2O] == 2.0
+
+
+def test_incremental_indexing(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Count full rebuilds of the index.
+    rebuilds = []
+    rebuild = TrajectoryStore._rebuild_index
+
+    def counting_rebuild(self):
+        rebuilds.append(1)
+        rebuild(self)
+
+    monkeypatch.setattr(TrajectoryStore, '_rebuild_index', counting_rebuild)
+
+    # 1. Create a store: the first index is always built from scratch.
+    path = tmp_path / 'test.nc'
+    flight_ids = random.sample(range(1000, 10000), 100)
+    with TrajectoryStore.create(base_file=path) as ts:
+        for fid in flight_ids:
+            ts.add(make_test_trajectory(10, fid))
+    assert len(rebuilds) == 1
+
+    # 2. Append small batches of flight IDs, including duplicates and IDs
+    # below and above the existing ones, syncing after each batch. These are
+    # merged into the existing index.
+    batches = [[20000, 20001, 20002], [500, 5000, 20000], flight_ids[:5]]
+    with TrajectoryStore.append(base_file=path) as ts:
+        for batch in batches:
+            for fid in batch:
+                ts.add(make_test_trajectory(10, fid))
+                flight_ids.append(fid)
+            ts.sync()
+    assert len(rebuilds) == 1
+
+    # 3. The index on disk is the same as a full rebuild would give.
+    with TrajectoryStore.open(base_file=path) as ts:
+        sorted_ids, traj_idxs = ts._load_index()
+        order = np.argsort(flight_ids, kind='stable')
+        assert np.array_equal(sorted_ids, np.array(flight_ids)[order])
+        assert np.array_equal(traj_idxs, order)
+        assert ts.flight_indices([20000])[0] == 100
+        assert ts.flight_indices([500])[0] == 103
+
+    # 4. A large batch of new flight IDs passes the compaction threshold and
+    # triggers a full rebuild.
+    with TrajectoryStore.append(base_file=path) as ts:
+        for fid in range(30000, 30100):
+            ts.add(make_test_trajectory(10, fid))
+    assert len(rebuilds) == 2
+    with TrajectoryStore.open(base_file=path) as ts:
+        assert ts.flight_indices([30050])[0] == 161
+
 
 def _check_complex(ts_read: TrajectoryStore, repeats: int = 1):
     assert len(ts_read) == 5 * repeats
@@ -841,3 +1219,1384 @@ def test_create_associated_complex(tmp_path: Path):
             assert isinstance(ts_read[i].tm2, SpeciesValues)
             for sp in ts_read[i].tm2:
                 assert isinstance(ts_read[i].tm2[sp], ThrustModeValues)
+
+
+def test_add_many(tmp_path: Path):
+    # Adding trajectories in bulk should give the same result as adding them
+    # one at a time.
+
+    path = tmp_path / 'test.nc'
+    trajs = [
+        make_test_trajectory(i + 5, i, simple_extras=True, complex_extras=True)
+        for i in range(300)
+    ]
+    with TrajectoryStore.create(base_file=path) as ts:
+        indexes = ts.add_many(trajs)
+        assert indexes == list(range(300))
+        assert len(ts) == 300
+
+    with TrajectoryStore.open(base_file=path) as ts_read:
+        assert len(ts_read) == 300
+        for i in (0, 1, 255, 256, 299):
+            assert ts_read[i].approx_eq(trajs[i])
+        assert ts_read.get_flight(123).name == 'traj_123'
+
+
+@pytest.mark.parametrize(
+    'buffer_args', [dict(write_buffer_size=7), dict(write_buffer_mb=0.015)]
+)
+def test_write_buffer(tmp_path: Path, buffer_args):
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path, **buffer_args) as ts:
+        for i in range(10):
+            ts.add(make_test_trajectory(20, i))
+
+        # Buffered trajectories count towards the store length and can be
+        # read back before they're written.
+        assert len(ts) == 10
+        assert len(ts._write_buffer) > 0
+        assert ts[9].name == 'traj_9'
+
+        ts.add_many(make_test_trajectory(20, i) for i in range(10, 20))
+        ts.sync()
+        assert len(ts._write_buffer) == 0
+
+        ts.add(make_test_trajectory(20, 20))
+
+    with TrajectoryStore.open(base_file=path) as ts_read:
+        assert len(ts_read) == 21
+        for i in range(21):
+            assert ts_read[i].name == f'traj_{i}'
+
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=path, write_buffer_size=10)
+
+
+def test_read_field(tmp_path: Path):
+    # Create a merged store with extra fields in the shards.
+    paths = []
+    trajs = []
+    for i in range(3):
+        path = tmp_path / f'test_{i}.nc'
+        paths.append(path)
+        with TrajectoryStore.create(base_file=path) as ts:
+            for j in range(10):
+                t = make_test_trajectory(5 + j, i * 10 + j, complex_extras=True)
+                trajs.append(t)
+                ts.add(t)
+    merged_path = tmp_path / 'merged.aeic-store'
+    TrajectoryStore.merge(input_stores=paths, output_store=merged_path)
+
+    with TrajectoryStore.open(base_file=merged_path) as ts:
+        # Per-trajectory field for the whole store.
+        total_fuel = ts.read_field('total_fuel_mass')
+        assert isinstance(total_fuel, np.ndarray)
+        assert np.allclose(total_fuel, [t.total_fuel_mass for t in trajs])
+
+        # Pointwise field for selected trajectories, in the requested order.
+        idxs = [25, 3, 11, 3]
+        fuel_flow = ts.read_field('fuel_flow', idxs)
+        assert len(fuel_flow) == 4
+        assert fuel_flow.offsets[-1] == len(fuel_flow.values)
+        for k, i in enumerate(idxs):
+            assert np.allclose(fuel_flow[k], trajs[i].fuel_flow)
+
+        # Boolean masks and slices.
+        mask = np.zeros(len(ts), dtype=bool)
+        mask[[1, 12, 29]] = True
+        assert list(ts.read_field('flight_id', mask)) == [1, 12, 29]
+        assert list(ts.read_field('name', slice(8, 12))) == [
+            f'traj_{i}' for i in range(8, 12)
+        ]
+
+        # Species-indexed fields.
+        tot = ts.read_field('tot')
+        assert isinstance(tot, SpeciesValues)
+        assert np.allclose(tot[Species.CO2], [t.tot[Species.CO2] for t in trajs])
+        seg = ts.read_field('seg', [17])
+        assert np.allclose(seg[Species.H2O][0], trajs[17].seg[Species.H2O])
+        tm = ts.read_field('tm', [4, 5])
+        assert tm.shape == (2, 4)
+        assert np.allclose(tm[1], list(trajs[5].tm.values()))
+
+        with pytest.raises(ValueError):
+            ts.read_field('no_such_field')
+        with pytest.raises(IndexError):
+            ts.read_field('altitude', [30])
+
+
+def test_slice_indexing(tmp_path: Path):
+    paths = []
+    for i in range(3):
+        path = tmp_path / f'test_{i}.nc'
+        paths.append(path)
+        with TrajectoryStore.create(base_file=path) as ts:
+            ts.add_many(
+                make_test_trajectory(5 + j, i * 10 + j, complex_extras=True)
+                for j in range(10)
+            )
+    merged_path = tmp_path / 'merged.aeic-store'
+    TrajectoryStore.merge(input_stores=paths, output_store=merged_path)
+
+    with TrajectoryStore.open(base_file=merged_path) as ts:
+        # Slices spanning several underlying files.
+        trajs = ts[5:25]
+        assert [t.flight_id for t in trajs] == list(range(5, 25))
+        assert [t.flight_id for t in ts[::7]] == [0, 7, 14, 21, 28]
+        assert [t.flight_id for t in ts[-2:]] == [28, 29]
+
+        # Loaded trajectories are saved in the cache.
+        assert all(i in ts._trajectories for i in range(5, 25))
+
+        # Fancy indexing, with repeats.
+        trajs = ts[[29, 0, 12, 0]]
+        assert [t.flight_id for t in trajs] == [29, 0, 12, 0]
+        assert trajs[1] is trajs[3]
+        assert len(trajs[0]) == 14
+        assert isinstance(trajs[0].tm2[Species.CO2], ThrustModeValues)
+        assert trajs[2].seg[Species.H2O].shape == (7,)
+
+        # Unsorted repeated indexes that aren't in the cache yet.
+        assert [t.flight_id for t in ts[[27, 3, 27, 2]]] == [27, 3, 27, 2]
+
+        # Boolean masks.
+        mask = np.arange(len(ts)) % 4 == 1
+        assert [t.flight_id for t in ts[mask]] == [1, 5, 9, 13, 17, 21, 25, 29]
+
+        # Negative integer indexes and out of range indexes.
+        assert ts[-1].flight_id == 29
+        with pytest.raises(IndexError):
+            ts[[1, 30]]
+        with pytest.raises(IndexError):
+            ts[mask[:-1]]
+
+        assert [t.flight_id for t in ts] == list(range(30))
+
+
+def test_prefetch_iteration(tmp_path: Path):
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(10 + i % 7, i) for i in range(100))
+
+    with TrajectoryStore.open(base_file=path) as ts:
+        # Block sizes that do and don't divide the store size.
+        for block in (10, 7, 1000):
+            ids = [t.flight_id for t in ts.iter(prefetch=3, block=block)]
+            assert ids == list(range(100))
+
+        # Store access from the consuming thread during iteration.
+        for t in ts.iter(prefetch=2, block=8):
+            assert ts[99 - t.flight_id].flight_id == 99 - t.flight_id
+
+        # Abandoning the iteration part way through stops the I/O thread.
+        nthreads = threading.active_count()
+        it = ts.iter(prefetch=2, block=5)
+        assert next(it).flight_id == 0
+        assert threading.active_count() == nthreads + 1
+        it.close()
+        assert threading.active_count() == nthreads
+
+        assert [t.flight_id for t in ts.iter(prefetch=0)] == list(range(100))
+        with pytest.raises(ValueError):
+            ts.iter(prefetch=-1)
+
+
+def test_concurrent_reads(tmp_path: Path):
+    ntrajs = 200
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(50, i) for i in range(ntrajs))
+
+    # Concurrent mode is for reading only.
+    with pytest.raises(ValueError):
+        TrajectoryStore.create(base_file=tmp_path / 'bad.nc', concurrent=True)
+    with pytest.raises(ValueError):
+        TrajectoryStore.append(base_file=path, concurrent=True)
+
+    # Many threads reading from one store, with a cache small enough that
+    # trajectories are evicted and reloaded while the threads are running.
+    errors = []
+
+    def reader(ts: TrajectoryStore, seed: int):
+        rng = np.random.default_rng(seed)
+        try:
+            for _ in range(30):
+                i = int(rng.integers(ntrajs))
+                assert ts[i].name == f'traj_{i}'
+                rows = rng.integers(ntrajs, size=10)
+                assert [t.flight_id for t in ts[rows]] == rows.tolist()
+                assert ts.get_flight(int(rows[0])).flight_id == rows[0]
+                assert np.array_equal(ts.read_field('flight_id', rows), rows)
+        except BaseException as exc:
+            errors.append(exc)
+
+    with TrajectoryStore.open(base_file=path, concurrent=True, cache_size_mb=1) as ts:
+        threads = [threading.Thread(target=reader, args=(ts, k)) for k in range(8)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+    assert errors == []
+
+    # Concurrent stores may also be opened in other threads.
+    def opener():
+        with TrajectoryStore.open(base_file=path, concurrent=True) as ts:
+            reader(ts, 100)
+
+    t = threading.Thread(target=opener)
+    t.start()
+    t.join()
+    assert errors == []
+
+
+def test_concurrent_reads_with_writer(tmp_path: Path):
+    ntrajs = 200
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(50, i) for i in range(ntrajs))
+
+    # Threads reading from a concurrent store while this thread writes
+    # another store, one trajectory at a time and in blocks.
+    errors = []
+    done = threading.Event()
+
+    def reader(ts: TrajectoryStore, seed: int):
+        rng = np.random.default_rng(seed)
+        try:
+            while not done.is_set():
+                rows = rng.integers(ntrajs, size=10)
+                assert [t.flight_id for t in ts[rows]] == rows.tolist()
+                assert np.array_equal(ts.read_field('flight_id', rows), rows)
+        except BaseException as exc:
+            errors.append(exc)
+
+    out_path = tmp_path / 'out.nc'
+    with TrajectoryStore.open(base_file=path, concurrent=True, cache_size_mb=1) as ts:
+        threads = [threading.Thread(target=reader, args=(ts, k)) for k in range(4)]
+        for t in threads:
+            t.start()
+        try:
+            with TrajectoryStore.create(base_file=out_path) as out:
+                for i in range(100):
+                    out.add(make_test_trajectory(50, i))
+                out.add_many(make_test_trajectory(50, i) for i in range(100, 300))
+                out.sync()
+                assert out.get_flight(250).flight_id == 250
+        finally:
+            done.set()
+            for t in threads:
+                t.join()
+    assert errors == []
+    with TrajectoryStore.open(base_file=out_path) as out:
+        assert np.array_equal(out.read_field('flight_id'), np.arange(300))
+
+    # Writes wait for NetCDF calls in other threads to finish.
+    from AEIC.trajectories.store import _NETCDF_LOCK
+
+    locked = threading.Event()
+
+    def holder():
+        with _NETCDF_LOCK:
+            locked.set()
+            done.wait(0.5)
+
+    done.clear()
+    with TrajectoryStore.append(base_file=out_path) as out:
+        t = threading.Thread(target=holder)
+        t.start()
+        locked.wait()
+        tstart = datetime.now()
+        out.add(make_test_trajectory(50, 300))
+        assert (datetime.now() - tstart).total_seconds() > 0.4
+        t.join()
+    with TrajectoryStore.open(base_file=out_path) as out:
+        assert len(out) == 301
+
+
+@pytest.mark.parametrize('layout', ['vlen', 'ragged'])
+def test_storage_layouts(tmp_path: Path, layout: str):
+    path = tmp_path / 'test.nc'
+    extra_path = tmp_path / 'extra.nc'
+    trajs = [
+        make_test_trajectory(5 + i % 11, i, simple_extras=True, complex_extras=True)
+        for i in range(40)
+    ]
+    with TrajectoryStore.create(
+        base_file=path,
+        associated_files=[(extra_path, ['simple_extras'])],
+        layout=layout,
+        write_buffer_size=16,
+    ) as ts:
+        for t in trajs[:5]:
+            ts.add(t)
+        ts.add_many(trajs[5:30])
+    with TrajectoryStore.append(base_file=path, associated_files=[extra_path]) as ts:
+        assert ts.layout == layout
+        ts.add_many(trajs[30:])
+
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        assert ts.files[0].layout == layout
+        assert ts.files[1].layout == layout
+        for i in (0, 4, 5, 17, 39):
+            assert ts[i].approx_eq(trajs[i])
+        assert [t.flight_id for t in ts[[33, 2, 33]]] == [33, 2, 33]
+
+        # Bulk reads.
+        alt = ts.read_field('altitude', [7, 3])
+        assert np.array_equal(alt[0], trajs[7].altitude)
+        assert np.array_equal(alt[1], trajs[3].altitude)
+        seg = ts.read_field('seg')
+        assert np.array_equal(seg[Species.H2O][21], trajs[21].seg[Species.H2O])
+        assert np.array_equal(ts.read_field('f2')[12], trajs[12].f2)
+
+        # Partial point ranges: e.g., just the cruise phase.
+        idxs = [8, 1, 30, 31]
+        n_climb = ts.read_field('n_climb', idxs)
+        n_cruise = ts.read_field('n_cruise', idxs)
+        cruise = ts.read_points('fuel_flow', idxs, n_climb, n_climb + n_cruise)
+        for k, i in enumerate(idxs):
+            t = trajs[i]
+            expected = t.fuel_flow[t.n_climb : t.n_climb + t.n_cruise]
+            assert np.array_equal(cruise[k], expected)
+        tail = ts.read_points('seg', [3, 9], start=4)
+        assert np.array_equal(tail[Species.CO2][1], trajs[9].seg[Species.CO2][4:])
+        assert len(ts.read_points('altitude', [0], 3, 100)[0]) == 2
+        with pytest.raises(ValueError):
+            ts.read_points('n_climb')
+
+        # Associated files created from the store use the same layout.
+        assoc_path = tmp_path / 'assoc.nc'
+        ts.create_associated(assoc_path, ['complex_extras'], complex_extras_for, 3.0)
+    with TrajectoryStore.open(
+        base_file=path, associated_files=[assoc_path], override=True
+    ) as ts:
+        assert ts.files[1].layout == layout
+        _check_associated_values(ts, 3.0)
+
+    # Merged stores.
+    paths = []
+    for i in range(2):
+        paths.append(tmp_path / f'part{i}.nc')
+        with TrajectoryStore.create(base_file=paths[-1], layout=layout) as ts:
+            ts.add_many(trajs[i * 20 : (i + 1) * 20])
+    merged_path = tmp_path / 'merged.aeic-store'
+    TrajectoryStore.merge(input_stores=paths, output_store=merged_path)
+    with TrajectoryStore.open(base_file=merged_path) as ts:
+        assert [t.flight_id for t in ts[15:25]] == list(range(15, 25))
+        lat = ts.read_points('latitude', [19, 20], 1, 3)
+        assert np.array_equal(lat[0], trajs[19].latitude[1:3])
+        assert np.array_equal(lat[1], trajs[20].latitude[1:3])
+
+
+def test_storage_layout_checks(tmp_path: Path):
+    with pytest.raises(ValueError):
+        TrajectoryStore.create(base_file=tmp_path / 'test.nc', layout='columnar')
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path, layout='ragged') as ts:
+        ts.add(make_test_trajectory(10, 1))
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=path, layout='ragged')
+
+
+def test_storage_policy(tmp_path: Path):
+    path = tmp_path / 'test.nc'
+    extra_path = tmp_path / 'extra.nc'
+    trajs = [make_test_trajectory(20, i, complex_extras=True) for i in range(30)]
+    policy = StoragePolicy(
+        default=FieldStorage(zlib=False, chunk_trajectories=8),
+        fieldsets={'complex_extras': FieldStorage(zlib=True, complevel=4)},
+        fields={
+            'fuel_flow': FieldStorage(
+                zlib=True, complevel=9, least_significant_digit=2
+            ),
+            'tot': FieldStorage(shuffle=True),
+        },
+    )
+    assert policy.resolve('complex_extras', 'tot') == FieldStorage(
+        zlib=True,
+        complevel=4,
+        shuffle=True,
+        chunk_trajectories=8,
+        chunk_points=16384,
+    )
+    assert StoragePolicy.from_json(policy.to_json()) == policy
+
+    with TrajectoryStore.create(
+        base_file=path,
+        associated_files=[(extra_path, ['complex_extras'])],
+        layout='ragged',
+        storage_policy=policy,
+    ) as ts:
+        ts.add_many(trajs)
+
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        assert ts.storage_policy == policy
+        assert ts.files[0].storage_policy == policy
+        base = ts.files[0].groups['base'][0]
+        extras = ts.files[1].groups['complex_extras'][0]
+        assert base.variables['fuel_flow'].filters()['complevel'] == 9
+        assert not base.variables['altitude'].filters()['zlib']
+        assert base.variables['n_climb'].chunking() == [8]
+        assert extras.variables['tot'].filters()['complevel'] == 4
+        assert extras.variables['tot'].filters()['shuffle']
+        assert not extras.variables['tm2'].filters()['shuffle']
+        assert extras.variables['tm2'].chunking() == [8, 2, 4]
+
+        # Quantized values are accurate to the number of digits asked for,
+        # other values are exact.
+        for i in (0, 13, 29):
+            t = ts[i]
+            assert np.allclose(t.fuel_flow, trajs[i].fuel_flow, rtol=0, atol=0.01)
+            assert np.array_equal(t.altitude, trajs[i].altitude)
+            assert np.array_equal(t.seg[Species.CO2], trajs[i].seg[Species.CO2])
+
+        # Associated files use the store's policy unless told otherwise.
+        assoc1 = tmp_path / 'assoc1.nc'
+        assoc2 = tmp_path / 'assoc2.nc'
+        ts.create_associated(
+            assoc1, ['simple_extras'], lambda t: SimpleExtras.random(len(t))
+        )
+        ts.create_associated(
+            assoc2,
+            ['simple_extras'],
+            lambda t: SimpleExtras.random(len(t)),
+            storage_policy='archive',
+        )
+    with TrajectoryStore.open(base_file=path, associated_files=[assoc1]) as ts:
+        assert ts.files[1].storage_policy == policy
+    with TrajectoryStore.open(base_file=path, associated_files=[assoc2]) as ts:
+        assert ts.files[1].storage_policy == StoragePolicy.preset('archive')
+        f1 = ts.files[1].groups['simple_extras'][0].variables['f1']
+        assert f1.filters()['complevel'] == 6
+
+    # Stores created without a policy use the "balanced" preset.
+    path2 = tmp_path / 'test2.nc'
+    with TrajectoryStore.create(base_file=path2) as ts:
+        ts.add(trajs[0])
+    with TrajectoryStore.open(base_file=path2) as ts:
+        assert ts.storage_policy == StoragePolicy.preset('balanced')
+
+    with pytest.raises(ValueError):
+        TrajectoryStore.create(base_file=tmp_path / 'x.nc', storage_policy='tiny')
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=path, storage_policy='fast')
+    with pytest.raises(ValueError):
+        FieldStorage(complevel=12)
+
+
+def test_column_store(tmp_path: Path):
+    path = tmp_path / 'test.nc'
+    extra_path = tmp_path / 'extra.nc'
+    trajs = [
+        make_test_trajectory(5 + i % 13, i, simple_extras=True, complex_extras=True)
+        for i in range(60)
+    ]
+    trajs[7].name = None
+    with TrajectoryStore.create(
+        base_file=path, associated_files=[(extra_path, ['complex_extras'])]
+    ) as ts:
+        ts.add_many(trajs)
+
+    columns_path = tmp_path / 'test.aeic-columns'
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        ts.export(columns_path)
+        expected_name = ts[7].name
+
+    with TrajectoryStore.open(base_file=columns_path) as ts:
+        assert len(ts) == 60
+        assert ts.column_store
+        assert {fs for f in ts.files for fs in f.fieldsets} == {
+            'base',
+            'simple_extras',
+            'complex_extras',
+        }
+        # (Missing names are read back as empty strings from NetCDF files,
+        # and the same happens for column stores.)
+        for i, t in enumerate(ts):
+            assert i == 7 or t.approx_eq(trajs[i])
+        assert ts[7].name == expected_name
+        assert ts.get_flight(42).approx_eq(trajs[42])
+        assert [t.flight_id for t in ts[[50, 3, 50]]] == [50, 3, 50]
+
+        # Field reads of contiguous ranges are views of the column files.
+        alt = ts.read_field('altitude')
+        assert not alt.values.flags.writeable
+        assert np.array_equal(alt[33], trajs[33].altitude)
+        seg = ts.read_field('seg', slice(10, 20))
+        assert np.array_equal(seg[Species.CO2][4], trajs[14].seg[Species.CO2])
+        tm = ts.read_field('tm', slice(5, None))
+        assert tm.shape == (55, 4)
+        assert np.allclose(tm[0], list(trajs[5].tm.values()))
+        assert np.array_equal(ts.read_field('mf', [9, 2]), [trajs[9].mf, trajs[2].mf])
+        cruise = ts.read_points('fuel_flow', [4, 1], 1, 3)
+        assert np.array_equal(cruise[0], trajs[4].fuel_flow[1:3])
+
+        # Conversion back to NetCDF.
+        nc_path = tmp_path / 'back.nc'
+        merged_path = tmp_path / 'back.aeic-store'
+        ts.export(nc_path, layout='ragged')
+        ts.export(merged_path, shard_size=25)
+    for p in (nc_path, merged_path):
+        with TrajectoryStore.open(base_file=p) as ts:
+            assert len(ts) == 60
+            for i in (0, 24, 25, 59):
+                assert ts[i].approx_eq(trajs[i])
+            assert ts.get_flight(31).approx_eq(trajs[31])
+    with TrajectoryStore.open(base_file=merged_path) as ts:
+        assert len(ts.files[0].dataset) == 3
+
+    # Column stores are read-only and self-contained, and have the same field
+    # set consistency checks as NetCDF files.
+    with pytest.raises(ValueError):
+        TrajectoryStore.append(base_file=columns_path)
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=columns_path, associated_files=[extra_path])
+    with TrajectoryStore.open(base_file=columns_path) as ts:
+        with pytest.raises(ValueError):
+            ts.export(columns_path)
+    metadata_file = columns_path / 'metadata.json'
+    metadata = json.loads(metadata_file.read_text())
+    metadata['fieldset_hashes'][0] = '0' * 32
+    metadata_file.write_text(json.dumps(metadata))
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=columns_path)
+
+
+def test_trajectory_nbytes():
+    traj = make_test_trajectory(100, 1, complex_extras=True)
+    # 14 pointwise base fields, plus 2 species for the pointwise "seg" field.
+    assert traj.nbytes >= 16 * 100 * 8
+    assert traj.nbytes < 17 * 100 * 8
+
+
+@pytest.mark.parametrize('policy', ['lru', 'lfu', 'slru'])
+def test_cache_policies(tmp_path: Path, policy: str):
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(1000, i) for i in range(40))
+
+    # A 1 MB cache holds about 9 of these trajectories.
+    with TrajectoryStore.open(
+        base_file=path, cache_size_mb=1, cache_policy=policy
+    ) as ts:
+        assert ts.cache_policy == policy
+        hot = [0, 1, 2, 3]
+        for _ in range(2):
+            for i in hot:
+                _ = ts[i]
+        stats = ts.cache_stats
+        assert (stats.hits, stats.misses, stats.evictions) == (4, 4, 0)
+        assert stats.entries == 4
+        assert stats.currsize == sum(ts[i].nbytes for i in hot)
+        assert stats.hit_rate == 0.5
+
+        # A full pass over the store evicts the hot trajectories from an LRU
+        # cache, but not from the LFU or scan-resistant SLRU caches.
+        for _ in ts:
+            pass
+        stats = ts.cache_stats
+        assert stats.evictions > 0
+        assert stats.currsize <= stats.maxsize
+        ts.reset_cache_stats()
+        for i in hot:
+            _ = ts[i]
+        expected_hits = 0 if policy == 'lru' else 4
+        assert ts.cache_stats.hits == expected_hits
+
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=path, cache_policy='fifo')
+
+
+@pytest.mark.parametrize('layout', ['vlen', 'ragged'])
+def test_field_projection(tmp_path: Path, layout: str):
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path, layout=layout) as ts:
+        for i in range(10):
+            t = make_test_trajectory(i + 5, i)
+            t.add_fields(SimpleExtras.random(i + 5))
+            t.add_fields(ComplexExtras.random(i + 5))
+            ts.add(t)
+
+    with TrajectoryStore.open(base_file=path) as ts:
+        full = ts[:]
+
+    # 1. Base field set only: no extra fields, and nothing from the other
+    # field sets.
+    with TrajectoryStore.open(base_file=path, fieldsets=['base']) as ts:
+        trajs = ts[:]
+        for t, f in zip(trajs, full):
+            assert len(t) == len(f)
+            assert np.array_equal(t.altitude, f.altitude)
+            assert t.name == f.name
+            assert t.X_fieldsets == {'base'}
+            with pytest.raises(AttributeError):
+                _ = t.f1
+            with pytest.raises(AttributeError):
+                _ = t.tot
+        assert ts[3].nbytes < full[3].nbytes
+
+    # 2. Individual per-trajectory fields only: trajectory lengths are still
+    # known.
+    with TrajectoryStore.open(base_file=path, fields=['tot', 'mf']) as ts:
+        for i, t in enumerate(ts):
+            assert len(t) == i + 5
+            assert t.mf == full[i].mf
+            assert t.tot.isclose(full[i].tot)
+            assert set(t.X_data) == {'tot', 'mf'}
+            with pytest.raises(AttributeError):
+                _ = t.altitude
+
+    # 3. Field sets and fields combined.
+    with TrajectoryStore.open(
+        base_file=path, fieldsets=['simple_extras'], fields=['name', 'seg']
+    ) as ts:
+        t = ts[7]
+        assert set(t.X_data) == {'f1', 'f2', 'mf', 'name', 'seg'}
+        assert t.name == 'traj_7'
+        assert np.array_equal(t.f2, full[7].f2)
+        assert t.seg.isclose(full[7].seg)
+
+    # 4. Checking.
+    with pytest.raises(ValueError, match='not found'):
+        TrajectoryStore.open(base_file=path, fieldsets=['missing'])
+    with pytest.raises(ValueError, match='not found'):
+        TrajectoryStore.open(base_file=path, fields=['missing'])
+    with pytest.raises(ValueError, match='READ mode'):
+        TrajectoryStore.append(base_file=path, fieldsets=['base'])
+
+
+@pytest.mark.parametrize('layout', ['vlen', 'ragged'])
+def test_lazy_trajectories(tmp_path: Path, layout: str):
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path, layout=layout) as ts:
+        for i in range(10):
+            t = make_test_trajectory(i + 5, i)
+            t.add_fields(ComplexExtras.random(i + 5))
+            ts.add(t)
+
+    with TrajectoryStore.open(base_file=path) as ts:
+        full = ts[:]
+
+    with TrajectoryStore.open(base_file=path, lazy=True) as ts:
+        # 1. Nothing is read until a field is accessed, then only that field.
+        t = ts[3]
+        assert isinstance(t, LazyTrajectory)
+        assert t.loaded_fields == set()
+        assert t.nbytes == 0
+        assert np.array_equal(t.altitude, full[3].altitude)
+        assert t.loaded_fields == {'altitude'}
+        assert t.tot.isclose(full[3].tot)
+        assert t.loaded_fields == {'altitude', 'tot'}
+
+        # 2. The cache sees the size of the loaded data.
+        assert ts.cache_stats.currsize == t.nbytes > 0
+
+        # 3. Trajectory lengths are found without loading fields.
+        t = ts[7]
+        assert len(t) == 12
+        assert t.loaded_fields == set()
+
+        # 4. Comparison and copying load everything.
+        assert ts[5].approx_eq(full[5])
+        c = ts[6].copy()
+        assert not isinstance(c, LazyTrajectory)
+        assert c.approx_eq(full[6])
+        with pytest.raises(AttributeError):
+            _ = ts[0].missing
+
+    # 5. Lazy loading combines with field projection: comparison and copying
+    # load only the projected fields, just as for eager trajectories.
+    for name, same in (('tot', operator.eq), ('altitude', np.array_equal)):
+        with TrajectoryStore.open(base_file=path, fields=[name]) as ts:
+            projected = ts[:]
+        with TrajectoryStore.open(base_file=path, lazy=True, fields=[name]) as ts:
+            t = ts[2]
+            assert t == projected[2]
+            assert t.loaded_fields == {name}
+            c = t.copy()
+            assert not isinstance(c, LazyTrajectory)
+            assert same(getattr(c, name), getattr(projected[2], name))
+            assert t.species == projected[2].species
+    with TrajectoryStore.open(base_file=path, lazy=True, fields=['tot']) as ts:
+        t = ts[2]
+        assert t.tot.isclose(full[2].tot)
+        with pytest.raises(AttributeError):
+            _ = t.altitude
+
+    # 6. Views can't load fields once the store is closed.
+    with pytest.raises(RuntimeError):
+        _ = t.seg
+    with pytest.raises(ValueError, match='READ mode'):
+        TrajectoryStore.append(base_file=path, lazy=True)
+
+
+def test_aggregate(tmp_path: Path):
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        for i in range(20):
+            t = make_test_trajectory(10, 100 + i)
+            t.add_fields(ComplexExtras.random(10))
+            ts.add(t)
+
+    with TrajectoryStore.open(base_file=path) as ts:
+        trajs = ts[:]
+        masses = np.array([t.starting_mass for t in trajs])
+
+        # 1. Whole store statistics.
+        result = ts.aggregate(
+            ['starting_mass', 'tot', 'tm'],
+            stats=['count', 'sum', 'mean', 'std', 'min', 'max'],
+            quantiles=[0.5, 0.9],
+        )
+        stats = result['starting_mass']
+        assert stats['count'] == 20
+        assert np.isclose(stats['sum'], masses.sum())
+        assert np.isclose(stats['mean'], masses.mean())
+        assert np.isclose(stats['std'], masses.std())
+        assert stats['min'] == masses.min() and stats['max'] == masses.max()
+        assert np.isclose(stats['q0.5'], np.quantile(masses, 0.5))
+        assert np.isclose(stats['q0.9'], np.quantile(masses, 0.9))
+        co2 = np.array([t.tot[Species.CO2] for t in trajs])
+        assert isinstance(result['tot']['sum'], SpeciesValues)
+        assert np.isclose(result['tot']['sum'][Species.CO2], co2.sum())
+        takeoff = np.array([t.tm[ThrustMode.TAKEOFF] for t in trajs])
+        assert isinstance(result['tm']['max'], ThrustModeValues)
+        assert np.isclose(result['tm']['max'][ThrustMode.TAKEOFF], takeoff.max())
+
+        # 2. Grouping by keys joined from flight IDs, with unmatched flights
+        # grouped under None.
+        types = {100 + i: 'A320' if i % 2 == 0 else 'B738' for i in range(18)}
+        types[5] = 'E190'
+        result = ts.aggregate('starting_mass', stats=['count', 'sum', 'mean'], by=types)
+        assert set(result) == {'A320', 'B738', 'E190', None}
+        assert result['A320']['starting_mass']['count'] == 9
+        assert np.isclose(result['B738']['starting_mass']['sum'], masses[1:18:2].sum())
+        assert result[None]['starting_mass']['count'] == 2
+        assert result['E190']['starting_mass']['count'] == 0
+        assert np.isnan(result['E190']['starting_mass']['mean'])
+
+        # 3. Grouping by a field and by explicit keys, for a subset.
+        result = ts.aggregate('total_fuel_mass', by='name', indices=slice(0, 4))
+        assert set(result) == {f'traj_{100 + i}' for i in range(4)}
+        keys = np.arange(10) % 3
+        result = ts.aggregate('starting_mass', by=keys, indices=slice(10, 20))
+        assert np.isclose(
+            result[0]['starting_mass']['sum'], masses[10:20][keys == 0].sum()
+        )
+
+        # 4. Checking.
+        with pytest.raises(ValueError, match='per-trajectory'):
+            ts.aggregate('altitude')
+        with pytest.raises(ValueError, match='Unknown statistic'):
+            ts.aggregate('starting_mass', stats=['median'])
+
+
+def fuel_and_count(traj: Trajectory, scale: float) -> tuple[float, int, list[int]]:
+    return scale * traj.total_fuel_mass, 1, [traj.flight_id]
+
+
+def combine_fuel_and_count(a: tuple, b: tuple) -> tuple[float, int, list[int]]:
+    return a[0] + b[0], a[1] + b[1], a[2] + b[2]
+
+
+def total_fuel(traj: Trajectory) -> float:
+    return traj.total_fuel_mass
+
+
+def test_map_reduce(tmp_path: Path):
+    # Merged store with shards of different sizes.
+    paths = []
+    for i in range(3):
+        paths.append(tmp_path / f'test{i}.nc')
+        with TrajectoryStore.create(base_file=paths[-1]) as ts:
+            ts.add_many(
+                make_test_trajectory(10, i * 100 + j) for j in range(5 + 10 * i)
+            )
+    merged = tmp_path / 'merged.aeic-store'
+    TrajectoryStore.merge(input_stores=paths, output_store=merged)
+    with TrajectoryStore.open(base_file=merged) as ts:
+        expected = sum(2.0 * t.total_fuel_mass for t in ts)
+        flight_ids = [t.flight_id for t in ts]
+
+    # Serial and parallel runs give the same results, combined in trajectory
+    # order.
+    for n_workers in (None, 2):
+        total, count, ids = TrajectoryStore.map_reduce(
+            merged, fuel_and_count, combine_fuel_and_count, 2.0, n_workers=n_workers
+        )
+        assert np.isclose(total, expected)
+        assert count == 45
+        assert ids == flight_ids
+
+    # Field projection is passed to the workers.
+    total, _, _ = TrajectoryStore.map_reduce(
+        merged,
+        fuel_and_count,
+        combine_fuel_and_count,
+        scale=2.0,
+        n_workers=2,
+        fields=['total_fuel_mass', 'flight_id'],
+    )
+    assert np.isclose(total, expected)
+
+    with pytest.raises(ValueError):
+        TrajectoryStore.map_reduce(merged, fuel_and_count, sum, n_workers=0)
+
+
+@pytest.mark.parametrize('layout', ['vlen', 'ragged'])
+def test_subset(tmp_path: Path, layout: str):
+    path = tmp_path / 'test.nc'
+    extra_path = tmp_path / 'extra.nc'
+    with TrajectoryStore.create(
+        base_file=path,
+        associated_files=[(extra_path, ['complex_extras'])],
+        layout=layout,
+    ) as ts:
+        for i in range(30):
+            t = make_test_trajectory(i + 5, i)
+            t.add_fields(ComplexExtras.random(i + 5))
+            ts.add(t)
+
+    # Predicate on per-trajectory fields, copying the associated file too.
+    out = tmp_path / 'subset.nc'
+    out_extra = tmp_path / 'subset_extra.nc'
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        full = ts[:]
+        n = ts.subset(
+            out,
+            where=lambda f: (f['flight_id'] % 3 == 0) & (f['n_climb'] > 3),
+            associated_files=[out_extra],
+        )
+    expected = [t for t in full if t.flight_id % 3 == 0 and t.n_climb > 3]
+    assert n == len(expected)
+    with TrajectoryStore.open(base_file=out, associated_files=[out_extra]) as ts:
+        assert ts.layout == layout
+        assert ts[:] == expected
+        assert ts.get_flight(12) == full[12]
+        assert ts.get_flight(13) is None
+
+    # Flight ID sets (with IDs not in the store), and only the base file.
+    out2 = tmp_path / 'subset2.nc'
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        assert ts.subset(out2, where={25, 4, 100}) == 2
+    with TrajectoryStore.open(base_file=out2) as ts:
+        assert ts.files[0].fieldsets == {'base'}
+        assert [t.flight_id for t in ts] == [4, 25]
+        assert np.array_equal(ts[1].altitude, full[25].altitude)
+
+    # Subset of a merged store, selecting from all of its files.
+    merged = tmp_path / 'merged.aeic-store'
+    with TrajectoryStore.open(base_file=path) as ts:
+        ts.export(merged, shard_size=7)
+    out3 = tmp_path / 'subset3.nc'
+    with TrajectoryStore.open(base_file=merged) as ts:
+        assert ts.subset(out3, where=np.arange(1, 30, 2)) == 15
+    with TrajectoryStore.open(base_file=out3) as ts:
+        assert [t.name for t in ts] == [f'traj_{i}' for i in range(1, 30, 2)]
+        assert np.array_equal(ts.read_field('flight_id'), np.arange(1, 30, 2))
+
+    # Checking.
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        with pytest.raises(ValueError, match='already exists'):
+            ts.subset(out, where={1}, associated_files=[tmp_path / 'new.nc'])
+        with pytest.raises(ValueError, match='associated output files'):
+            ts.subset(tmp_path / 'new.nc', where={1}, associated_files=[])
+        with pytest.raises(ValueError, match='boolean mask'):
+            ts.subset(tmp_path / 'new.nc', where=lambda f: f['flight_id'])
+    assert not (tmp_path / 'new.nc').exists()
+
+
+def test_write_behind(tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    # Record the threads that NetCDF writes are made from.
+    write_threads = set()
+    write_block = TrajectoryStore._write_block
+
+    def recording_write_block(self, **kwargs):
+        write_threads.add(threading.get_ident())
+        return write_block(self, **kwargs)
+
+    monkeypatch.setattr(TrajectoryStore, '_write_block', recording_write_block)
+
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(
+        base_file=path, write_behind=True, write_buffer_size=4
+    ) as ts:
+        for i in range(10):
+            ts.add(make_test_trajectory(20, i))
+        ts.add_many(make_test_trajectory(20, i) for i in range(10, 30))
+
+        # Queued trajectories count towards the store length and can be read
+        # back, and lookups by flight ID see them.
+        assert len(ts) == 30
+        assert ts.get_flight(17).name == 'traj_17'
+        assert np.array_equal(ts.read_field('flight_id'), np.arange(30))
+        ts.sync()
+    assert len(write_threads) == 1
+    assert threading.get_ident() not in write_threads
+
+    with TrajectoryStore.append(base_file=path, write_behind=True) as ts:
+        ts.add(make_test_trajectory(20, 30))
+    with TrajectoryStore.open(base_file=path) as ts:
+        assert len(ts) == 31
+        assert [t.name for t in ts] == [f'traj_{i}' for i in range(31)]
+        assert ts.get_flight(30).name == 'traj_30'
+
+    # Exceptions from the writer thread are raised by the next call that
+    # checks on the writer.
+    def failing_write_block(self, **kwargs):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(TrajectoryStore, '_write_block', failing_write_block)
+    ts = TrajectoryStore.create(base_file=tmp_path / 'fail.nc', write_behind=True)
+    ts.add(make_test_trajectory(20, 0))
+    with pytest.raises(OSError, match='disk full'):
+        ts.sync()
+    ts.add(make_test_trajectory(20, 1))
+    with pytest.raises(OSError, match='disk full'):
+        ts.close()
+    assert ts._writer is None
+    assert not ts.nc_linked
+
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=path, write_behind=True)
+
+
+def add_and_crash(path: Path, layout: str) -> None:
+    ts = TrajectoryStore.create(
+        base_file=path,
+        associated_files=[(path.with_suffix('.extra.nc'), ['simple_extras'])],
+        layout=layout,
+        write_buffer_size=10,
+        checkpoint_every=40,
+    )
+    for i in range(100):
+        ts.add(make_test_trajectory(20, i, simple_extras=True))
+    os._exit(1)
+
+
+@pytest.mark.parametrize('layout', ['vlen', 'ragged'])
+def test_checkpointing(tmp_path: Path, layout: str):
+    # Kill a process part way through writing a store: checkpoints happen
+    # after 40 and 80 trajectories.
+    path = tmp_path / 'test.nc'
+    extra_path = path.with_suffix('.extra.nc')
+    p = mp.get_context('spawn').Process(target=add_and_crash, args=(path, layout))
+    p.start()
+    p.join()
+    assert p.exitcode == 1
+
+    # Appending truncates the store to the last commit (if any uncommitted
+    # trajectories made it to disk), and the flights that are there can be
+    # skipped.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        ts = TrajectoryStore.append(base_file=path, associated_files=[extra_path])
+    with ts:
+        assert len(ts) == 80
+        assert np.array_equal(ts.flight_ids(), np.arange(80))
+        done = set(ts.flight_ids().tolist())
+        for i in range(100):
+            if i not in done:
+                ts.add(make_test_trajectory(20, i, simple_extras=True))
+
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        assert len(ts) == 100
+        assert [t.name for t in ts] == [f'traj_{i}' for i in range(100)]
+        assert ts.files[0].dataset[0].committed_trajectories == 100
+        assert ts.files[0].dataset[0].committed_flight_id == 99
+        expected = ts[:60]
+
+    # A cleanly closed store isn't touched.
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        with TrajectoryStore.append(base_file=path) as ts:
+            assert len(ts) == 100
+
+    # Trajectories written after the last commit are discarded.
+    with nc4.Dataset(path, 'a') as ds:
+        ds.committed_trajectories = 60
+    with pytest.warns(UserWarning, match='Discarding 40 uncommitted'):
+        ts = TrajectoryStore.append(base_file=path, associated_files=[extra_path])
+    with ts:
+        assert len(ts) == 60
+        assert ts.get_flight(70) is None
+        ts.add(make_test_trajectory(20, 100, simple_extras=True))
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        assert len(ts) == 61
+        assert ts[:60] == expected
+        assert ts.get_flight(100).name == 'traj_100'
+
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=path, checkpoint_every=10)
+
+
+def write_shards(store_dir: Path, prefix: str, start: int) -> None:
+    with TrajectoryStore.create_sharded(
+        store_dir, max_trajectories_per_shard=15, shard_prefix=prefix
+    ) as writer:
+        writer.add_many(make_test_trajectory(10, start + i) for i in range(40))
+
+
+def test_create_sharded(tmp_path: Path):
+    store_dir = tmp_path / 'test.aeic-store'
+    with TrajectoryStore.create_sharded(
+        store_dir, max_trajectories_per_shard=10, title='sharded', layout='ragged'
+    ) as writer:
+        for i in range(15):
+            writer.add(make_test_trajectory(20, i))
+
+        # Finished shards are already part of the merged store. A reader that
+        # has the store open while more shards are added keeps seeing the
+        # store as it was when it was opened.
+        with TrajectoryStore.open(base_file=store_dir) as ts:
+            assert len(ts) == 10
+            assert ts.get_flight(3).name == 'traj_3'
+            index_inode = (store_dir / '_index.nc').stat().st_ino
+            metadata = (store_dir / 'metadata.json').read_text()
+
+            assert writer.add_many(
+                make_test_trajectory(20, i) for i in range(15, 25)
+            ) == (list(range(15, 25)))
+            assert (store_dir / '_index.nc').stat().st_ino != index_inode
+            assert len(ts) == 10
+            assert ts.get_flight(9).name == 'traj_9'
+            assert ts.get_flight(12) is None
+    assert [p.name for p in writer.shards] == [
+        'shard_00000.nc',
+        'shard_00001.nc',
+        'shard_00002.nc',
+    ]
+    with TrajectoryStore.open(base_file=store_dir) as ts:
+        assert len(ts) == 25
+        assert ts.global_attributes['title'] == 'sharded'
+        assert ts.layout == 'ragged'
+        assert [t.name for t in ts] == [f'traj_{i}' for i in range(25)]
+        assert ts.get_flight(24).name == 'traj_24'
+
+    # A reader that finds the old metadata file but the new index file (from
+    # opening the store between the two being replaced) ignores index entries
+    # for trajectories it doesn't have.
+    current = (store_dir / 'metadata.json').read_text()
+    (store_dir / 'metadata.json').write_text(metadata)
+    with TrajectoryStore.open(base_file=store_dir) as ts:
+        assert len(ts) == 10
+        assert np.array_equal(ts.flight_ids(), np.arange(10))
+        assert ts.get_flight(20) is None
+    (store_dir / 'metadata.json').write_text(current)
+
+    # Shards limited by size, added to the same store.
+    nbytes = make_test_trajectory(20, 100).nbytes
+    with TrajectoryStore.create_sharded(
+        store_dir, max_bytes_per_shard=3 * nbytes, shard_prefix='more', layout='ragged'
+    ) as writer:
+        writer.add_many(make_test_trajectory(20, i) for i in range(100, 107))
+    assert len(writer.shards) == 3
+    with TrajectoryStore.open(base_file=store_dir) as ts:
+        assert len(ts) == 32
+        assert ts[25].name == 'traj_100'
+        assert ts.get_flight(106).name == 'traj_106'
+
+    # Processes writing shards of the same store in parallel.
+    parallel_dir = tmp_path / 'parallel.aeic-store'
+    ctx = mp.get_context('spawn')
+    procs = [
+        ctx.Process(target=write_shards, args=(parallel_dir, f'w{k}', 1000 * k))
+        for k in range(2)
+    ]
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+        assert p.exitcode == 0
+    with TrajectoryStore.open(base_file=parallel_dir) as ts:
+        assert len(ts) == 80
+        assert len(ts.files[0].path) == 6
+        expected = [*range(40), *range(1000, 1040)]
+        assert np.array_equal(ts.flight_ids(), expected)
+        for fid in (0, 39, 1000, 1039):
+            assert ts.get_flight(fid).flight_id == fid
+
+    # Shards must match the rest of the store.
+    with pytest.raises(ValueError, match='do not match'):
+        with TrajectoryStore.create_sharded(store_dir, shard_prefix='bad') as writer:
+            writer.add(make_test_trajectory(20, 200))
+    with TrajectoryStore.open(base_file=store_dir) as ts:
+        assert len(ts) == 32
+
+    with pytest.raises(ValueError):
+        TrajectoryStore.create_sharded(tmp_path / 'bad')
+    with pytest.raises(ValueError):
+        TrajectoryStore.create_sharded(store_dir, base_file=tmp_path / 'x.nc')
+
+
+def test_create_sharded_error(tmp_path: Path):
+    # If the writer's body raises, finished shards stay in the store, but the
+    # shard being written is deleted rather than added.
+    store_dir = tmp_path / 'test.aeic-store'
+    with pytest.raises(RuntimeError, match='simulation failed'):
+        with TrajectoryStore.create_sharded(
+            store_dir, max_trajectories_per_shard=10
+        ) as writer:
+            writer.add_many(make_test_trajectory(20, i) for i in range(15))
+            raise RuntimeError('simulation failed')
+    assert [p.name for p in writer.shards] == ['shard_00000.nc']
+    assert not (store_dir / 'shard_00001.nc').exists()
+    with TrajectoryStore.open(base_file=store_dir) as ts:
+        assert len(ts) == 10
+        assert np.array_equal(ts.flight_ids(), np.arange(10))
+        assert ts.get_flight(12) is None
+
+    # The store can be added to afterwards as usual.
+    with TrajectoryStore.create_sharded(store_dir) as writer:
+        assert writer.add_many(
+            make_test_trajectory(20, i) for i in range(10, 15)
+        ) == list(range(5))
+    with TrajectoryStore.open(base_file=store_dir) as ts:
+        assert len(ts) == 15
+        assert ts.get_flight(12).name == 'traj_12'
+
+
+def test_create_sharded_species(tmp_path: Path):
+    # Every shard gets the species dimension of the first trajectory added,
+    # so a later trajectory with other species can't be added.
+    co2_h2o = [Species.CO2, Species.H2O]
+    h2o_nox = [Species.H2O, Species.NOx]
+    with pytest.raises(ValueError, match='not in the species dimension'):
+        with TrajectoryStore.create_sharded(
+            tmp_path / 'test.aeic-store', max_trajectories_per_shard=2
+        ) as writer:
+            writer.add_many(
+                [
+                    make_species_test_trajectory(10, 0, co2_h2o),
+                    make_species_test_trajectory(10, 1, co2_h2o),
+                    make_species_test_trajectory(10, 2, h2o_nox),
+                ]
+            )
+    assert [p.name for p in writer.shards] == ['shard_00000.nc']
+    with TrajectoryStore.open(base_file=tmp_path / 'test.aeic-store') as ts:
+        assert len(ts) == 2
+
+    # With the species given, shards have the same species dimension and
+    # values read back under the right species.
+    store_dir = tmp_path / 'species.aeic-store'
+    with TrajectoryStore.create_sharded(
+        store_dir,
+        max_trajectories_per_shard=2,
+        species=[Species.NOx, Species.H2O, Species.CO2],
+    ) as writer:
+        writer.add_many(
+            [
+                make_species_test_trajectory(10, 0, co2_h2o),
+                make_species_test_trajectory(10, 1, co2_h2o),
+                make_species_test_trajectory(10, 2, h2o_nox),
+            ]
+        )
+    assert len(writer.shards) == 2
+    with TrajectoryStore.open(base_file=store_dir) as ts:
+        assert len(ts) == 3
+        assert ts[0].tot[Species.CO2] == 1.0
+        assert ts[0].tot[Species.H2O] == 2.0
+        assert ts[2].tot[Species.H2O] == 1.0
+        assert ts[2].tot[Species.NOx] == 2.0
+        assert ts[2].tm2[Species.NOx][ThrustMode.IDLE] == 2.0
+
+    # Files of a merged store with different species dimensions are
+    # rejected when they're opened.
+    bad_dir = tmp_path / 'bad.aeic-store'
+    bad_dir.mkdir()
+    for k, species in enumerate((co2_h2o, h2o_nox)):
+        with TrajectoryStore.create(base_file=bad_dir / f'{k}.nc') as ts:
+            ts.add(make_species_test_trajectory(10, k, species))
+    (bad_dir / 'metadata.json').write_text(
+        json.dumps(dict(stores=[['0.nc', 1], ['1.nc', 1]]))
+    )
+    with TrajectoryStore.open(base_file=bad_dir) as ts:
+        assert ts[0].tot[Species.CO2] == 1.0
+        with pytest.raises(ValueError, match='Species dimension'):
+            ts[1]
+
+
+@pytest.mark.parametrize('layout', ['vlen', 'ragged'])
+def test_compact(tmp_path: Path, layout: str):
+    path = tmp_path / 'test.nc'
+    extra_path = tmp_path / 'extra.nc'
+    with TrajectoryStore.create(
+        base_file=path,
+        associated_files=[(extra_path, ['complex_extras'])],
+        layout=layout,
+    ) as ts:
+        for i in range(30):
+            t = make_test_trajectory(i + 5, i)
+            t.add_fields(ComplexExtras.random(i + 5))
+            ts.add(t)
+    other = 'ragged' if layout == 'vlen' else 'vlen'
+
+    # Sort by a joined key (flight 7 has no key, so goes last), switching
+    # storage layout and policy.
+    types = {i: ['B738', 'A320', 'B77W'][i % 3] for i in range(30) if i != 7}
+    order = sorted(range(30), key=lambda i: (i not in types, types.get(i, '')))
+    out = tmp_path / 'compact.nc'
+    out_extra = tmp_path / 'compact_extra.nc'
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        full = ts[:]
+        ts.compact(
+            out,
+            types,
+            associated_files=[out_extra],
+            layout=other,
+            storage_policy='archive',
+        )
+    with TrajectoryStore.open(base_file=out, associated_files=[out_extra]) as ts:
+        assert ts.layout == other
+        assert ts.storage_policy == StoragePolicy.preset('archive')
+        assert ts[:] == [full[i] for i in order]
+        assert ts.get_flight(12) == full[12]
+
+    # Merged store output written by worker processes, sorted by a key for
+    # each trajectory.
+    merged = tmp_path / 'compact.aeic-store'
+    merged_extra = tmp_path / 'compact_extra.aeic-store'
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        ts.compact(
+            merged,
+            -np.arange(30),
+            associated_files=[merged_extra],
+            shard_size=7,
+            n_workers=2,
+        )
+    with TrajectoryStore.open(base_file=merged, associated_files=[merged_extra]) as ts:
+        assert len(ts.files[0].path) == 5
+        assert ts.layout == layout
+        assert ts[:] == full[::-1]
+        assert ts.get_flight(3) == full[3]
+
+    # Sorting a store back by flight ID, copying only the base field sets.
+    out2 = tmp_path / 'compact2.nc'
+    with TrajectoryStore.open(base_file=merged) as ts:
+        ts.compact(out2)
+    with TrajectoryStore.open(base_file=out2) as ts:
+        assert np.array_equal(ts.read_field('flight_id'), np.arange(30))
+        assert [t.name for t in ts] == [t.name for t in full]
+
+    # Checking.
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        with pytest.raises(ValueError, match='all be merged stores'):
+            ts.compact(merged.with_name('x.aeic-store'), associated_files=['x.nc'])
+        with pytest.raises(ValueError, match='merged store'):
+            ts.compact(tmp_path / 'new.nc', n_workers=2)
+        with pytest.raises(ValueError, match='Cannot sort'):
+            ts.compact(tmp_path / 'new.nc', 'altitude')
+    assert not (tmp_path / 'new.nc').exists()
+
+
+def test_merged_store_open_files(tmp_path: Path):
+    path = tmp_path / 'test.nc'
+    extra_path = tmp_path / 'extra.nc'
+    with TrajectoryStore.create(
+        base_file=path, associated_files=[(extra_path, ['complex_extras'])]
+    ) as ts:
+        for i in range(30):
+            t = make_test_trajectory(i + 5, i)
+            t.add_fields(ComplexExtras.random(i + 5))
+            ts.add(t)
+    merged = tmp_path / 'merged.aeic-store'
+    merged_extra = tmp_path / 'merged_extra.aeic-store'
+    with TrajectoryStore.open(base_file=path, associated_files=[extra_path]) as ts:
+        full = ts[:]
+        ts.compact(merged, associated_files=[merged_extra], shard_size=3)
+
+    # Only the first file is opened when the store is opened, and no more
+    # than the maximum number of files are open at once after that.
+    with TrajectoryStore.open(base_file=merged, max_open_files=4) as ts:
+        assert len(ts._open_files) == 1
+        assert len(ts) == 30
+        assert len(ts._open_files) == 1
+        assert np.array_equal(ts[17].altitude, full[17].altitude)
+        assert np.array_equal(ts.read_field('flight_id'), np.arange(30))
+        assert len(ts._open_files) == 4
+    assert len(ts._open_files) == 0
+
+    # Base and associated files, with files closed and reopened all the time.
+    with TrajectoryStore.open(
+        base_file=merged, associated_files=[merged_extra], max_open_files=1
+    ) as ts:
+        assert ts[:] == full
+        assert ts.get_flight(25) == full[25]
+        assert len(ts._open_files) == 1
+
+    # Files are checked when they're first opened.
+    with open(merged / 'metadata.json') as f:
+        metadata = json.load(f)
+    metadata['stores'][5][1] = 4
+    metadata['stores'][6][1] = 2
+    with open(merged / 'metadata.json', 'w') as f:
+        json.dump(metadata, f)
+    with TrajectoryStore.open(base_file=merged) as ts:
+        assert ts[0].name == full[0].name
+        with pytest.raises(ValueError, match='does not match metadata'):
+            ts[16]
+
+    with pytest.raises(ValueError):
+        TrajectoryStore.open(base_file=merged, max_open_files=0)
+    with pytest.raises(ValueError):
+        TrajectoryStore.create(base_file=tmp_path / 'new.nc', max_open_files=4)
+
+
+def test_species_block_writes(tmp_path: Path):
+    # The species dimension only holds the species in the data, so values must
+    # be written by their position in that dimension, not in the `Species`
+    # enumeration.
+    trajs = []
+    for i in range(20):
+        t = make_test_trajectory(10, i)
+        extras = ComplexExtras.random(10)
+        for name in ('tot', 'seg', 'tm2'):
+            val = getattr(extras, name)
+            setattr(
+                extras,
+                name,
+                SpeciesValues(
+                    {Species.NOx: val[Species.CO2], Species.SO2: val[Species.H2O]}
+                ),
+            )
+        t.add_fields(extras)
+        trajs.append(t)
+
+    # Trajectories are written one at a time and in blocks, in both layouts.
+    for layout in ('vlen', 'ragged'):
+        path = tmp_path / f'test_{layout}.nc'
+        with TrajectoryStore.create(base_file=path, layout=layout) as ts:
+            ts.add(trajs[0])
+            ts.add_many(trajs[1:])
+        with TrajectoryStore.open(base_file=path) as ts:
+            assert ts._nc['complex_extras'].species == [Species.NOx, Species.SO2]
+            assert ts[:] == trajs
+            tot = ts.read_field('tot')
+            assert isinstance(tot, SpeciesValues)
+            assert np.allclose(tot[Species.SO2], [t.tot[Species.SO2] for t in trajs])
+
+
+def test_species_mismatch_writes(tmp_path: Path):
+    # Values for species outside the species dimension of the file (taken
+    # from the first trajectory) can't be written, and are not dropped
+    # silently.
+    t0 = make_species_test_trajectory(10, 0, [Species.CO2, Species.H2O])
+    t1 = make_species_test_trajectory(10, 1, [Species.H2O, Species.NOx])
+    for layout in ('vlen', 'ragged'):
+        path = tmp_path / f'test_{layout}.nc'
+        with TrajectoryStore.create(base_file=path, layout=layout) as ts:
+            ts.add(t0)
+            with pytest.raises(ValueError, match='not in the species dimension'):
+                ts.add(t1)
+        path = tmp_path / f'test_many_{layout}.nc'
+        with TrajectoryStore.create(base_file=path, layout=layout) as ts:
+            with pytest.raises(ValueError, match='not in the species dimension'):
+                ts.add_many([t0, t1])
+
+    # Trajectories with only some of the species are fine.
+    t2 = make_species_test_trajectory(10, 2, [Species.H2O])
+    path = tmp_path / 'test_subset.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many([t0, t2])
+    with TrajectoryStore.open(base_file=path) as ts:
+        assert ts[1].tot[Species.H2O] == 1.0
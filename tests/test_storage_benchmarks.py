@@ -0,0 +1,583 @@
+# Storage benchmarks. These are long-running timing runs rather than checks, so
+# they are skipped unless pytest is run with --benchmarks, e.g.
+#
+#   pytest --benchmarks -s tests/test_storage_benchmarks.py
+
+# TODO: Remove this when we move to Python 3.14+.
+from __future__ import annotations
+
+import operator
+import random
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import netCDF4 as nc4
+import numpy as np
+import pytest
+from test_storage import ComplexExtras, make_test_trajectory, total_fuel
+
+from AEIC.performance.types import ThrustMode, ThrustModeValues
+from AEIC.trajectories import StoragePolicy, TrajectoryStore
+from AEIC.trajectories.trajectory import Trajectory
+from AEIC.types import Species, SpeciesValues
+
+pytestmark = pytest.mark.benchmark
+
+
+def test_incremental_indexing_benchmark(tmp_path: Path):
+    # Compare the time to bring the index up to date after appending a small
+    # batch of trajectories by merging and by a full rebuild.
+
+    ntrajs = 20000
+    nappend = 100
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many([make_test_trajectory(2, i) for i in range(ntrajs)])
+
+    times = {}
+    for method in ('merge', 'rebuild'):
+        with TrajectoryStore.append(base_file=path) as ts:
+            ts._load_index()
+            ts.add_many(
+                [
+                    make_test_trajectory(2, random.randrange(ntrajs))
+                    for _ in range(nappend)
+                ]
+            )
+            ts._flush_write_buffer()
+            tstart = datetime.now()
+            if method == 'merge':
+                ts._reindex()
+            else:
+                ts._rebuild_index()
+                ts.index_stale = False
+            times[method] = (datetime.now() - tstart).total_seconds()
+
+    print(
+        f'reindex after appending {nappend} to {ntrajs}: '
+        f'merge {times["merge"]:.4f} s, rebuild {times["rebuild"]:.4f} s'
+    )
+
+
+def test_add_many_benchmark(tmp_path: Path):
+    # Compare trajectory write throughput for adding trajectories one at a
+    # time and in bulk.
+
+    ntrajs = 5000
+    trajs = [make_test_trajectory(100, i) for i in range(ntrajs)]
+
+    tstart = datetime.now()
+    with TrajectoryStore.create(base_file=tmp_path / 'add.nc') as ts:
+        for t in trajs:
+            ts.add(t)
+    single = ntrajs / (datetime.now() - tstart).total_seconds()
+
+    tstart = datetime.now()
+    with TrajectoryStore.create(base_file=tmp_path / 'add_many.nc') as ts:
+        ts.add_many(trajs)
+    bulk = ntrajs / (datetime.now() - tstart).total_seconds()
+
+    print(f'add: {single:.0f} trajectories/s, add_many: {bulk:.0f} trajectories/s')
+
+
+def test_scan_benchmark(tmp_path: Path):
+    # Compare sequential scan throughput for trajectory-at-a-time and block
+    # reads.
+
+    ntrajs = 5000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(100, i) for i in range(ntrajs))
+
+    with TrajectoryStore.open(base_file=path) as ts:
+        tstart = datetime.now()
+        for i in range(ntrajs):
+            ts._load_trajectories(np.array([i]))
+        single = ntrajs / (datetime.now() - tstart).total_seconds()
+
+    with TrajectoryStore.open(base_file=path) as ts:
+        tstart = datetime.now()
+        for _ in ts:
+            pass
+        block = ntrajs / (datetime.now() - tstart).total_seconds()
+
+    print(f'single: {single:.0f} trajectories/s, block: {block:.0f} trajectories/s')
+
+
+def test_prefetch_benchmark(tmp_path: Path):
+    # Compare iteration with and without prefetching when there is some
+    # computation to do for each trajectory.
+
+    ntrajs = 5000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(100, i) for i in range(ntrajs))
+
+    def work(t: Trajectory):
+        for _ in range(20):
+            np.sort(t.fuel_flow * t.altitude)
+
+    for prefetch in (0, 4):
+        with TrajectoryStore.open(base_file=path) as ts:
+            tstart = datetime.now()
+            for t in ts.iter(prefetch=prefetch):
+                work(t)
+            rate = ntrajs / (datetime.now() - tstart).total_seconds()
+        print(f'prefetch={prefetch}: {rate:.0f} trajectories/s')
+
+
+def test_concurrent_read_benchmark(tmp_path: Path):
+    # Trajectory lookup throughput with different numbers of threads reading
+    # from a single concurrent store, for lookups that mostly miss the
+    # trajectory cache and for lookups that always hit it.
+
+    ntrajs = 5000
+    nlookups = 4000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(100, i) for i in range(ntrajs))
+
+    def run(ts: TrajectoryStore, nthreads: int, high: int) -> float:
+        def lookups(seed: int):
+            rng = np.random.default_rng(seed)
+            for i in rng.integers(high, size=nlookups // nthreads):
+                _ = ts[int(i)]
+
+        threads = [threading.Thread(target=lookups, args=(k,)) for k in range(nthreads)]
+        tstart = datetime.now()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return nlookups / (datetime.now() - tstart).total_seconds()
+
+    for nthreads in (1, 2, 4, 8, 16):
+        with TrajectoryStore.open(
+            base_file=path, concurrent=True, cache_size_mb=4
+        ) as ts:
+            miss_rate = run(ts, nthreads, ntrajs)
+            _ = ts[0:50]
+            hit_rate = run(ts, nthreads, 50)
+        print(
+            f'{nthreads:2d} threads: {miss_rate:.0f} lookups/s (cache misses), '
+            f'{hit_rate:.0f} lookups/s (cache hits)'
+        )
+
+
+def test_storage_layout_benchmark(tmp_path: Path):
+    # File size, write and read times for the two storage layouts.
+
+    ntrajs = 5000
+    trajs = [make_test_trajectory(200 + i % 100, i) for i in range(ntrajs)]
+    for layout in ('vlen', 'ragged'):
+        path = tmp_path / f'{layout}.nc'
+        tstart = datetime.now()
+        with TrajectoryStore.create(base_file=path, layout=layout) as ts:
+            ts.add_many(trajs)
+        write_rate = ntrajs / (datetime.now() - tstart).total_seconds()
+
+        with TrajectoryStore.open(base_file=path) as ts:
+            tstart = datetime.now()
+            for _ in ts:
+                pass
+            scan_rate = ntrajs / (datetime.now() - tstart).total_seconds()
+        with TrajectoryStore.open(base_file=path) as ts:
+            tstart = datetime.now()
+            ts.read_field('altitude')
+            field_time = (datetime.now() - tstart).total_seconds()
+            tstart = datetime.now()
+            ts.read_points('altitude', start=50, stop=60)
+            points_time = (datetime.now() - tstart).total_seconds()
+        print(
+            f'{layout}: {path.stat().st_size / 1024**2:.1f} MB, '
+            f'write {write_rate:.0f} trajectories/s, '
+            f'scan {scan_rate:.0f} trajectories/s, '
+            f'read_field {field_time:.3f} s, read_points {points_time:.3f} s'
+        )
+
+
+def test_storage_policy_benchmark(tmp_path: Path):
+    # File size, write and read times for the preset storage policies, with
+    # pointwise data in the ragged layout (which is the only layout where
+    # pointwise data can be compressed).
+
+    ntrajs = 5000
+    trajs = [
+        make_test_trajectory(200 + i % 100, i, complex_extras=True)
+        for i in range(ntrajs)
+    ]
+    for preset in StoragePolicy.PRESETS:
+        path = tmp_path / f'{preset}.nc'
+        tstart = datetime.now()
+        with TrajectoryStore.create(
+            base_file=path, layout='ragged', storage_policy=preset
+        ) as ts:
+            ts.add_many(trajs)
+        write_rate = ntrajs / (datetime.now() - tstart).total_seconds()
+
+        with TrajectoryStore.open(base_file=path) as ts:
+            tstart = datetime.now()
+            for _ in ts:
+                pass
+            scan_rate = ntrajs / (datetime.now() - tstart).total_seconds()
+        with TrajectoryStore.open(base_file=path) as ts:
+            tstart = datetime.now()
+            ts.read_field('seg')
+            field_time = (datetime.now() - tstart).total_seconds()
+        print(
+            f'{preset}: {path.stat().st_size / 1024**2:.1f} MB, '
+            f'write {write_rate:.0f} trajectories/s, '
+            f'scan {scan_rate:.0f} trajectories/s, '
+            f'read_field {field_time:.3f} s'
+        )
+
+
+def test_column_store_benchmark(tmp_path: Path):
+    # Repeated analysis passes over a NetCDF store and the same data in a
+    # column store.
+
+    ntrajs = 5000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(200 + i % 100, i) for i in range(ntrajs))
+    columns_path = tmp_path / 'test.aeic-columns'
+    tstart = datetime.now()
+    with TrajectoryStore.open(base_file=path) as ts:
+        ts.export(columns_path)
+    print(f'export: {(datetime.now() - tstart).total_seconds():.2f} s')
+
+    for p in (path, columns_path):
+        with TrajectoryStore.open(base_file=p) as ts:
+            tstart = datetime.now()
+            for _ in range(5):
+                total = float(ts.read_field('altitude').values.sum())
+            field_time = (datetime.now() - tstart).total_seconds() / 5
+        with TrajectoryStore.open(base_file=p, cache_size_mb=1) as ts:
+            tstart = datetime.now()
+            for _ in ts:
+                pass
+            scan_rate = ntrajs / (datetime.now() - tstart).total_seconds()
+        print(
+            f'{p.name}: read_field {field_time:.4f} s (sum {total:.3g}), '
+            f'scan {scan_rate:.0f} trajectories/s'
+        )
+
+
+def test_field_projection_benchmark(tmp_path: Path):
+    # Compare full scans of a store with emissions-like data with scans
+    # reading only the base field set and only per-trajectory totals.
+
+    ntrajs = 2000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        trajs = []
+        for i in range(ntrajs):
+            t = make_test_trajectory(200, i)
+            t.add_fields(ComplexExtras.random(200))
+            trajs.append(t)
+        ts.add_many(trajs)
+
+    for kwargs in ({}, {'fieldsets': ['base']}, {'fields': ['tot']}):
+        with TrajectoryStore.open(base_file=path, **kwargs) as ts:
+            tstart = datetime.now()
+            nbytes = sum(t.nbytes for t in ts)
+            elapsed = (datetime.now() - tstart).total_seconds()
+        print(
+            f'{kwargs or "all fields"}: {ntrajs / elapsed:.0f} trajectories/s, '
+            f'{nbytes / 1e6:.1f} MB of data'
+        )
+
+
+def test_lazy_trajectories_benchmark(tmp_path: Path):
+    # Compare eager and lazy trajectories for a pass over a store that uses
+    # only a few fields of each trajectory.
+
+    ntrajs = 2000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        trajs = []
+        for i in range(ntrajs):
+            t = make_test_trajectory(200, i)
+            t.add_fields(ComplexExtras.random(200))
+            trajs.append(t)
+        ts.add_many(trajs)
+
+    for lazy in (False, True):
+        with TrajectoryStore.open(base_file=path, lazy=lazy) as ts:
+            tstart = datetime.now()
+            for i in range(ntrajs):
+                t = ts[i]
+                _ = t.altitude.max() + t.fuel_flow.sum() + t.tot[Species.CO2]
+            elapsed = (datetime.now() - tstart).total_seconds()
+            print(
+                f'lazy={lazy}: {ntrajs / elapsed:.0f} trajectories/s, '
+                f'cache {ts.cache_stats.currsize / 1e6:.1f} MB'
+            )
+
+
+def test_aggregate_benchmark(tmp_path: Path):
+    # Compare store-wide statistics computed by `aggregate` on a merged store
+    # with computing them from trajectories.
+
+    ntrajs = 50000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(2, i) for i in range(ntrajs))
+    merged = tmp_path / 'test.aeic-store'
+    with TrajectoryStore.open(base_file=path) as ts:
+        ts.export(merged, shard_size=10000)
+    types = {i: f'type{i % 200}' for i in range(ntrajs)}
+
+    with TrajectoryStore.open(base_file=merged) as ts:
+        tstart = datetime.now()
+        ts.aggregate(
+            ['starting_mass', 'total_fuel_mass'],
+            stats=['sum', 'mean', 'max'],
+            quantiles=[0.5],
+            by=types,
+        )
+        fast = (datetime.now() - tstart).total_seconds()
+
+    with TrajectoryStore.open(base_file=merged) as ts:
+        tstart = datetime.now()
+        sums: dict[str, float] = {}
+        for t in ts:
+            key = types[t.flight_id]
+            sums[key] = sums.get(key, 0.0) + t.total_fuel_mass
+        slow = (datetime.now() - tstart).total_seconds()
+
+    print(f'aggregate: {fast:.3f} s, trajectory loop: {slow:.3f} s')
+
+
+def test_map_reduce_benchmark(tmp_path: Path):
+    # Compare serial and parallel map/reduce over a merged store.
+
+    ntrajs = 20000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(100, i) for i in range(ntrajs))
+    merged = tmp_path / 'test.aeic-store'
+    with TrajectoryStore.open(base_file=path) as ts:
+        ts.export(merged, shard_size=ntrajs // 8)
+
+    for n_workers in (None, 2, 4):
+        tstart = datetime.now()
+        TrajectoryStore.map_reduce(
+            merged, total_fuel, operator.add, n_workers=n_workers
+        )
+        elapsed = (datetime.now() - tstart).total_seconds()
+        print(f'n_workers={n_workers}: {ntrajs / elapsed:.0f} trajectories/s')
+
+
+def test_subset_benchmark(tmp_path: Path):
+    # Compare extracting a subset of a store by block copying with reading
+    # the trajectories and adding them to a new store.
+
+    ntrajs = 20000
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path) as ts:
+        ts.add_many(make_test_trajectory(100, i) for i in range(ntrajs))
+
+    with TrajectoryStore.open(base_file=path) as ts:
+        tstart = datetime.now()
+        n = ts.subset(tmp_path / 'subset.nc', where=lambda f: f['flight_id'] % 4 == 0)
+        elapsed = (datetime.now() - tstart).total_seconds()
+        print(f'subset: {n} trajectories in {elapsed:.3f} s')
+
+        tstart = datetime.now()
+        with TrajectoryStore.create(base_file=tmp_path / 'roundtrip.nc') as out:
+            out.add_many(t for t in ts if t.flight_id % 4 == 0)
+        elapsed = (datetime.now() - tstart).total_seconds()
+        print(f'round trip: {n} trajectories in {elapsed:.3f} s')
+
+
+def test_write_behind_benchmark(tmp_path: Path):
+    # Compare creating a store with simulated CPU-bound work between adds,
+    # with and without a writer thread.
+
+    ntrajs = 2000
+    trajs = [make_test_trajectory(200, i) for i in range(ntrajs)]
+
+    def simulate():
+        x = np.random.rand(200, 200)
+        for _ in range(5):
+            x = x @ x
+            x /= x.max()
+
+    for write_behind in (False, True):
+        tstart = datetime.now()
+        with TrajectoryStore.create(
+            base_file=tmp_path / f'test_{write_behind}.nc',
+            write_behind=write_behind,
+            write_buffer_size=64,
+            storage_policy='archive',
+        ) as ts:
+            for t in trajs:
+                simulate()
+                ts.add(t)
+        elapsed = (datetime.now() - tstart).total_seconds()
+        print(f'write_behind={write_behind}: {ntrajs / elapsed:.0f} trajectories/s')
+
+
+def test_checkpointing_benchmark(tmp_path: Path):
+    # Cost of committing a store at different intervals while writing it.
+
+    ntrajs = 5000
+    trajs = [make_test_trajectory(100, i) for i in range(ntrajs)]
+    for every in (None, 1000, 100):
+        tstart = datetime.now()
+        with TrajectoryStore.create(
+            base_file=tmp_path / f'test_{every}.nc',
+            write_buffer_size=50,
+            checkpoint_every=every,
+        ) as ts:
+            for t in trajs:
+                ts.add(t)
+        elapsed = (datetime.now() - tstart).total_seconds()
+        print(f'checkpoint_every={every}: {ntrajs / elapsed:.0f} trajectories/s')
+
+
+def test_create_sharded_benchmark(tmp_path: Path):
+    # Compare writing slice files and merging them with writing a sharded
+    # merged store directly.
+
+    ntrajs = 20000
+    trajs = [make_test_trajectory(100, i) for i in range(ntrajs)]
+
+    tstart = datetime.now()
+    paths = []
+    for k in range(4):
+        paths.append(tmp_path / f'slice_{k}.nc')
+        with TrajectoryStore.create(base_file=paths[-1]) as ts:
+            ts.add_many(trajs[k * ntrajs // 4 : (k + 1) * ntrajs // 4])
+    twrite = (datetime.now() - tstart).total_seconds()
+    tstart = datetime.now()
+    TrajectoryStore.merge(
+        output_store=tmp_path / 'merged.aeic-store', input_stores=paths
+    )
+    tmerge = (datetime.now() - tstart).total_seconds()
+    print(f'slices + merge: {twrite:.2f} s + {tmerge:.2f} s')
+
+    tstart = datetime.now()
+    with TrajectoryStore.create_sharded(
+        tmp_path / 'sharded.aeic-store', max_trajectories_per_shard=ntrajs // 4
+    ) as writer:
+        writer.add_many(trajs)
+    print(f'create_sharded: {(datetime.now() - tstart).total_seconds():.2f} s')
+
+
+def test_compact_benchmark(tmp_path: Path):
+    # Time compacting a store written in shuffled flight ID order, then
+    # compare reading a range of flight IDs from the original and compacted
+    # stores.
+
+    ntrajs = 20000
+    ids = np.random.permutation(ntrajs)
+    path = tmp_path / 'test.nc'
+    with TrajectoryStore.create(base_file=path, layout='ragged') as ts:
+        ts.add_many(make_test_trajectory(100, int(i)) for i in ids)
+
+    for n_workers in (1, 4):
+        output = tmp_path / f'compact_{n_workers}.aeic-store'
+        with TrajectoryStore.open(base_file=path) as ts:
+            tstart = datetime.now()
+            ts.compact(output, shard_size=ntrajs // 4, n_workers=n_workers)
+            elapsed = (datetime.now() - tstart).total_seconds()
+        print(f'compact, {n_workers} workers: {elapsed:.2f} s')
+
+    wanted = np.arange(5000, 7000)
+    for p in (path, tmp_path / 'compact_1.aeic-store'):
+        with TrajectoryStore.open(base_file=p) as ts:
+            tstart = datetime.now()
+            ts.read_field('altitude', ts.flight_indices(wanted))
+            elapsed = (datetime.now() - tstart).total_seconds()
+        print(f'{p.name}: range read in {elapsed:.3f} s')
+
+
+def test_merged_store_open_files_benchmark(tmp_path: Path):
+    # Time opening a merged store with 10000 files, reading one trajectory
+    # from it, and reading a field from all of the files.
+
+    nfiles = 10000
+    store_dir = tmp_path / 'many.aeic-store'
+    with TrajectoryStore.create_sharded(
+        store_dir, max_trajectories_per_shard=1
+    ) as writer:
+        writer.add_many(make_test_trajectory(20, i) for i in range(nfiles))
+
+    tstart = datetime.now()
+    with TrajectoryStore.open(base_file=store_dir) as ts:
+        print(f'open: {(datetime.now() - tstart).total_seconds() * 1000:.1f} ms')
+        tstart = datetime.now()
+        ts.get_flight(1234)
+        elapsed = (datetime.now() - tstart).total_seconds() * 1000
+        print(f'first lookup: {elapsed:.1f} ms')
+        tstart = datetime.now()
+        ts.read_field('flight_id')
+        elapsed = (datetime.now() - tstart).total_seconds()
+        print(f'read field from all files: {elapsed:.2f} s')
+
+
+def test_species_block_io_benchmark(tmp_path: Path):
+    # Compare writing and reading per-species per-thrust mode values one
+    # element at a time with one NetCDF call per block of trajectories.
+    from AEIC.trajectories.store import _decode_rows, _encode_rows
+
+    ntrajs = 2000
+    species = list(Species)
+    field = ComplexExtras.FIELD_SETS[0]['tm2']
+    vals = [
+        SpeciesValues(
+            {sp: ThrustModeValues(*np.random.rand(4).tolist()) for sp in species}
+        )
+        for _ in range(ntrajs)
+    ]
+
+    with nc4.Dataset(tmp_path / 'bench.nc', 'w') as ds:
+        ds.createDimension('trajectory', None)
+        ds.createDimension('species', len(species))
+        ds.createDimension('thrust_mode', len(ThrustMode))
+        dims = ('trajectory', 'species', 'thrust_mode')
+        var1 = ds.createVariable('elements', np.float64, dims)
+        var2 = ds.createVariable('blocks', np.float64, dims)
+
+        tstart = datetime.now()
+        for i, val in enumerate(vals):
+            for si, sp in enumerate(species):
+                for ti, tm in enumerate(ThrustMode):
+                    var1[i, si, ti] = val[sp][tm]
+        write_elements = (datetime.now() - tstart).total_seconds()
+
+        tstart = datetime.now()
+        for start in range(0, ntrajs, 256):
+            block = vals[start : start + 256]
+            var2[start : start + len(block)] = _encode_rows(
+                block, field, 'tm2', species, var2.get_fill_value()
+            )
+        write_blocks = (datetime.now() - tstart).total_seconds()
+
+        tstart = datetime.now()
+        read1 = [
+            SpeciesValues(
+                {
+                    sp: ThrustModeValues(
+                        {tm: var1[i, si, ti] for ti, tm in enumerate(ThrustMode)}
+                    )
+                    for si, sp in enumerate(species)
+                }
+            )
+            for i in range(ntrajs)
+        ]
+        read_elements = (datetime.now() - tstart).total_seconds()
+
+        tstart = datetime.now()
+        read2 = _decode_rows(var2.get_fill_value(), var2[:], field, 'tm2', species)
+        read_blocks = (datetime.now() - tstart).total_seconds()
+
+    assert read1 == read2 == vals
+    print(
+        f'write: {write_elements:.2f} s element by element, '
+        f'{write_blocks:.3f} s in blocks'
+    )
+    print(f'read: {read_elements:.2f} s element by element, {read_blocks:.3f} s')